@@ -3,69 +3,179 @@ from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
-from passlib.context import CryptContext
-from pydantic import BaseModel
-import psycopg2
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, PlainTextResponse
 from db import (
     init_db, get_all_users, create_user, delete_user, 
     reset_password, authenticate_user, is_admin_user, 
-    get_db_connection, return_db_connection
+    get_db_connection, return_db_connection, close_connection_pool,
+    warm_connection_pool, check_db_connection,
+    get_read_connection, get_replica_status, invalidate_users
 )
-from db import connection_pool
+from ingest import insert_findings
+from trends import get_trend_series, catch_up_trends, TREND_CATCHUP_INTERVAL
+from host_summary import get_host_ranking, get_host_detail, SORT_COLUMNS
+from correlation import get_correlation, get_shared_columns, CORRELATION_MAX_ROWS
+from models import PiiRecord, normalize_record
+from compression import DecompressionMiddleware, get_ingest_stats
+from msgpack_ingest import MSGPACK_CONTENT_TYPES, MSGPACK_SCHEMA, decode_batch
+from sketches import flush_sketches, SKETCH_FLUSH_INTERVAL
+from analytics import use_approximate, get_type_stats, count_findings
+from logging_config import configure_logging, shutdown_logging, annotate, RequestLogMiddleware
+from tracing import TracingMiddleware, shutdown_tracing, span
+from admission import AdmissionMiddleware, get_admission_stats
+from sync import get_host_digests, apply_sync
+from alerts import (
+    flush_alerts, load_rules, get_rules, create_rule, delete_rule, get_alerts, invalidate_rules,
+    ALERT_FLUSH_INTERVAL
+)
+from dimensions import (
+    distinct_hostnames, distinct_sources, migrate_legacy, DIMENSION_MIGRATE_INTERVAL
+)
+from archive import find_findings, export_findings, archive_old_findings, ARCHIVE_INTERVAL
+from columnar import (
+    get_columnar_cache, refresh_columnar_cache, get_columnar_stats, invalidate_columnar,
+    COLUMNAR_REFRESH_INTERVAL
+)
+from invalidation import start_listener, stop_listener, get_invalidation_stats
+from profiling import (
+    profile_stacks, start_tracemalloc, stop_tracemalloc, tracemalloc_status, take_snapshot, diff_snapshots
+)
+from topk import flush_topk, get_top_k, exact_top_k, TOPK_DIMENSIONS, TOPK_FLUSH_INTERVAL
 
 from typing import List
 from contextlib import asynccontextmanager
 
-class PiiRecord(BaseModel):
-    hostname: str
-    source: str
-    column_name: str
-    detected: List[str]
 from datetime import datetime
+from urllib.parse import quote
 import os
 import csv
 import io
-import pandas as pd
+import json
 import logging
 import time
+import asyncio
+from starlette.concurrency import run_in_threadpool
 
-logging.basicConfig(level=logging.INFO)
+configure_logging()
 logger = logging.getLogger(__name__)
 
+# FAST_START=1 serves requests immediately and initialises the database in
+# the background; /readyz reports 503 until that has finished.
+FAST_START = os.getenv("FAST_START", "0").lower() in ("1", "true", "yes")
+DB_INIT_RETRIES = int(os.getenv("DB_INIT_RETRIES", "5"))
+
+def with_primary_connection(fn):
+    conn = get_db_connection()
+    try:
+        return fn(conn)
+    finally:
+        return_db_connection(conn)
+
+async def run_periodically(app: FastAPI, name: str, interval: int, fn):
+    """Run fn(conn) on a primary connection every `interval` seconds."""
+    while True:
+        # Start after the first interval so jobs never compete with startup
+        await asyncio.sleep(interval)
+        if not app.state.db_ready:
+            continue
+        try:
+            await run_in_threadpool(with_primary_connection, fn)
+        except Exception as e:
+            logger.error(f"{name} failed: {str(e)}")
+
+# (name, interval seconds, job) run in the background of every worker
+BACKGROUND_JOBS = [
+    # Rebuild recent trend buckets to absorb late-arriving rows
+    ("Trend catch-up", TREND_CATCHUP_INTERVAL, catch_up_trends),
+    # Persist in-memory state accumulated by ingest
+    ("Sketch flush", SKETCH_FLUSH_INTERVAL, flush_sketches),
+    ("Top-K flush", TOPK_FLUSH_INTERVAL, flush_topk),
+    # Write alert hits and shared rate counters; reloads rules
+    ("Alert flush", ALERT_FLUSH_INTERVAL, flush_alerts),
+    # Tail new findings into the in-memory columnar cache
+    ("Columnar cache refresh", COLUMNAR_REFRESH_INTERVAL, refresh_columnar_cache),
+    # Move pre-dimension rows out of pii_results_legacy; a no-op once it is gone
+    ("Dimension migration", DIMENSION_MIGRATE_INTERVAL, migrate_legacy),
+]
+if ARCHIVE_INTERVAL:
+    # Move findings past ARCHIVE_AFTER_DAYS to Parquet; one worker at a time
+    BACKGROUND_JOBS.append(("Archive", ARCHIVE_INTERVAL, archive_old_findings))
+# Jobs that must run once more on shutdown so no ingested state is lost
+SHUTDOWN_FLUSHES = [
+    ("Sketch flush", flush_sketches), ("Top-K flush", flush_topk), ("Alert flush", flush_alerts),
+]
+# (table, handler) for change notifications from other workers; see invalidation.py
+INVALIDATION_HANDLERS = [
+    ("pii_results", invalidate_columnar),
+    ("users", invalidate_users),
+    ("alert_rules", invalidate_rules),
+]
+
+async def initialize_database(app: FastAPI):
+    """Run init_db() off the event loop, retrying with exponential backoff."""
+    started = time.perf_counter()
+    for attempt in range(1, DB_INIT_RETRIES + 1):
+        try:
+            await run_in_threadpool(init_db)
+            await run_in_threadpool(warm_connection_pool)
+            # Evaluate alert rules from the first ingested batch on
+            await run_in_threadpool(with_primary_connection, load_rules)
+            start_listener(INVALIDATION_HANDLERS)
+            app.state.db_ready = True
+            logger.info(f"Database initialized successfully in {time.perf_counter() - started:.2f}s")
+            # Load the columnar cache now rather than after the first refresh interval
+            app.state.cache_preload = asyncio.create_task(preload_columnar_cache())
+            return True
+        except Exception as e:
+            if attempt == DB_INIT_RETRIES:
+                logger.error(f"Failed to initialize database after {DB_INIT_RETRIES} attempts: {str(e)}")
+                return False
+            logger.warning(f"Database initialization attempt {attempt} failed, retrying...")
+            await asyncio.sleep(2 ** attempt)  # Exponential backoff
+
+async def preload_columnar_cache():
+    try:
+        await run_in_threadpool(with_primary_connection, refresh_columnar_cache)
+    except Exception as e:
+        logger.error(f"Columnar cache load failed: {str(e)}")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup event
     logger.info("Starting up application")
-    try:
-        # Wait for database to be ready
-        max_retries = 5
-        retry_count = 0
-        while retry_count < max_retries:
-            try:
-                init_db()
-                logger.info("Database initialized successfully")
-                break
-            except Exception as e:
-                retry_count += 1
-                if retry_count == max_retries:
-                    logger.error(f"Failed to initialize database after {max_retries} attempts: {str(e)}")
-                    raise
-                logger.warning(f"Database initialization attempt {retry_count} failed, retrying...")
-                time.sleep(2 ** retry_count)  # Exponential backoff
-    except Exception as e:
-        logger.error(f"Failed to initialize database: {str(e)}")
-        # Don't raise the exception, just log it
-        pass
-    
+    app.state.db_ready = False
+    if FAST_START:
+        logger.info("Fast start enabled, initializing database in the background")
+        init_task = asyncio.create_task(initialize_database(app))
+    else:
+        # Failures are logged, not raised, so the app still comes up
+        init_task = None
+        await initialize_database(app)
+
+    jobs = [
+        asyncio.create_task(run_periodically(app, name, interval, fn))
+        for name, interval, fn in BACKGROUND_JOBS
+    ]
+
     yield
-    
+
     # Shutdown event
     logger.info("Shutting down application")
+    for job in jobs:
+        job.cancel()
+    if app.state.db_ready:
+        for name, fn in SHUTDOWN_FLUSHES:
+            try:
+                await run_in_threadpool(with_primary_connection, fn)
+            except Exception as e:
+                logger.error(f"Final {name.lower()} failed: {str(e)}")
+    if init_task is not None:
+        init_task.cancel()
+    await run_in_threadpool(stop_listener)
     # Clean up any remaining connections
-    if 'connection_pool' in globals():
-        connection_pool.closeall()
+    close_connection_pool()
+    shutdown_tracing()
+    shutdown_logging()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -79,13 +189,50 @@ app.add_middleware(
 )
 
 app.add_middleware(SessionMiddleware, secret_key="super-secret-key")
+
+# gzip/zstd request bodies on the ingest routes
+app.add_middleware(DecompressionMiddleware, paths=("/upload", "/sync"))
+
+# Per-route-class concurrency limits; sheds with 503 before any body is read
+app.add_middleware(AdmissionMiddleware)
+
+# Root span per sampled request, inside the access log so its DB totals
+# land on the request record
+app.add_middleware(TracingMiddleware)
+
+# One sampled summary record per request; added last so it wraps everything
+app.add_middleware(RequestLogMiddleware)
 API_KEY = os.getenv("API_KEY", "supersecretkey123")
 
 from fastapi.staticfiles import StaticFiles
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+class TracedTemplates(Jinja2Templates):
+    def TemplateResponse(self, *args, **kwargs):
+        name = kwargs.get("name") or next((a for a in args if isinstance(a, str)), None)
+        with span("template.render", template=name):
+            return super().TemplateResponse(*args, **kwargs)
+
 # templates directory
-templates = Jinja2Templates(directory="templates")
+templates = TracedTemplates(directory="templates")
+
+# -----------------------------
+# Routes: Health
+# -----------------------------
+@app.get("/healthz")
+def liveness():
+    """Process is up; never touches the database."""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readiness(request: Request):
+    """Database initialised and reachable."""
+    if not request.app.state.db_ready:
+        return JSONResponse({"status": "starting"}, status_code=503)
+    if not await run_in_threadpool(check_db_connection):
+        return JSONResponse({"status": "database unavailable"}, status_code=503)
+    # An unhealthy replica is not fatal: reads fall back to the primary
+    return {"status": "ready", "replica": get_replica_status()}
 
 # -----------------------------
 # Routes: Auth
@@ -112,58 +259,82 @@ def logout(request: Request):
 # ------------------------------
 @app.get("/", response_class=HTMLResponse)
 
-def dashboard(request: Request, hostname: str = None, source: str = None):
+def dashboard(request: Request, hostname: str = None, source: str = None, approx: bool = None):
     try:
-        logger.info("Dashboard route accessed")
-        
         if not request.session.get("user"):
-            logger.info("No user in session, redirecting to login")
+            annotate(redirect="login")
             return RedirectResponse("/login")
 
-        logger.info(f"User in session: {request.session.get('user')}")
+        annotate(user=request.session.get("user"))
 
         conn = None
         try:
-            conn = get_db_connection()
+            conn = get_read_connection()
             cur = conn.cursor()
             
+            approximate = use_approximate(approx)
+            cache = None if approximate else get_columnar_cache()
+            annotate(columnar=cache is not None)
+
             # fetch unique hostnames and sources
-            cur.execute("SELECT DISTINCT hostname FROM pii_results WHERE hostname IS NOT NULL")
-            hostnames = [row[0] for row in cur.fetchall()]
-            logger.info(f"Found {len(hostnames)} unique hostnames")
-
-            cur.execute("SELECT DISTINCT source FROM pii_results WHERE source IS NOT NULL")
-            sources = [row[0] for row in cur.fetchall()]
-            logger.info(f"Found {len(sources)} unique sources")
-
-            # build query based on filters
-            query = "SELECT * FROM pii_results WHERE 1=1"
-            params = []
-            if hostname:
-                query += " AND hostname = %s"
-                params.append(hostname)
-            if source:
-                query += " AND source = %s"
-                params.append(source)
-
-            logger.info(f"Executing query: {query} with params: {params}")
-            cur.execute(query, params)
-            filtered_rows = cur.fetchall()
-            logger.info(f"Found {len(filtered_rows)} rows matching filters")
-
-            # prepare chart data
-            cur.execute("SELECT detected, COUNT(*) FROM pii_results GROUP BY detected")
-            chart_results = cur.fetchall() or []
-            logger.info(f"Found {len(chart_results)} unique detection types")
+            if cache is not None:
+                hostnames = cache.hostnames()
+                sources = cache.sources()
+            else:
+                if approximate:
+                    # The host summary tables are far smaller than pii_results
+                    cur.execute("SELECT hostname FROM host_summary WHERE hostname <> '' ORDER BY hostname")
+                    hostnames = [row[0] for row in cur.fetchall()]
+                    cur.execute("SELECT DISTINCT source FROM host_sources")
+                    sources = [row[0] for row in cur.fetchall()]
+                else:
+                    # Probes the dimension tables instead of scanning every finding
+                    hostnames = distinct_hostnames(cur)
+                    sources = distinct_sources(cur)
+            annotate(hostnames=len(hostnames), sources=len(sources), approximate=approximate)
+
+            match_count = None
+            type_stats = None
+            if cache is not None:
+                annotate(matching_rows=cache.count_matching(hostname, source))
+                chart_results = cache.detected_counts()
+            elif approximate:
+                if hostname or source:
+                    # Same exact-match filter as the exact and cached paths
+                    match_count = count_findings(conn, True, hostname=hostname, source=source,
+                                                 source_prefix=False)
+                    annotate(matching_rows=match_count["count"])
+
+                cur.execute("SELECT detected, SUM(count) FROM pii_trend_daily GROUP BY detected")
+                chart_results = cur.fetchall() or []
+                type_stats = get_type_stats(conn, True)
+            else:
+                # build query based on filters
+                query = "SELECT * FROM pii_results WHERE 1=1"
+                params = []
+                if hostname:
+                    query += " AND hostname = %s"
+                    params.append(hostname)
+                if source:
+                    query += " AND source = %s"
+                    params.append(source)
+
+                logger.debug("Executing query: %s with params: %s", query, params)
+                cur.execute(query, params)
+                filtered_rows = cur.fetchall()
+                annotate(matching_rows=len(filtered_rows))
+
+                # prepare chart data
+                cur.execute("SELECT detected, COUNT(*) FROM pii_results GROUP BY detected")
+                chart_results = cur.fetchall() or []
+            annotate(detection_types=len(chart_results))
             
             chart_data = {
                 "labels": [r[0] if r[0] is not None else "Unknown" for r in chart_results],
-                "counts": [r[1] for r in chart_results]
+                "counts": [int(r[1]) for r in chart_results]
             }
             
-            logger.info("Getting dashboard data...")
             rows, pii_counts, host_counts = get_dashboard_data(conn)
-            logger.info("Dashboard data retrieved successfully")
 
             result = templates.TemplateResponse("dashboard.html", {
                 "request": request,
@@ -175,24 +346,26 @@ def dashboard(request: Request, hostname: str = None, source: str = None):
                 "chart_data": chart_data,
                 "pii_type_data": pii_counts,
                 "pii_host_data": host_counts,
-                "filter": None
+                "filter": None,
+                "approximate": approximate,
+                "match_count": match_count,
+                "type_stats": type_stats
             })
 
             return result
 
         except Exception as db_error:
-            logger.error(f"Database error in dashboard: {str(db_error)}")
+            logger.error("Database error in dashboard: %s", db_error)
             raise
         finally:
             if conn:
                 try:
                     return_db_connection(conn)
-                    logger.info("Database connection returned to pool")
                 except Exception as close_error:
-                    logger.error(f"Error returning connection to pool: {str(close_error)}")
+                    logger.error("Error returning connection to pool: %s", close_error)
 
     except Exception as e:
-        logger.error(f"Unhandled error in dashboard: {str(e)}")
+        logger.error("Unhandled error in dashboard: %s", e)
         return templates.TemplateResponse("error.html", {
             "request": request,
             "error_message": "An error occurred while loading the dashboard. Please try again later."
@@ -201,55 +374,60 @@ def dashboard(request: Request, hostname: str = None, source: str = None):
 
 def get_dashboard_data(connection, pii_filter: str = None):
     """Prepare rows and chart data, with optional PII filter."""
-    logger.info(f"Getting dashboard data with filter: {pii_filter}")
+    annotate(pii_filter=pii_filter)
+    cache = get_columnar_cache()
     cur = connection.cursor()
     
     try:
-        if pii_filter:
-            # Filtered rows
-            cur.execute("""
-                SELECT hostname, source, column_name, detected, timestamp 
-                FROM pii_results 
-                WHERE detected LIKE %s 
-                ORDER BY timestamp DESC LIMIT 100
-            """, (f"%{pii_filter}%",))
-        else:
-            # All rows
-            cur.execute("""
-                SELECT hostname, source, column_name, detected, timestamp 
-                FROM pii_results 
-                ORDER BY timestamp DESC LIMIT 100
-            """)
-        
-        rows = cur.fetchall()
-        logger.info(f"Retrieved {len(rows)} rows")
+        # The cache answers unless older, aggregated-only rows could qualify
+        rows = cache.latest_rows(pii_filter, 100) if cache is not None else None
+        annotate(rows_cached=rows is not None)
+        if rows is None:
+            if pii_filter:
+                # Filtered rows
+                cur.execute("""
+                    SELECT hostname, source, column_name, detected, timestamp 
+                    FROM pii_results 
+                    WHERE detected LIKE %s 
+                    ORDER BY timestamp DESC LIMIT 100
+                """, (f"%{pii_filter}%",))
+            else:
+                # All rows
+                cur.execute("""
+                    SELECT hostname, source, column_name, detected, timestamp 
+                    FROM pii_results 
+                    ORDER BY timestamp DESC LIMIT 100
+                """)
+            rows = cur.fetchall()
+        annotate(rows=len(rows))
 
         # Initialize counts
         pii_counts = {"aadhaar": 0, "pan": 0, "email": 0, "phone": 0, "credit_card": 0}
         host_counts = {}
 
         # Process the same rows for both PII counts and host counts
-        for row in rows:
-            hostname, _, _, detected, _ = row
-            
-            # Count PII types
-            if detected:
-                detected_lower = detected.lower()
-                for pii in pii_counts:
-                    if pii in detected_lower:
-                        pii_counts[pii] += 1
-
-            # Count by hostname
-            if hostname:
-                host_counts[hostname] = host_counts.get(hostname, 0) + 1
-
-        logger.info(f"PII counts: {pii_counts}")
-        logger.info(f"Host counts: {dict(sorted(host_counts.items()))}")
+        with span("dashboard.aggregate", rows=len(rows)):
+            for row in rows:
+                hostname, _, _, detected, _ = row
+
+                # Count PII types
+                if detected:
+                    detected_lower = detected.lower()
+                    for pii in pii_counts:
+                        if pii in detected_lower:
+                            pii_counts[pii] += 1
+
+                # Count by hostname
+                if hostname:
+                    host_counts[hostname] = host_counts.get(hostname, 0) + 1
+
+        annotate(pii_counts=pii_counts, chart_hosts=len(host_counts))
+        logger.debug("Host counts: %s", host_counts)
         
         return rows, pii_counts, host_counts
         
     except Exception as e:
-        logger.error(f"Error in get_dashboard_data: {str(e)}")
+        logger.error("Error in get_dashboard_data: %s", e)
         # Return empty data instead of raising
         return [], {"aadhaar": 0, "pan": 0, "email": 0, "phone": 0, "credit_card": 0}, {}
 
@@ -266,10 +444,11 @@ def filter_by_type(request: Request, pii_type: str):
     if not request.session.get("user"):
         return RedirectResponse("/login")
     
-    conn = get_db_connection()
+    conn = get_read_connection()
     try:
         rows, pii_counts, host_counts = get_dashboard_data(conn, pii_filter=pii_type)
-        conn.close()
+        return_db_connection(conn)
+        conn = None
         return templates.TemplateResponse("dashboard.html", {
             "request": request,
             "rows": rows,
@@ -279,36 +458,623 @@ def filter_by_type(request: Request, pii_type: str):
         })
     except Exception as e:
         if conn:
-            conn.close()
+            return_db_connection(conn)
         print(f"Error in filter_by_type: {str(e)}")
         raise
 
 
+@app.get("/api/cache/stats")
+def cache_stats(request: Request):
+    """State of this worker's columnar cache and invalidation listener."""
+    if not request.session.get("user"):
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    return {"columnar": get_columnar_stats(), "invalidation": get_invalidation_stats()}
+
+
+@app.get("/api/trends")
+def trends(request: Request, granularity: str = "day", days: int = 90,
+           hostname: str = None, detected: str = None):
+    if not request.session.get("user"):
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    if granularity not in ("hour", "day"):
+        return JSONResponse({"error": "granularity must be 'hour' or 'day'"}, status_code=400)
+    if days < 1 or days > 366 * 7:
+        return JSONResponse({"error": "days out of range"}, status_code=400)
+
+    conn = get_read_connection()
+    try:
+        return get_trend_series(conn, granularity, days, hostname, detected)
+    except Exception as e:
+        logger.error("Error fetching trends: %s", e)
+        return JSONResponse({"error": str(e)}, status_code=500)
+    finally:
+        return_db_connection(conn)
+
+
+@app.get("/api/stats")
+def type_stats_api(request: Request, approx: bool = None, days: int = None):
+    if not request.session.get("user"):
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+
+    conn = get_read_connection()
+    try:
+        return get_type_stats(conn, use_approximate(approx), days)
+    except Exception as e:
+        logger.error("Error fetching stats: %s", e)
+        return JSONResponse({"error": str(e)}, status_code=500)
+    finally:
+        return_db_connection(conn)
+
+
+@app.get("/api/count")
+def count_api(request: Request, hostname: str = None, source: str = None,
+              detected: str = None, approx: bool = None):
+    """Findings matching the filters; `source` is a prefix match."""
+    if not request.session.get("user"):
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+
+    conn = get_read_connection()
+    try:
+        return count_findings(conn, use_approximate(approx), hostname, source, detected)
+    except Exception as e:
+        logger.error("Error counting findings: %s", e)
+        return JSONResponse({"error": str(e)}, status_code=500)
+    finally:
+        return_db_connection(conn)
+
+
+@app.get("/api/topk")
+def top_k_api(request: Request, dimension: str = "host", k: int = 20, exact: bool = False):
+    """Heavy hitters by findings; `exact=1` recomputes with a full GROUP BY."""
+    if not request.session.get("user"):
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    if dimension not in TOPK_DIMENSIONS:
+        return JSONResponse({"error": f"dimension must be one of {list(TOPK_DIMENSIONS)}"}, status_code=400)
+    k = min(max(k, 1), 100)
+
+    if not exact:
+        return {"dimension": dimension, "exact": False, "items": get_top_k(dimension, k)}
+
+    conn = get_read_connection()
+    try:
+        return {"dimension": dimension, "exact": True, "items": exact_top_k(conn, dimension, k)}
+    except Exception as e:
+        logger.error("Error computing exact top-k: %s", e)
+        return JSONResponse({"error": str(e)}, status_code=500)
+    finally:
+        return_db_connection(conn)
+
+
+# ------------------------------
+# Findings across hot and archived data
+# ------------------------------
+@app.get("/api/findings")
+def findings_api(request: Request, since: datetime = None, until: datetime = None,
+                 hostname: str = None, detected: str = None, limit: int = 1000):
+    """Newest findings in [since, until); archived Parquet files are read when the range reaches them."""
+    if not request.session.get("user"):
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    limit = min(max(limit, 1), 10000)
+
+    conn = get_read_connection()
+    try:
+        rows = find_findings(conn, since, until, hostname, detected, limit)
+    except Exception as e:
+        logger.error("Error fetching findings: %s", e)
+        return JSONResponse({"error": str(e)}, status_code=500)
+    finally:
+        return_db_connection(conn)
+    annotate(archived_rows=sum(1 for r in rows if r[5] == "archive"))
+    return {"findings": [
+        {"hostname": h, "source": src, "column_name": col, "detected": det,
+         "timestamp": ts.isoformat() if ts else None, "tier": tier}
+        for h, src, col, det, ts, tier in rows
+    ]}
+
+
+@app.get("/api/export")
+def export_api(request: Request, since: datetime = None, until: datetime = None,
+               hostname: str = None, detected: str = None):
+    """All matching findings as CSV, archived rows first."""
+    if not request.session.get("user"):
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+
+    def generate():
+        conn = get_read_connection()
+        try:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(["hostname", "source", "column_name", "detected", "timestamp"])
+            for i, row in enumerate(export_findings(conn, since, until, hostname, detected), 1):
+                writer.writerow(row)
+                if i % 1000 == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+        finally:
+            conn.rollback()
+            return_db_connection(conn)
+
+    return StreamingResponse(generate(), media_type="text/csv",
+                             headers={"Content-Disposition": "attachment; filename=findings.csv"})
+
+
+# ------------------------------
+# Alerts
+# ------------------------------
+@app.get("/api/alerts")
+def alerts_api(request: Request, since: datetime = None, rule_id: int = None, limit: int = 100):
+    if not request.session.get("user"):
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    limit = min(max(limit, 1), 1000)
+
+    conn = get_read_connection()
+    try:
+        return {"alerts": get_alerts(conn, since, rule_id, limit)}
+    except Exception as e:
+        logger.error("Error fetching alerts: %s", e)
+        return JSONResponse({"error": str(e)}, status_code=500)
+    finally:
+        return_db_connection(conn)
+
+
+@app.get("/api/alerts/rules")
+def alert_rules_api(request: Request):
+    if not request.session.get("user"):
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+
+    conn = get_read_connection()
+    try:
+        return {"rules": get_rules(conn)}
+    except Exception as e:
+        logger.error("Error fetching alert rules: %s", e)
+        return JSONResponse({"error": str(e)}, status_code=500)
+    finally:
+        return_db_connection(conn)
+
+
+@app.post("/api/alerts/rules")
+async def create_alert_rule(request: Request):
+    """Add a rule: {"name", "detected", "host_pattern", "source_prefix", "threshold", "window_seconds", "cooldown_seconds"}."""
+    if request.session.get("role") != "admin":
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    try:
+        data = await request.json()
+        rule_id = await run_in_threadpool(with_primary_connection, lambda conn: create_rule(conn, data))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        logger.error("Error creating alert rule: %s", e)
+        return JSONResponse({"error": str(e)}, status_code=500)
+    return {"status": "success", "id": rule_id}
+
+
+@app.delete("/api/alerts/rules/{rule_id}")
+def delete_alert_rule(request: Request, rule_id: int):
+    if request.session.get("role") != "admin":
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    try:
+        deleted = with_primary_connection(lambda conn: delete_rule(conn, rule_id))
+    except Exception as e:
+        logger.error("Error deleting alert rule: %s", e)
+        return JSONResponse({"error": str(e)}, status_code=500)
+    if not deleted:
+        return JSONResponse({"error": "Rule not found"}, status_code=404)
+    return {"status": "success"}
+
+
+# ------------------------------
+# Host ranking / drill-down
+# ------------------------------
+@app.get("/api/hosts")
+def host_ranking_api(request: Request, sort: str = "risk_score", order: str = "desc",
+                     page: int = 1, page_size: int = 50):
+    if not request.session.get("user"):
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    if sort not in SORT_COLUMNS:
+        return JSONResponse({"error": f"sort must be one of {sorted(SORT_COLUMNS)}"}, status_code=400)
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), 500)
+
+    conn = get_read_connection()
+    try:
+        return get_host_ranking(conn, sort, order, page, page_size)
+    except Exception as e:
+        logger.error("Error fetching host ranking: %s", e)
+        return JSONResponse({"error": str(e)}, status_code=500)
+    finally:
+        return_db_connection(conn)
+
+
+@app.get("/hosts", response_class=HTMLResponse)
+def host_ranking_page(request: Request, sort: str = "risk_score", order: str = "desc",
+                      page: int = 1, page_size: int = 50):
+    if not request.session.get("user"):
+        return RedirectResponse("/login")
+    if sort not in SORT_COLUMNS:
+        sort = "risk_score"
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), 500)
+
+    conn = get_read_connection()
+    try:
+        ranking = get_host_ranking(conn, sort, order, page, page_size)
+    finally:
+        return_db_connection(conn)
+
+    return templates.TemplateResponse("hosts.html", {
+        "request": request,
+        "user": request.session["user"],
+        "role": request.session.get("role"),
+        "ranking": ranking,
+    })
+
+
+@app.get("/hosts/{hostname}", response_class=HTMLResponse)
+def host_detail_page(request: Request, hostname: str):
+    if not request.session.get("user"):
+        return RedirectResponse("/login")
+
+    conn = get_read_connection()
+    try:
+        host = get_host_detail(conn, hostname)
+        shared_columns = get_shared_columns(conn, hostname=hostname, limit=50) if host else []
+    finally:
+        return_db_connection(conn)
+
+    if host is None:
+        return templates.TemplateResponse("error.html", {
+            "request": request,
+            "error_message": f"No findings recorded for host {hostname}."
+        }, status_code=404)
+
+    return templates.TemplateResponse("host.html", {
+        "request": request,
+        "user": request.session["user"],
+        "role": request.session.get("role"),
+        "host": host,
+        "shared_columns": shared_columns,
+    })
+
+
+# ------------------------------
+# Cross-host column correlation
+# ------------------------------
+@app.get("/api/correlation")
+def correlation_api(request: Request, column: str = None, source: str = None, detected: str = None,
+                    limit: int = 1000):
+    if not request.session.get("user"):
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    limit = min(max(limit, 1), CORRELATION_MAX_ROWS)
+
+    conn = get_read_connection()
+    try:
+        return get_correlation(conn, column, source, detected, limit)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        logger.error("Error fetching column correlation: %s", e)
+        return JSONResponse({"error": str(e)}, status_code=500)
+    finally:
+        return_db_connection(conn)
+
+
+@app.get("/api/correlation/columns")
+def shared_columns_api(request: Request, hostname: str = None, detected: str = None,
+                       min_hosts: int = 2, limit: int = 100):
+    if not request.session.get("user"):
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    min_hosts = max(min_hosts, 1)
+    limit = min(max(limit, 1), 1000)
+
+    conn = get_read_connection()
+    try:
+        return {"columns": get_shared_columns(conn, hostname, detected, min_hosts, limit)}
+    except Exception as e:
+        logger.error("Error fetching shared columns: %s", e)
+        return JSONResponse({"error": str(e)}, status_code=500)
+    finally:
+        return_db_connection(conn)
+
+
+@app.get("/columns", response_class=HTMLResponse)
+def shared_columns_page(request: Request, column: str = None, detected: str = None, min_hosts: int = 2):
+    if not request.session.get("user"):
+        return RedirectResponse("/login")
+    if column:
+        # The search box; the drill-down lives at /columns/{column}
+        target = f"/columns/{quote(column, safe='')}"
+        return RedirectResponse(target + (f"?detected={quote(detected)}" if detected else ""), status_code=302)
+    min_hosts = max(min_hosts, 1)
+
+    conn = get_read_connection()
+    try:
+        columns = get_shared_columns(conn, detected=detected, min_hosts=min_hosts, limit=200)
+    finally:
+        return_db_connection(conn)
+
+    return templates.TemplateResponse("columns.html", {
+        "request": request,
+        "user": request.session["user"],
+        "role": request.session.get("role"),
+        "columns": columns,
+        "detected": detected,
+        "min_hosts": min_hosts,
+    })
+
+
+@app.get("/columns/{column}", response_class=HTMLResponse)
+def column_correlation_page(request: Request, column: str, detected: str = None):
+    if not request.session.get("user"):
+        return RedirectResponse("/login")
+
+    conn = get_read_connection()
+    try:
+        correlation = get_correlation(conn, column, detected=detected, limit=CORRELATION_MAX_ROWS)
+    except ValueError as e:
+        return templates.TemplateResponse("error.html", {
+            "request": request,
+            "error_message": str(e)
+        }, status_code=400)
+    finally:
+        return_db_connection(conn)
+
+    return templates.TemplateResponse("column.html", {
+        "request": request,
+        "user": request.session["user"],
+        "role": request.session.get("role"),
+        "correlation": correlation,
+    })
+
+
+# A plain def, so FastAPI runs the insert and its derived-table upserts in the
+# threadpool instead of on the event loop
 @app.post("/upload")
-async def upload(record: PiiRecord, request: Request):
+def upload(record: PiiRecord, request: Request):
     # Check API key
     if request.headers.get("X-API-Key") != API_KEY:
         return JSONResponse({"error": "Unauthorized"}, status_code=401)
 
+    conn = None
     try:
         conn = get_db_connection()
-        cur = conn.cursor()
-        
+
         # Join the list of detections with a comma
         detected_str = ", ".join(record.detected)
-        
-        cur.execute("""
-            INSERT INTO pii_results (hostname, source, column_name, detected, timestamp) 
-            VALUES (%s, %s, %s, %s, %s)
-        """, (record.hostname, record.source, record.column_name, detected_str, datetime.now()))
-        
+
+        insert_findings(conn, [
+            (record.hostname, record.source, record.column_name, detected_str, datetime.now())
+        ])
+
         conn.commit()
-        return_db_connection(conn)
         return {"status": "success"}
     except Exception as e:
-        logger.error(f"Error uploading record: {str(e)}")
+        logger.error("Error uploading record: %s", e)
+        if conn:
+            conn.rollback()
+        return JSONResponse({"error": str(e)}, status_code=500)
+    finally:
+        if conn:
+            return_db_connection(conn)
+
+
+def parse_json_batch(body: bytes, timestamp):
+    payload = json.loads(body)
+    if not isinstance(payload, list):
+        raise ValueError("batch must be a JSON array of records")
+    rows = []
+    for item in payload:
+        r = PiiRecord(**item)
+        rows.append((r.hostname, r.source, r.column_name, ", ".join(r.detected), timestamp))
+    return rows
+
+
+@app.post("/upload/batch", openapi_extra={
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": {"type": "array", "items": PiiRecord.schema()}},
+            MSGPACK_CONTENT_TYPES[0]: {"schema": {"type": "string", "format": "binary"}},
+        },
+    },
+})
+async def upload_batch(request: Request):
+    # Check API key
+    if request.headers.get("X-API-Key") != API_KEY:
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+
+    body = await request.body()
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    # Decoding and validating a large batch is CPU-bound; keep it off the event loop
+    return await run_in_threadpool(store_batch, body, content_type, datetime.now())
+
+
+def store_batch(body: bytes, content_type: str, now):
+    try:
+        if content_type in MSGPACK_CONTENT_TYPES:
+            rows = decode_batch(body, now)
+        else:
+            rows = parse_json_batch(body, now)
+    except (ValueError, TypeError) as e:
+        return JSONResponse({"error": str(e)}, status_code=422)
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        insert_findings(conn, rows)
+        conn.commit()
+        return {"status": "success", "inserted": len(rows)}
+    except Exception as e:
+        logger.error("Error uploading batch: %s", e)
+        if conn:
+            conn.rollback()
+        return JSONResponse({"error": str(e)}, status_code=500)
+    finally:
+        if conn:
+            return_db_connection(conn)
+
+
+# ------------------------------
+# Agent sync (see sync.py)
+# ------------------------------
+@app.get("/sync/{hostname}")
+async def sync_digests(request: Request, hostname: str, digest: str = None):
+    """Per-source digests of a host; just {"unchanged": true} when `digest` matches."""
+    if request.headers.get("X-API-Key") != API_KEY:
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+
+    def load(conn):
+        return get_host_digests(conn, hostname)
+
+    try:
+        # Stale digests are recomputed and stored, so this needs the primary
+        result = await run_in_threadpool(with_primary_connection, load)
+    except Exception as e:
+        logger.error("Error loading sync digests: %s", e)
         return JSONResponse({"error": str(e)}, status_code=500)
 
+    annotate(sync_sources=len(result["sources"]))
+    if digest and digest == result["digest"]:
+        return {"hostname": hostname, "digest": result["digest"], "unchanged": True}
+    return dict(result, unchanged=False)
+
+
+def parse_sync_body(body: bytes, hostname: str, timestamp):
+    payload = json.loads(body)
+    if not isinstance(payload, dict):
+        raise ValueError("sync body must be a JSON object")
+    sources = payload.get("sources") or {}
+    removed = payload.get("removed") or []
+    if not isinstance(sources, dict) or not isinstance(removed, list):
+        raise ValueError("sources must be an object and removed a list")
+    if not all(isinstance(s, str) for s in removed):
+        raise ValueError("removed must be a list of source paths")
+
+    rows = {}
+    for source, findings in sources.items():
+        if not isinstance(findings, list):
+            raise ValueError(f"findings for {source} must be a list")
+        if not all(isinstance(item, dict) for item in findings):
+            raise ValueError(f"findings for {source} must be objects")
+        rows[source] = [
+            normalize_record(dict(item, hostname=hostname, source=source), timestamp)
+            for item in findings
+        ]
+    return rows, removed
+
+
+@app.post("/sync/{hostname}")
+async def sync_upload(request: Request, hostname: str):
+    """
+    Replace the findings of the posted sources and delete those of the
+    removed ones. Body: {"sources": {source: [{"column_name", "detected"}]},
+    "removed": [source]}.
+    """
+    if request.headers.get("X-API-Key") != API_KEY:
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+
+    now = datetime.now()
+    try:
+        sources, removed = parse_sync_body(await request.body(), hostname, now)
+    except (ValueError, TypeError) as e:
+        return JSONResponse({"error": str(e)}, status_code=422)
+
+    def apply(conn):
+        return apply_sync(conn, hostname, sources, removed, now)
+
+    try:
+        result = await run_in_threadpool(with_primary_connection, apply)
+    except Exception as e:
+        logger.error("Error applying sync: %s", e)
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+    annotate(sync_added=result["added"], sync_removed=result["removed"])
+    return dict(result, status="success")
+
+
+@app.get("/schema/msgpack")
+def msgpack_schema():
+    """Layout of the MessagePack batch accepted by /upload/batch."""
+    return MSGPACK_SCHEMA
+
+
+@app.get("/api/ingest/stats")
+def ingest_stats(request: Request):
+    """Wire vs decoded byte counters for the ingest routes (this worker only)."""
+    if request.headers.get("X-API-Key") != API_KEY and request.session.get("role") != "admin":
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    return get_ingest_stats()
+
+
+@app.get("/api/admission/stats")
+def admission_stats(request: Request):
+    """Limits, queue depths and shed counts per route class (this worker only)."""
+    if request.headers.get("X-API-Key") != API_KEY and request.session.get("role") != "admin":
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    return get_admission_stats()
+
+
+
+# ------------------------------
+# Profiling (Admins only)
+# ------------------------------
+@app.get("/admin/profile")
+async def profile(request: Request, seconds: float = 10, interval_ms: float = 5, tasks: bool = False):
+    """Sample this worker's threads (and with tasks=1 its asyncio tasks); returns collapsed stacks."""
+    if "user" not in request.session or request.session.get("role") != "admin":
+        return RedirectResponse("/login", status_code=302)
+
+    loop = asyncio.get_running_loop() if tasks else None
+    try:
+        folded, samples = await run_in_threadpool(profile_stacks, seconds, interval_ms / 1000, loop)
+    except RuntimeError as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+    return PlainTextResponse(folded, headers={
+        "Content-Disposition": f"attachment; filename=profile-{os.getpid()}.folded",
+        "X-Profile-Samples": str(samples),
+        "X-Worker-Pid": str(os.getpid()),
+    })
+
+@app.get("/admin/memory")
+def memory_status(request: Request):
+    if "user" not in request.session or request.session.get("role") != "admin":
+        return RedirectResponse("/login", status_code=302)
+    return dict(tracemalloc_status(), pid=os.getpid())
+
+@app.post("/admin/memory/start")
+def memory_start(request: Request, frames: int = 25):
+    if "user" not in request.session or request.session.get("role") != "admin":
+        return RedirectResponse("/login", status_code=302)
+    return dict(start_tracemalloc(frames), pid=os.getpid())
+
+@app.post("/admin/memory/stop")
+def memory_stop(request: Request):
+    if "user" not in request.session or request.session.get("role") != "admin":
+        return RedirectResponse("/login", status_code=302)
+    return dict(stop_tracemalloc(), pid=os.getpid())
+
+@app.post("/admin/memory/snapshot")
+def memory_snapshot(request: Request, name: str = None, limit: int = 20):
+    if "user" not in request.session or request.session.get("role") != "admin":
+        return RedirectResponse("/login", status_code=302)
+    try:
+        return dict(take_snapshot(name, min(max(limit, 1), 200)), pid=os.getpid())
+    except RuntimeError as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+
+@app.get("/admin/memory/diff")
+def memory_diff(request: Request, old: str = None, new: str = None, limit: int = 20,
+                group_by: str = "lineno"):
+    """Allocation growth between two snapshots; new=now compares against the live heap."""
+    if "user" not in request.session or request.session.get("role") != "admin":
+        return RedirectResponse("/login", status_code=302)
+    try:
+        return dict(diff_snapshots(old, new, min(max(limit, 1), 200), group_by), pid=os.getpid())
+    except (KeyError, ValueError) as e:
+        return JSONResponse({"error": str(e).strip("'")}, status_code=400)
+    except RuntimeError as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
 
 
 # ------------------------------
@@ -0,0 +1,288 @@
+# admission.py
+"""
+Admission control and load shedding for DB-bound routes.
+
+Requests are grouped into route classes (ingest, dashboard, export, auth).
+Each class has its own concurrency limit and a bounded FIFO wait queue.
+A request over the limit waits in the queue for up to
+ADMISSION_QUEUE_TIMEOUT seconds. When the queue is full, or the wait runs
+out, it is answered straight away with 503 and Retry-After instead of
+piling up on the connection pool.
+
+The limits follow database latency. The duration of every statement run
+by an admitted request is observed through the pool's cursor class
+(tracing.QUERY_OBSERVERS); background jobs such as the archiver or the
+trend catch-up are left out, so their long statements do not read as
+congestion and shed user traffic. Once per
+ADMISSION_ADJUST_INTERVAL the mean of the last interval is compared with
+a slowly rising baseline. Latency above ADMISSION_LATENCY_TOLERANCE times
+the baseline cuts a shared health factor multiplicatively; otherwise it
+recovers additively (AIMD). Each class runs at max(min, max * health)
+concurrent requests.
+
+All admission bookkeeping happens on the event loop, so a worker needs no
+locks beyond the one guarding the latency counters that threadpool
+handlers update.
+"""
+import os
+import math
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
+
+from starlette.responses import JSONResponse
+
+from db import get_pool_size
+from logging_config import annotate, match_route
+from tracing import QUERY_OBSERVERS
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "1").lower() in ("1", "true", "yes")
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+ADMISSION_ADJUST_INTERVAL = float(os.getenv("ADMISSION_ADJUST_INTERVAL", "1"))
+ADMISSION_LATENCY_TOLERANCE = float(os.getenv("ADMISSION_LATENCY_TOLERANCE", "2"))
+# Mean statement latency below this never counts as congestion
+ADMISSION_LATENCY_FLOOR_MS = float(os.getenv("ADMISSION_LATENCY_FLOOR_MS", "50"))
+ADMISSION_MIN_HEALTH = 0.1
+
+# Path prefix -> route class; None exempts the path. "/" matches only itself.
+ADMISSION_ROUTES = [
+    ("/upload", "ingest"),
+    ("/sync", "ingest"),
+    ("/api/export", "export"),
+    ("/login", "auth"),
+    ("/users", "auth"),
+    ("/", "dashboard"),
+    ("/filter", "dashboard"),
+    ("/hosts", "dashboard"),
+    ("/columns", "dashboard"),
+    ("/api", "dashboard"),
+    ("/api/admission", None),
+]
+
+
+# Route class of the admitted request this context belongs to; copied into
+# run_in_threadpool handlers, unset in background threads
+_admitted = contextvars.ContextVar("admitted_route_class", default=None)
+
+
+def default_limits():
+    """{class: (max concurrency, min concurrency, queue size)} sized from the pool."""
+    _, pool_max = get_pool_size()
+    half = max(1, pool_max // 2)
+    quarter = max(1, pool_max // 4)
+    return {
+        "ingest": (half, 1, 2 * half),
+        "dashboard": (half, 1, 2 * half),
+        "export": (quarter, 1, quarter),
+        # Logins are cheap and must keep working while everything else sheds
+        "auth": (max(2, quarter), 2, 4 * max(2, quarter)),
+    }
+
+
+def load_limits(spec: str = None):
+    """Defaults overridden by ADMISSION_LIMITS ("class=max[:min[:queue]],...")."""
+    limits = default_limits()
+    spec = spec if spec is not None else os.getenv("ADMISSION_LIMITS", "")
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, value = item.split("=", 1)
+        name = name.strip()
+        parts = [int(p) for p in value.split(":")]
+        max_limit = max(1, parts[0])
+        min_limit = min(max_limit, parts[1]) if len(parts) > 1 else min(max_limit, limits.get(name, (0, 1, 0))[1])
+        queue_size = parts[2] if len(parts) > 2 else 2 * max_limit
+        limits[name] = (max_limit, min_limit, queue_size)
+    return limits
+
+
+class DbLatency:
+    """Per-interval mean statement latency against a slowly rising baseline."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._total = 0.0
+        self._count = 0
+        self.current_ms = None
+        self.baseline_ms = None
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._total += seconds
+            self._count += 1
+
+    def roll(self):
+        """Close the current interval; returns its mean in ms, or None if idle."""
+        with self._lock:
+            total, count = self._total, self._count
+            self._total, self._count = 0.0, 0
+        if not count:
+            return None
+        self.current_ms = total / count * 1000
+        if self.baseline_ms is None or self.current_ms < self.baseline_ms:
+            self.baseline_ms = self.current_ms
+        else:
+            # Drift up so a permanent shift in latency becomes the new normal
+            self.baseline_ms *= 1.01
+        return self.current_ms
+
+    def congested(self) -> bool:
+        return (
+            self.current_ms is not None
+            and self.current_ms > ADMISSION_LATENCY_FLOOR_MS
+            and self.current_ms > ADMISSION_LATENCY_TOLERANCE * self.baseline_ms
+        )
+
+
+class RouteClass:
+    def __init__(self, name: str, max_limit: int, min_limit: int, queue_size: int):
+        self.name = name
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.queue_size = queue_size
+        self.limit = max_limit
+        self.in_flight = 0
+        self.waiters = deque()
+        self.counters = {"admitted": 0, "queued": 0, "shed": 0, "timed_out": 0}
+
+    def set_health(self, health: float):
+        self.limit = max(self.min_limit, int(self.max_limit * health))
+        self.wake()
+
+    def wake(self):
+        while self.waiters and self.in_flight < self.limit:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(True)
+
+    async def acquire(self) -> bool:
+        """Admit now, after queueing, or return False to shed."""
+        if self.in_flight < self.limit and not self.waiters:
+            self.in_flight += 1
+            self.counters["admitted"] += 1
+            return True
+        if len(self.waiters) >= self.queue_size:
+            self.counters["shed"] += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.counters["queued"] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), ADMISSION_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # Admitted just as the timeout fired; keep the slot
+                self.counters["admitted"] += 1
+                return True
+            waiter.cancel()
+            self.waiters.remove(waiter)
+            self.counters["timed_out"] += 1
+            self.counters["shed"] += 1
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+            raise
+        self.counters["admitted"] += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self.wake()
+
+    def stats(self):
+        return dict(self.counters, limit=self.limit, max_limit=self.max_limit,
+                    min_limit=self.min_limit, in_flight=self.in_flight,
+                    waiting=len(self.waiters), queue_size=self.queue_size)
+
+
+class AdmissionController:
+    def __init__(self, limits: dict = None, routes=None):
+        limits = limits if limits is not None else load_limits()
+        self.classes = {name: RouteClass(name, *values) for name, values in limits.items()}
+        self.routes = sorted(routes or ADMISSION_ROUTES, key=lambda r: len(r[0]), reverse=True)
+        self.latency = DbLatency()
+        self.health = 1.0
+        self.last_adjust = time.monotonic()
+        QUERY_OBSERVERS.append(self.observe_query)
+
+    def observe_query(self, seconds: float):
+        if _admitted.get() is not None:
+            self.latency.observe(seconds)
+
+    def classify(self, path: str):
+        name = match_route(self.routes, path, None)
+        return self.classes.get(name)
+
+    def adjust(self):
+        now = time.monotonic()
+        if now - self.last_adjust < ADMISSION_ADJUST_INTERVAL:
+            return
+        self.last_adjust = now
+        if self.latency.roll() is None:
+            return
+        if self.latency.congested():
+            self.health = max(ADMISSION_MIN_HEALTH, self.health * 0.7)
+        else:
+            self.health = min(1.0, self.health + 0.05)
+        for route_class in self.classes.values():
+            route_class.set_health(self.health)
+
+    def stats(self):
+        return {
+            "enabled": ADMISSION_CONTROL,
+            "health": round(self.health, 3),
+            "db_latency_ms": None if self.latency.current_ms is None else round(self.latency.current_ms, 2),
+            "db_baseline_ms": None if self.latency.baseline_ms is None else round(self.latency.baseline_ms, 2),
+            "classes": {name: c.stats() for name, c in self.classes.items()},
+        }
+
+
+controller = AdmissionController()
+
+
+def get_admission_stats():
+    return controller.stats()
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying the per-class limits; 503 + Retry-After when shedding."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        route_class = controller.classify(scope["path"]) if scope["type"] == "http" else None
+        if not ADMISSION_CONTROL or route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        controller.adjust()
+        waited = time.perf_counter()
+        if not await route_class.acquire():
+            annotate(admission=route_class.name, shed=True)
+            response = JSONResponse(
+                {"error": "Server busy, please retry"},
+                status_code=503,
+                headers={"Retry-After": str(max(1, math.ceil(ADMISSION_RETRY_AFTER / controller.health)))},
+            )
+            await response(scope, receive, send)
+            return
+
+        annotate(admission=route_class.name,
+                 admission_wait_ms=round((time.perf_counter() - waited) * 1000, 2))
+        token = _admitted.set(route_class.name)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _admitted.reset(token)
+            route_class.release()
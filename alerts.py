@@ -0,0 +1,431 @@
+# alerts.py
+"""
+Alert rules evaluated incrementally on ingest.
+
+Rules live in alert_rules. Each worker compiles the enabled ones into an
+index keyed by detection type ("*" matches any type) and checks a rule's
+host glob and source prefix only for findings of a matching type.
+insert_findings() calls record_alerts() for every batch. That call only
+updates in-memory state, so ingest never waits on alert writes.
+
+A rule with threshold 1 fires on every matching finding; such hits are
+keyed by host and source. A rule with a higher threshold is a rate rule.
+It counts matches per host in slices of its window, and the slices are
+summed across workers in alert_counters at flush time. The rule fires once
+a host's count over the last window_seconds reaches the threshold.
+
+flush_alerts() runs as a background job. It writes alerts with an upsert
+on (rule, host/source, cooldown period), so repeats within
+cooldown_seconds increase one alert's count instead of adding rows. Newly
+created alerts are also POSTed to ALERT_WEBHOOK_URL when it is set;
+`python alerts.py --listen 9000` is a local stand-in receiver. A rule
+change is published through invalidation.py, so every worker reloads its
+rules at its next flush. ALERT_RULES_REFRESH seconds is the fallback
+reload interval.
+"""
+import os
+import re
+import json
+import time
+import fnmatch
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+from trends import split_detected
+from invalidation import publish
+
+ALERT_FLUSH_INTERVAL = int(os.getenv("ALERT_FLUSH_INTERVAL", "5"))
+ALERT_RULES_REFRESH = int(os.getenv("ALERT_RULES_REFRESH", "30"))
+ALERT_WEBHOOK_URL = os.getenv("ALERT_WEBHOOK_URL", "")
+# Rate-rule windows are counted in this many slices
+ALERT_WINDOW_SLICES = 6
+# Host-glob results remembered per rule
+ALERT_HOST_CACHE_SIZE = 10000
+
+logger = logging.getLogger(__name__)
+
+RULE_FIELDS = ("id", "name", "detected", "host_pattern", "source_prefix",
+               "threshold", "window_seconds", "cooldown_seconds")
+
+
+class Rule:
+    __slots__ = RULE_FIELDS + ("_host_re", "_host_cache")
+
+    def __init__(self, id, name, detected, host_pattern, source_prefix,
+                 threshold, window_seconds, cooldown_seconds):
+        self.id = id
+        self.name = name
+        self.detected = detected
+        self.host_pattern = host_pattern or "*"
+        self.source_prefix = source_prefix or ""
+        self.threshold = threshold
+        self.window_seconds = window_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self._host_re = None if self.host_pattern == "*" else re.compile(
+            fnmatch.translate(self.host_pattern), re.IGNORECASE)
+        self._host_cache = {}
+
+    @property
+    def is_rate(self) -> bool:
+        return self.threshold > 1
+
+    @property
+    def slice_seconds(self) -> int:
+        return max(1, self.window_seconds // ALERT_WINDOW_SLICES)
+
+    def matches(self, hostname: str, source: str) -> bool:
+        if self.source_prefix and not source.startswith(self.source_prefix):
+            return False
+        if self._host_re is None:
+            return True
+        matched = self._host_cache.get(hostname)
+        if matched is None:
+            if len(self._host_cache) >= ALERT_HOST_CACHE_SIZE:
+                self._host_cache.clear()
+            matched = self._host_cache[hostname] = bool(self._host_re.match(hostname))
+        return matched
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in RULE_FIELDS}
+
+
+class RuleIndex:
+    """Enabled rules by detection type."""
+
+    def __init__(self, rules):
+        self.rules = {rule.id: rule for rule in rules}
+        self.by_type = {}
+        self.any_type = []
+        for rule in rules:
+            if rule.detected == "*":
+                self.any_type.append(rule)
+            else:
+                self.by_type.setdefault(rule.detected, []).append(rule)
+
+    def match(self, hostname: str, source: str, types):
+        """Rules matching one finding, each once, with the type that matched."""
+        seen = set()
+        for detected in types:
+            for rule in self.by_type.get(detected, ()):
+                if rule.id not in seen and rule.matches(hostname, source):
+                    seen.add(rule.id)
+                    yield rule, detected
+        if types:
+            for rule in self.any_type:
+                if rule.id not in seen and rule.matches(hostname, source):
+                    seen.add(rule.id)
+                    yield rule, ", ".join(types)
+
+
+def parse_rule(data: dict):
+    """Validate a rule definition; returns the alert_rules column values or raises ValueError."""
+    if not isinstance(data, dict):
+        raise ValueError("rule must be an object")
+    name = data.get("name")
+    detected = data.get("detected")
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError("name must be a non-empty string")
+    if not isinstance(detected, str) or not detected.strip():
+        raise ValueError("detected must be a detection type or '*'")
+    host_pattern = data.get("host_pattern") or "*"
+    source_prefix = data.get("source_prefix") or ""
+    if not isinstance(host_pattern, str) or not isinstance(source_prefix, str):
+        raise ValueError("host_pattern and source_prefix must be strings")
+
+    values = {}
+    for field, default, minimum in (("threshold", 1, 1), ("window_seconds", 3600, 60),
+                                    ("cooldown_seconds", 3600, 60)):
+        value = data.get(field, default)
+        if not isinstance(value, int) or isinstance(value, bool) or value < minimum:
+            raise ValueError(f"{field} must be an integer >= {minimum}")
+        values[field] = value
+    return (name.strip(), detected.strip().lower(), host_pattern, source_prefix,
+            values["threshold"], values["window_seconds"], values["cooldown_seconds"],
+            bool(data.get("enabled", True)))
+
+
+_lock = threading.Lock()
+_index = RuleIndex([])
+_loaded_at = None
+# (rule_id, dedup_key) -> [count, first_seen, last_seen, hostname, source, detected]
+_hits = {}
+# (rule_id, hostname, slice_start epoch) -> count, for rate rules
+_counts = {}
+
+
+def load_rules(conn):
+    """Recompile the index from the enabled rules in alert_rules."""
+    global _index, _loaded_at
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SELECT {', '.join(RULE_FIELDS)} FROM alert_rules WHERE enabled ORDER BY id")
+        rules = [Rule(*row) for row in cur.fetchall()]
+        conn.commit()
+    finally:
+        cur.close()
+    _index = RuleIndex(rules)
+    _loaded_at = time.monotonic()
+    return len(rules)
+
+
+def get_rules(conn):
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SELECT {', '.join(RULE_FIELDS)}, enabled, created_at FROM alert_rules ORDER BY id")
+        return [dict(zip(RULE_FIELDS + ("enabled", "created_at"), row)) for row in cur.fetchall()]
+    finally:
+        cur.close()
+
+
+def create_rule(conn, data: dict):
+    """Insert a rule and reload this worker's index; returns the new id. Raises ValueError."""
+    values = parse_rule(data)
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            INSERT INTO alert_rules (name, detected, host_pattern, source_prefix,
+                                     threshold, window_seconds, cooldown_seconds, enabled)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING id
+        """, values)
+        rule_id = cur.fetchone()[0]
+        publish(cur, "alert_rules", "insert", key=str(rule_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    load_rules(conn)
+    return rule_id
+
+
+def delete_rule(conn, rule_id: int) -> bool:
+    cur = conn.cursor()
+    try:
+        cur.execute("DELETE FROM alert_rules WHERE id = %s", (rule_id,))
+        deleted = cur.rowcount > 0
+        publish(cur, "alert_rules", "delete", key=str(rule_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    load_rules(conn)
+    return deleted
+
+
+def invalidate_rules(change):
+    """Invalidation handler: reload the rules at the next flush."""
+    global _loaded_at
+    _loaded_at = None
+
+
+def merge_pending(hits, counts):
+    with _lock:
+        for key, (count, first, last, hostname, source, detected) in hits.items():
+            pending = _hits.get(key)
+            if pending is None:
+                _hits[key] = [count, first, last, hostname, source, detected]
+            else:
+                pending[0] += count
+                pending[1] = min(pending[1], first)
+                pending[2] = max(pending[2], last)
+        for key, count in counts.items():
+            _counts[key] = _counts.get(key, 0) + count
+
+
+def record_alerts(rows):
+    """Evaluate a batch of (hostname, source, column_name, detected, timestamp) rows."""
+    index = _index
+    if not index.rules:
+        return
+    now = int(time.time())
+    hits = {}
+    counts = {}
+    for hostname, source, _, detected, ts in rows:
+        hostname = hostname or ""
+        source = source or ""
+        for rule, matched in index.match(hostname, source, split_detected(detected)):
+            if rule.is_rate:
+                key = (rule.id, hostname, now - now % rule.slice_seconds)
+                counts[key] = counts.get(key, 0) + 1
+                continue
+            ts = ts or datetime.now()
+            key = (rule.id, f"{hostname}|{source}")
+            hit = hits.get(key)
+            if hit is None:
+                hits[key] = [1, ts, ts, hostname, source, matched]
+            else:
+                hit[0] += 1
+                hit[1] = min(hit[1], ts)
+                hit[2] = max(hit[2], ts)
+    if hits or counts:
+        merge_pending(hits, counts)
+
+
+def cooldown_start(rule: Rule, now: float) -> datetime:
+    return datetime.fromtimestamp(now - now % rule.cooldown_seconds)
+
+
+def evaluate_rates(cur, index: RuleIndex, counts, now: float):
+    """Add this worker's slices to alert_counters; returns alert hits for windows over threshold."""
+    cur.executemany("""
+        INSERT INTO alert_counters (rule_id, hostname, slice_start, count)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (rule_id, hostname, slice_start)
+        DO UPDATE SET count = alert_counters.count + EXCLUDED.count
+    """, [(rule_id, hostname, datetime.fromtimestamp(start), count)
+          for (rule_id, hostname, start), count in counts.items()
+          if rule_id in index.rules])
+
+    hits = {}
+    for rule_id, hostname in sorted({(r, h) for r, h, _ in counts}):
+        rule = index.rules.get(rule_id)
+        if rule is None:
+            continue
+        cur.execute("""
+            SELECT COALESCE(SUM(count), 0) FROM alert_counters
+            WHERE rule_id = %s AND hostname = %s AND slice_start > %s
+        """, (rule_id, hostname, datetime.fromtimestamp(now - rule.window_seconds)))
+        total = cur.fetchone()[0]
+        if total >= rule.threshold:
+            seen = datetime.fromtimestamp(now)
+            hits[(rule_id, hostname)] = [total, seen, seen, hostname, None, rule.detected]
+
+    cur.execute("""
+        DELETE FROM alert_counters c USING alert_rules r
+        WHERE r.id = c.rule_id AND c.slice_start < %s - make_interval(secs => r.window_seconds)
+    """, (datetime.fromtimestamp(now),))
+    return hits
+
+
+def write_alerts(cur, index: RuleIndex, hits, rate: bool, now: float):
+    """Upsert alerts; returns the ones created by this call."""
+    created = []
+    for (rule_id, dedup_key), (count, first, last, hostname, source, detected) in hits.items():
+        rule = index.rules.get(rule_id)
+        if rule is None:
+            continue
+        # Rate hits carry the window total, which replaces rather than adds
+        cur.execute(f"""
+            INSERT INTO alerts (rule_id, dedup_key, window_start, hostname, source, detected,
+                                count, first_seen, last_seen)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (rule_id, dedup_key, window_start) DO UPDATE SET
+                count = {"GREATEST(alerts.count, EXCLUDED.count)" if rate else "alerts.count + EXCLUDED.count"},
+                first_seen = LEAST(alerts.first_seen, EXCLUDED.first_seen),
+                last_seen = GREATEST(alerts.last_seen, EXCLUDED.last_seen)
+            RETURNING id, (xmax = 0)
+        """, (rule_id, dedup_key, cooldown_start(rule, now), hostname, source, detected,
+              count, first, last))
+        alert_id, inserted = cur.fetchone()
+        if inserted:
+            created.append({
+                "id": alert_id, "rule_id": rule_id, "rule": rule.name, "hostname": hostname,
+                "source": source, "detected": detected, "count": count,
+                "first_seen": first.isoformat(), "last_seen": last.isoformat(),
+            })
+    return created
+
+
+def post_webhook(alerts):
+    import urllib.request
+
+    req = urllib.request.Request(
+        ALERT_WEBHOOK_URL,
+        data=json.dumps({"alerts": alerts}).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    urllib.request.urlopen(req, timeout=5).close()
+
+
+def flush_alerts(conn):
+    """Reload rules when due, then write pending hits and counters. Returns alerts created."""
+    global _hits, _counts
+    if _loaded_at is None or time.monotonic() - _loaded_at >= ALERT_RULES_REFRESH:
+        load_rules(conn)
+    with _lock:
+        hits, _hits = _hits, {}
+        counts, _counts = _counts, {}
+    if not hits and not counts:
+        return 0
+
+    index = _index
+    now = time.time()
+    cur = conn.cursor()
+    try:
+        created = write_alerts(cur, index, hits, False, now)
+        if counts:
+            created += write_alerts(cur, index, evaluate_rates(cur, index, counts, now), True, now)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        merge_pending(hits, counts)
+        raise
+    finally:
+        cur.close()
+
+    if created and ALERT_WEBHOOK_URL:
+        try:
+            post_webhook(created)
+        except Exception as e:
+            logger.warning("Alert webhook failed: %s", e)
+    return len(created)
+
+
+def get_alerts(conn, since: datetime = None, rule_id: int = None, limit: int = 100):
+    query = """
+        SELECT a.id, a.rule_id, r.name, a.hostname, a.source, a.detected, a.count,
+               a.first_seen, a.last_seen, a.created_at
+        FROM alerts a LEFT JOIN alert_rules r ON r.id = a.rule_id
+        WHERE 1=1
+    """
+    params = []
+    if since:
+        query += " AND a.last_seen >= %s"
+        params.append(since)
+    if rule_id is not None:
+        query += " AND a.rule_id = %s"
+        params.append(rule_id)
+    query += " ORDER BY a.last_seen DESC LIMIT %s"
+    params.append(limit)
+    cur = conn.cursor()
+    try:
+        cur.execute(query, params)
+        columns = ("id", "rule_id", "rule", "hostname", "source", "detected", "count",
+                   "first_seen", "last_seen", "created_at")
+        return [dict(zip(columns, row)) for row in cur.fetchall()]
+    finally:
+        cur.close()
+
+
+def main():
+    """Local webhook stand-in: print every alert POSTed to it."""
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    parser = argparse.ArgumentParser(description="Receive alert webhooks and print them")
+    parser.add_argument("--listen", type=int, default=9000, help="Port to listen on")
+    args = parser.parse_args()
+
+    class Receiver(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            for alert in json.loads(body or b"{}").get("alerts", []):
+                print(json.dumps(alert), flush=True)
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    print(f"Listening for alerts on http://localhost:{args.listen}/ "
+          f"(set ALERT_WEBHOOK_URL to this address)")
+    HTTPServer(("", args.listen), Receiver).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
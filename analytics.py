@@ -0,0 +1,156 @@
+# analytics.py
+"""
+Aggregate statistics over pii_results, exact or approximate.
+
+Exact mode runs COUNT/COUNT(DISTINCT) over pii_results. Approximate mode
+reads finding counts from the daily trend buckets and distinct counts from
+the HyperLogLog sketches, and answers ad-hoc filtered counts by sampling
+with a 95% confidence interval. ANALYTICS_MODE sets the default; callers can
+override it per request.
+"""
+import os
+import math
+from datetime import datetime, timedelta
+
+from sketches import HyperLogLog, estimate_distinct
+from dimensions import estimated_rows, sampled_results
+
+ANALYTICS_MODE = os.getenv("ANALYTICS_MODE", "exact").lower()
+# Aim for about this many sampled rows when estimating filtered counts
+SAMPLE_TARGET_ROWS = int(os.getenv("SAMPLE_TARGET_ROWS", "100000"))
+# BERNOULLI samples rows independently, which the confidence interval
+# assumes. SYSTEM samples whole pages and is cheaper, but findings are
+# inserted in per-host batches and cluster by page, so it reports no interval.
+SAMPLE_METHOD = os.getenv("SAMPLE_METHOD", "BERNOULLI").upper()
+
+
+def use_approximate(approx=None) -> bool:
+    """Resolve a per-request override against the ANALYTICS_MODE default."""
+    if approx is None:
+        return ANALYTICS_MODE in ("approx", "approximate")
+    return bool(approx)
+
+
+def get_type_stats(conn, approximate: bool, days: int = None):
+    """
+    Findings and distinct hosts/sources/columns per detection type.
+
+    Returns {"approximate": bool, "relative_error": float|None,
+             "types": {detected: {"findings", "distinct_hosts",
+                                  "distinct_sources", "distinct_columns"}}}
+    """
+    since = datetime.now() - timedelta(days=days) if days else None
+    cur = conn.cursor()
+    try:
+        if approximate:
+            query = "SELECT detected, SUM(count) FROM pii_trend_daily"
+            params = []
+            if since:
+                query += " WHERE bucket >= %s"
+                params.append(since.replace(hour=0, minute=0, second=0, microsecond=0))
+            cur.execute(query + " GROUP BY detected", params)
+            findings = {d: int(c) for d, c in cur.fetchall()}
+            distinct = estimate_distinct(conn, since=since)
+            types = {
+                d: {
+                    "findings": findings.get(d, 0),
+                    "distinct_hosts": distinct.get(d, {}).get("host", 0),
+                    "distinct_sources": distinct.get(d, {}).get("source", 0),
+                    "distinct_columns": distinct.get(d, {}).get("column", 0),
+                }
+                for d in sorted(set(findings) | set(distinct))
+            }
+            return {"approximate": True, "relative_error": HyperLogLog.relative_error, "types": types}
+
+        query = """
+            SELECT trim(d),
+                   COUNT(*),
+                   COUNT(DISTINCT hostname),
+                   COUNT(DISTINCT (hostname, source)),
+                   COUNT(DISTINCT (hostname, source, column_name))
+            FROM pii_results, unnest(string_to_array(detected, ',')) AS d
+            WHERE trim(d) <> ''
+        """
+        params = []
+        if since:
+            query += " AND timestamp >= %s"
+            params.append(since)
+        cur.execute(query + " GROUP BY 1 ORDER BY 1", params)
+        types = {
+            d: {"findings": n, "distinct_hosts": h, "distinct_sources": s, "distinct_columns": c}
+            for d, n, h, s, c in cur.fetchall()
+        }
+        return {"approximate": False, "relative_error": None, "types": types}
+    finally:
+        cur.close()
+
+
+def build_filter(hostname=None, source=None, detected=None, source_prefix: bool = True):
+    clauses = []
+    params = []
+    if hostname:
+        clauses.append("hostname = %s")
+        params.append(hostname)
+    if source and source_prefix:
+        clauses.append("source LIKE %s")
+        params.append(source.replace("%", r"\%").replace("_", r"\_") + "%")
+    elif source:
+        clauses.append("source = %s")
+        params.append(source)
+    if detected:
+        clauses.append("detected LIKE %s")
+        params.append(f"%{detected}%")
+    where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+    return where, params
+
+
+def count_findings(conn, approximate: bool, hostname=None, source=None, detected=None,
+                   source_prefix: bool = True):
+    """
+    Count findings matching the filters. `source` matches as a prefix, or
+    exactly with source_prefix=False (the dashboard's filter).
+
+    Approximate mode samples about SAMPLE_TARGET_ROWS rows and returns the
+    scaled estimate with a 95% confidence interval (low/high are None with
+    SYSTEM sampling); small tables are always counted exactly.
+    """
+    where, params = build_filter(hostname, source, detected, source_prefix)
+    cur = conn.cursor()
+    try:
+        fraction = 1.0
+        if approximate:
+            total = estimated_rows(cur)
+            if total and total > SAMPLE_TARGET_ROWS:
+                fraction = SAMPLE_TARGET_ROWS / total
+
+        if fraction >= 1.0:
+            cur.execute("SELECT COUNT(*) FROM pii_results" + where, params)
+            count = cur.fetchone()[0]
+            return {"count": count, "approximate": False, "low": count, "high": count}
+
+        method = "SYSTEM" if SAMPLE_METHOD == "SYSTEM" else "BERNOULLI"
+        # TABLESAMPLE needs a table, so sample pii_findings rather than the view
+        sample, sample_params = sampled_results(cur, method, fraction * 100)
+        cur.execute(f"SELECT COUNT(*) FROM {sample}" + where, sample_params + params)
+        sampled = cur.fetchone()[0]
+    finally:
+        cur.close()
+
+    estimate = sampled / fraction
+    result = {
+        "count": round(estimate),
+        "approximate": True,
+        "low": None,
+        "high": None,
+        "sample_fraction": fraction,
+        "sample_method": method,
+    }
+    if method == "BERNOULLI":
+        # Binomial standard error of the scaled count
+        margin = 1.96 * math.sqrt(sampled * (1 - fraction)) / fraction
+        if sampled == 0:
+            # Rule of three: with no hits the 95% upper bound is about 3 / fraction
+            margin = 3 / fraction
+        result["low"] = max(0, round(estimate - margin))
+        result["high"] = round(estimate + margin)
+    return result
@@ -0,0 +1,351 @@
+# archive.py
+"""
+Cold-storage tier for old findings.
+
+archive_old_findings() moves pii_results rows older than
+ARCHIVE_AFTER_DAYS into zstd-compressed Parquet files under ARCHIVE_DIR,
+partitioned by month (month=YYYY-MM/part-<n>.parquet). Each chunk of
+ARCHIVE_BATCH_ROWS rows is deleted with DELETE ... RETURNING, written to
+its file and recorded in archive_files in the same transaction. If the
+transaction fails, the file is removed; a file that is not in
+archive_files is never read. manifest.json in ARCHIVE_DIR mirrors
+archive_files for offline tools.
+
+Rows are sorted by hostname and timestamp inside each file, so Parquet
+row-group statistics prune on both. The manifest keeps each file's time
+range and, when small enough, its host list. find_findings() and
+export_findings() read pii_results and then only the archive files that
+can match the requested time range and host.
+
+Archiving is not deletion: trend buckets, host summaries, top-K, sketches
+and the column index keep counting archived findings. Each chunk also
+writes its hourly (hostname, source, column_name, detected) counts to
+archive_rollup in the same transaction. The pii_history view adds those
+counts to pii_results, and every rebuild reads from it, so a rebuild does
+not drop archived findings. Files archived before rollups existed are
+rolled up from their Parquet data at the start of the next run. Sources
+that agents keep in step through /sync are skipped, since their rows are
+current state rather than history.
+
+Run it from cron (python archive.py) or set ARCHIVE_INTERVAL to run it
+as a background job. ARCHIVE_DIR must be on persistent disk.
+"""
+import os
+import json
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+from invalidation import publish
+from dimensions import delete_findings
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_ROWS = int(os.getenv("ARCHIVE_BATCH_ROWS", "500000"))
+# Background job interval in seconds; 0 leaves archiving to cron
+ARCHIVE_INTERVAL = int(os.getenv("ARCHIVE_INTERVAL", "0"))
+# Files with more distinct hosts than this do not list them in the manifest
+ARCHIVE_MAX_HOSTS_PER_FILE = 1000
+ARCHIVE_LOCK_KEY = 7240318
+ARCHIVE_COLUMNS = ("hostname", "source", "column_name", "detected", "timestamp")
+
+logger = logging.getLogger(__name__)
+
+
+def arrow_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("hostname", pa.string()),
+        ("source", pa.string()),
+        ("column_name", pa.string()),
+        ("detected", pa.string()),
+        ("timestamp", pa.timestamp("us")),
+    ])
+
+
+def write_parquet(path, rows):
+    """Write (hostname, source, column_name, detected, timestamp) rows sorted by host and time."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows = sorted(rows, key=lambda r: (r[0] or "", r[4] or datetime.min))
+    columns = list(zip(*rows))
+    table = pa.Table.from_arrays(
+        [pa.array(list(values), type=field.type) for values, field in zip(columns, arrow_schema())],
+        schema=arrow_schema(),
+    )
+    tmp = path + ".tmp"
+    pq.write_table(table, tmp, compression="zstd", row_group_size=64 * 1024)
+    os.replace(tmp, path)
+    return os.path.getsize(path)
+
+
+def write_manifest(conn):
+    """Mirror archive_files to ARCHIVE_DIR/manifest.json."""
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT path, min_ts, max_ts, row_count, hosts, bytes, created_at
+            FROM archive_files ORDER BY min_ts
+        """)
+        files = [
+            {"path": path, "min_ts": min_ts.isoformat(), "max_ts": max_ts.isoformat(),
+             "rows": rows, "hosts": hosts, "bytes": size, "created_at": created.isoformat()}
+            for path, min_ts, max_ts, rows, hosts, size, created in cur.fetchall()
+        ]
+        conn.commit()
+    finally:
+        cur.close()
+    tmp = os.path.join(ARCHIVE_DIR, "manifest.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump({"updated_at": datetime.now().isoformat(), "files": files}, f, indent=1)
+    os.replace(tmp, os.path.join(ARCHIVE_DIR, "manifest.json"))
+
+
+def rollup(rows):
+    """Hourly (hostname, source, column_name, detected) -> (max timestamp, count)."""
+    groups = {}
+    for hostname, source, column_name, detected, ts in rows:
+        key = (hostname, source, column_name, detected, ts.replace(minute=0, second=0, microsecond=0))
+        max_ts, count = groups.get(key, (ts, 0))
+        groups[key] = (max(max_ts, ts), count + 1)
+    return [key[:4] + value for key, value in groups.items()]
+
+
+def write_rollup(cur, file_id, rows):
+    from psycopg2.extras import execute_values
+
+    execute_values(cur, """
+        INSERT INTO archive_rollup (file_id, hostname, source, column_name, detected, max_ts, row_count)
+        VALUES %s
+    """, [(file_id,) + group for group in rollup(rows)], page_size=5000)
+    cur.execute("UPDATE archive_files SET rolled_up = true WHERE id = %s", (file_id,))
+
+
+def backfill_rollups(conn):
+    """Roll up files archived before archive_rollup existed. Returns files done."""
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT id, path FROM archive_files WHERE NOT rolled_up ORDER BY id")
+        pending = cur.fetchall()
+        conn.commit()
+        for file_id, path in pending:
+            cur.execute("DELETE FROM archive_rollup WHERE file_id = %s", (file_id,))
+            write_rollup(cur, file_id, read_file(path))
+            conn.commit()
+            logger.info("Rolled up archive file %s", path)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return len(pending)
+
+
+def archive_chunk(conn, cutoff):
+    """Move up to ARCHIVE_BATCH_ROWS of the oldest eligible rows into one file. Returns rows moved."""
+    cur = conn.cursor()
+    path = None
+    try:
+        cur.execute("""
+            SELECT date_trunc('month', MIN(timestamp)) FROM pii_results p
+            WHERE timestamp < %s
+              AND NOT EXISTS (SELECT 1 FROM source_digests d
+                              WHERE d.hostname = p.hostname AND d.source = p.source)
+        """, (cutoff,))
+        month = cur.fetchone()[0]
+        if month is None:
+            conn.rollback()
+            return 0
+        month_end = (month + timedelta(days=32)).replace(day=1)
+
+        # One month per file so partitions never straddle. The advisory lock
+        # keeps other runs out; rows deleted meanwhile are just not returned.
+        cur.execute("""
+            SELECT id FROM pii_results p
+            WHERE timestamp >= %s AND timestamp < %s
+              AND NOT EXISTS (SELECT 1 FROM source_digests d
+                              WHERE d.hostname = p.hostname AND d.source = p.source)
+            ORDER BY timestamp
+            LIMIT %s
+        """, (month, min(month_end, cutoff), ARCHIVE_BATCH_ROWS))
+        rows = delete_findings(cur, [r[0] for r in cur.fetchall()])
+        if not rows:
+            conn.rollback()
+            return 0
+
+        partition = f"month={month:%Y-%m}"
+        os.makedirs(os.path.join(ARCHIVE_DIR, partition), exist_ok=True)
+        cur.execute("SELECT nextval('archive_files_id_seq')")
+        file_id = cur.fetchone()[0]
+        path = os.path.join(ARCHIVE_DIR, partition, f"part-{file_id:08d}.parquet")
+        size = write_parquet(path, rows)
+
+        hosts = sorted({r[0] or "" for r in rows})
+        cur.execute("""
+            INSERT INTO archive_files (id, path, partition, min_ts, max_ts, row_count, hosts, bytes)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """, (file_id, os.path.relpath(path, ARCHIVE_DIR), partition,
+              min(r[4] for r in rows), max(r[4] for r in rows), len(rows),
+              hosts if len(hosts) <= ARCHIVE_MAX_HOSTS_PER_FILE else None, size))
+        write_rollup(cur, file_id, rows)
+        publish(cur, "pii_results", "delete", hosts)
+        conn.commit()
+        path = None
+        return len(rows)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        # Written but not committed: nothing references it
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+
+def archive_old_findings(conn, older_than_days: int = None, max_rows: int = None):
+    """Archive everything older than the threshold. Returns rows moved; 0 if another run holds the lock."""
+    cutoff = datetime.now() - timedelta(days=older_than_days or ARCHIVE_AFTER_DAYS)
+    cur = conn.cursor()
+    cur.execute("SELECT pg_try_advisory_lock(%s)", (ARCHIVE_LOCK_KEY,))
+    locked = cur.fetchone()[0]
+    conn.commit()
+    if not locked:
+        cur.close()
+        return 0
+
+    moved = 0
+    try:
+        backfill_rollups(conn)
+        while max_rows is None or moved < max_rows:
+            count = archive_chunk(conn, cutoff)
+            if not count:
+                break
+            moved += count
+            logger.info("Archived %s rows older than %s", f"{moved:,}", f"{cutoff:%Y-%m-%d}")
+        if moved:
+            write_manifest(conn)
+    finally:
+        cur.execute("SELECT pg_advisory_unlock(%s)", (ARCHIVE_LOCK_KEY,))
+        conn.commit()
+        cur.close()
+    return moved
+
+
+def plan_files(conn, since=None, until=None, hostname=None, newest_first=False):
+    """Manifest entries whose time range (and host list, if known) can match."""
+    query = "SELECT path, min_ts, max_ts FROM archive_files WHERE 1=1"
+    params = []
+    if since:
+        query += " AND max_ts >= %s"
+        params.append(since)
+    if until:
+        query += " AND min_ts < %s"
+        params.append(until)
+    if hostname is not None:
+        query += " AND (hosts IS NULL OR %s = ANY(hosts))"
+        params.append(hostname)
+    cur = conn.cursor()
+    try:
+        cur.execute(query + (" ORDER BY max_ts DESC" if newest_first else " ORDER BY min_ts"), params)
+        return cur.fetchall()
+    finally:
+        cur.close()
+
+
+def read_file(path, since=None, until=None, hostname=None, detected=None):
+    """Rows of one archive file matching the filters, as tuples."""
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    filters = []
+    if since:
+        filters.append(("timestamp", ">=", since))
+    if until:
+        filters.append(("timestamp", "<", until))
+    if hostname is not None:
+        filters.append(("hostname", "=", hostname))
+    table = pq.read_table(os.path.join(ARCHIVE_DIR, path), filters=filters or None)
+    if detected:
+        table = table.filter(pc.match_substring(table["detected"], detected))
+    columns = [table[name].to_pylist() for name in ARCHIVE_COLUMNS]
+    return list(zip(*columns))
+
+
+def hot_query(since=None, until=None, hostname=None, detected=None):
+    query = f"SELECT {', '.join(ARCHIVE_COLUMNS)} FROM pii_results WHERE 1=1"
+    params = []
+    if since:
+        query += " AND timestamp >= %s"
+        params.append(since)
+    if until:
+        query += " AND timestamp < %s"
+        params.append(until)
+    if hostname is not None:
+        query += " AND hostname = %s"
+        params.append(hostname)
+    if detected:
+        query += " AND detected LIKE %s"
+        params.append(f"%{detected}%")
+    return query, params
+
+
+def find_findings(conn, since=None, until=None, hostname=None, detected=None, limit=1000):
+    """Newest `limit` findings across pii_results and the archive.
+
+    Archive files are visited newest first and only while they can still
+    hold something newer than the oldest row kept so far.
+    """
+    query, params = hot_query(since, until, hostname, detected)
+    cur = conn.cursor()
+    try:
+        cur.execute(query + " ORDER BY timestamp DESC LIMIT %s", params + [limit])
+        rows = [row + ("hot",) for row in cur.fetchall()]
+    finally:
+        cur.close()
+
+    for path, _, max_ts in plan_files(conn, since, until, hostname, newest_first=True):
+        if len(rows) >= limit and max_ts < rows[-1][4]:
+            break
+        rows.extend(row + ("archive",) for row in read_file(path, since, until, hostname, detected))
+        rows.sort(key=lambda r: r[4], reverse=True)
+        del rows[limit:]
+    return rows
+
+
+def export_findings(conn, since=None, until=None, hostname=None, detected=None):
+    """Yield every matching finding: archived files oldest first, then pii_results by time."""
+    for path, _, _ in plan_files(conn, since, until, hostname):
+        yield from read_file(path, since, until, hostname, detected)
+
+    query, params = hot_query(since, until, hostname, detected)
+    cur = conn.cursor(name="export_findings")
+    cur.itersize = 10000
+    try:
+        cur.execute(query + " ORDER BY timestamp", params)
+        yield from cur
+    finally:
+        cur.close()
+
+
+def main():
+    from db import init_db, get_db_connection, return_db_connection
+
+    parser = argparse.ArgumentParser(description="Move old findings to Parquet cold storage")
+    parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--max-rows", type=int, default=None, help="Stop after about this many rows")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    init_db()
+    conn = get_db_connection()
+    try:
+        moved = archive_old_findings(conn, args.older_than_days, args.max_rows)
+        print(f"Archived {moved:,} rows to {os.path.abspath(ARCHIVE_DIR)}")
+    finally:
+        return_db_connection(conn)
+
+
+if __name__ == "__main__":
+    main()
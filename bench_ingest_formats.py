@@ -0,0 +1,83 @@
+"""
+Decode + validate throughput of the JSON and MessagePack batch formats.
+
+Runs on a single core and measures only the CPU work /upload/batch does
+before touching the database: parsing the body and turning it into
+pii_results row tuples.
+
+Usage:
+    python bench_ingest_formats.py --records 100000 --repeat 5
+"""
+import json
+import time
+import random
+import argparse
+import statistics
+from datetime import datetime
+
+from models import PiiRecord
+from msgpack_ingest import encode_batch, decode_batch
+
+DETECTION_TYPES = ["email", "phone", "pan", "aadhaar", "credit_card"]
+
+
+def make_records(n, hosts=50, seed=7):
+    rng = random.Random(seed)
+    records = []
+    for i in range(n):
+        host = f"host-{rng.randrange(hosts):03d}.corp.example.com"
+        records.append({
+            "hostname": host,
+            "source": f"/srv/data/exports/{host}/customers_{rng.randrange(200)}.csv",
+            "column_name": rng.choice(["email", "phone_no", "pan_number", "card", "notes"]) + f"_{i % 7}",
+            "detected": rng.sample(DETECTION_TYPES, rng.randint(1, 2)),
+        })
+    return records
+
+
+def json_path(body, now):
+    # Mirrors parse_json_batch() in DataDiscoveryServer
+    rows = []
+    for item in json.loads(body):
+        r = PiiRecord(**item)
+        rows.append((r.hostname, r.source, r.column_name, ", ".join(r.detected), now))
+    return rows
+
+
+def msgpack_path(body, now):
+    return decode_batch(body, now)
+
+
+def bench(fn, body, repeat):
+    now = datetime.now()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = fn(body, now)
+        timings.append(time.perf_counter() - started)
+    return len(rows), statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare JSON and MessagePack ingest decoding")
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    records = make_records(args.records)
+    bodies = {
+        "json": json.dumps(records).encode(),
+        "msgpack": encode_batch(records),
+    }
+
+    print(f"{'format':<10} {'body MB':>9} {'median s':>9} {'records/s/core':>15}")
+    results = {}
+    for name, fn in (("json", json_path), ("msgpack", msgpack_path)):
+        n, seconds = bench(fn, bodies[name], args.repeat)
+        results[name] = n / seconds
+        print(f"{name:<10} {len(bodies[name]) / 1e6:9.2f} {seconds:9.3f} {results[name]:15,.0f}")
+    print(f"msgpack speedup: {results['msgpack'] / results['json']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Query-level benchmark of the dashboard, filter, facet and export paths.
+
+Times every query the UI and APIs issue against the current database and
+compares the medians with a stored baseline for the same dataset scale.
+Slower runs are flagged as regressions. With --generate the suite first
+loads each scale with generate_dataset.py, so one command covers e.g.
+1M and 10M:
+
+    python bench_queries.py --generate 1M,10M --save-baseline   # record
+    python bench_queries.py --generate 1M,10M                   # compare
+    python bench_queries.py --scale 10M --only dashboard        # current data
+
+Exits 1 when any query regressed by more than --tolerance (and by more
+than --min-delta-ms).
+"""
+import sys
+import json
+import time
+import argparse
+import statistics
+from datetime import datetime
+
+from import_results import connect
+from dimensions import estimated_rows
+
+BASELINE_FILE = "bench_baseline.json"
+
+
+def fetch_all(sql, params=()):
+    def run(conn, p):
+        cur = conn.cursor()
+        try:
+            cur.execute(sql, [p[k] for k in params])
+            return len(cur.fetchall())
+        finally:
+            cur.close()
+    return run
+
+
+def stream(sql, params=()):
+    """Read the result through a server-side cursor, as a CSV export would."""
+    def run(conn, p):
+        cur = conn.cursor(name="bench_export")
+        cur.itersize = 10000
+        try:
+            cur.execute(sql, [p[k] for k in params])
+            return sum(1 for _ in cur)
+        finally:
+            cur.close()
+    return run
+
+
+def call(fn_path, **kwargs):
+    """Call module.function(conn, **kwargs); "$name" values are taken from params."""
+    module_name, fn_name = fn_path.rsplit(".", 1)
+
+    def run(conn, p):
+        fn = getattr(__import__(module_name), fn_name)
+        args = {k: (p[v[1:]] if isinstance(v, str) and v.startswith("$") else v) for k, v in kwargs.items()}
+        result = fn(conn, **args)
+        return len(result) if hasattr(result, "__len__") else 1
+    return run
+
+
+# (group, name, runner); SQL mirrors DataDiscoveryServer.py
+QUERIES = [
+    ("dashboard", "distinct_hostnames",
+     fetch_all("SELECT h.hostname FROM hosts h WHERE EXISTS (SELECT 1 FROM pii_findings f WHERE f.host_id = h.id)")),
+    ("dashboard", "distinct_sources",
+     fetch_all("SELECT s.source FROM sources s WHERE EXISTS (SELECT 1 FROM pii_findings f WHERE f.source_id = s.id)")),
+    ("dashboard", "filtered_rows_host",
+     fetch_all("SELECT * FROM pii_results WHERE 1=1 AND hostname = %s", ("host",))),
+    ("dashboard", "filtered_rows_host_source",
+     fetch_all("SELECT * FROM pii_results WHERE 1=1 AND hostname = %s AND source = %s", ("host", "source"))),
+    ("dashboard", "chart_by_detected",
+     fetch_all("SELECT detected, COUNT(*) FROM pii_results GROUP BY detected")),
+    ("dashboard", "latest_rows",
+     fetch_all("""SELECT hostname, source, column_name, detected, timestamp
+                  FROM pii_results ORDER BY timestamp DESC LIMIT 100""")),
+    ("filter", "latest_rows_by_type",
+     fetch_all("""SELECT hostname, source, column_name, detected, timestamp
+                  FROM pii_results WHERE detected LIKE %s ORDER BY timestamp DESC LIMIT 100""", ("like",))),
+    ("facet", "type_stats_exact", call("analytics.get_type_stats", approximate=False)),
+    ("facet", "type_stats_approx", call("analytics.get_type_stats", approximate=True)),
+    ("facet", "count_exact", call("analytics.count_findings", approximate=False, hostname="$host")),
+    ("facet", "count_approx", call("analytics.count_findings", approximate=True, hostname="$host")),
+    ("facet", "trends_90d", call("trends.get_trend_series", granularity="day", days=90)),
+    ("facet", "trends_host_7d_hourly",
+     call("trends.get_trend_series", granularity="hour", days=7, hostname="$host")),
+    ("facet", "host_ranking", call("host_summary.get_host_ranking")),
+    ("facet", "host_detail", call("host_summary.get_host_detail", hostname="$host")),
+    ("facet", "topk_exact_sources", call("topk.exact_top_k", dimension="source")),
+    ("export", "host_findings",
+     stream("""SELECT hostname, source, column_name, detected, timestamp
+               FROM pii_results WHERE hostname = %s ORDER BY timestamp""", ("host",))),
+    ("export", "type_last_7_days",
+     stream("""SELECT hostname, source, column_name, detected, timestamp
+               FROM pii_results WHERE detected LIKE %s AND timestamp >= now() - interval '7 days'
+               ORDER BY timestamp""", ("like",))),
+]
+
+
+def pick_params(conn, detected):
+    """Parameters taken from the data: the busiest host and its busiest source."""
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT hostname FROM host_summary ORDER BY finding_count DESC LIMIT 1")
+        row = cur.fetchone()
+        if row is None:
+            cur.execute("SELECT hostname FROM pii_results LIMIT 1")
+            row = cur.fetchone()
+        host = row[0] if row else ""
+        cur.execute("SELECT source FROM host_sources WHERE hostname = %s ORDER BY finding_count DESC LIMIT 1",
+                    (host,))
+        row = cur.fetchone()
+        source = row[0] if row else ""
+        rows = int(estimated_rows(cur))
+        conn.commit()
+    finally:
+        cur.close()
+    return {"host": host, "source": source, "detected": detected, "like": f"%{detected}%"}, rows
+
+
+def run_suite(conn, params, repeat, groups=None, timeout_ms=None):
+    results = {}
+    if timeout_ms:
+        cur = conn.cursor()
+        cur.execute("SET statement_timeout = %s", (timeout_ms,))
+        conn.commit()
+        cur.close()
+    for group, name, runner in QUERIES:
+        if groups and group not in groups:
+            continue
+        key = f"{group}.{name}"
+        timings = []
+        rows = None
+        try:
+            runner(conn, params)  # warm-up
+            conn.rollback()
+            for _ in range(repeat):
+                started = time.perf_counter()
+                rows = runner(conn, params)
+                timings.append((time.perf_counter() - started) * 1000)
+                conn.rollback()
+        except Exception as e:
+            conn.rollback()
+            results[key] = {"error": str(e).strip()}
+            print(f"  {key:<42} ERROR {str(e).strip()}")
+            continue
+        timings.sort()
+        results[key] = {
+            "median_ms": round(statistics.median(timings), 3),
+            "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+            "rows": rows,
+        }
+        print(f"  {key:<42} {results[key]['median_ms']:>10.2f} ms  (p95 {results[key]['p95_ms']:.2f}, "
+              f"{rows:,} rows)")
+    return results
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """Return [(query, baseline_ms, current_ms)] that got slower."""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if not base or "median_ms" not in base or "median_ms" not in result:
+            continue
+        current, previous = result["median_ms"], base["median_ms"]
+        if current > previous * (1 + tolerance) and current - previous > min_delta_ms:
+            regressions.append((key, previous, current))
+    return regressions
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dashboard/filter/facet/export queries")
+    parser.add_argument("--generate", default=None,
+                        help="Comma-separated scales to generate and benchmark in turn, e.g. 1M,10M")
+    parser.add_argument("--scale", default=None,
+                        help="Label for the current data (default: estimated row count, e.g. 10M)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", default=None, help="Comma-separated groups: dashboard,filter,facet,export")
+    parser.add_argument("--detected", default="email", help="Detection type used by filter/export queries")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0,
+                        help="Ignore slowdowns smaller than this many milliseconds")
+    parser.add_argument("--timeout-ms", type=int, default=600000, help="statement_timeout per query")
+    parser.add_argument("--workers", type=int, default=None, help="Generator worker processes")
+    args = parser.parse_args()
+
+    from generate_dataset import generate, parse_count, format_count
+
+    groups = set(args.only.split(",")) if args.only else None
+    baseline = load_baseline(args.baseline)
+    scales = [s.strip() for s in args.generate.split(",")] if args.generate else [args.scale]
+    all_regressions = []
+
+    for scale in scales:
+        if args.generate:
+            print(f"== Generating {scale} ==")
+            generate(parse_count(scale), workers=args.workers, truncate=True)
+
+        conn = connect()
+        try:
+            params, estimated = pick_params(conn, args.detected)
+            label = format_count(parse_count(scale)) if scale else format_count(round(estimated, -5) or estimated)
+            print(f"== Scale {label} (~{estimated:,} rows), host {params['host']} ==")
+            results = run_suite(conn, params, args.repeat, groups, args.timeout_ms)
+        finally:
+            conn.close()
+
+        regressions = compare(results, baseline.get(label, {}).get("queries", {}),
+                              args.tolerance, args.min_delta_ms)
+        for key, previous, current in regressions:
+            print(f"  REGRESSION {key}: {previous:.2f} ms -> {current:.2f} ms "
+                  f"(+{(current / previous - 1) * 100:.0f}%)")
+        all_regressions.extend((label,) + r for r in regressions)
+
+        if args.save_baseline:
+            baseline[label] = {"recorded_at": datetime.now().isoformat(timespec="seconds"),
+                               "rows": estimated, "queries": results}
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+
+    if all_regressions:
+        print(f"{len(all_regressions)} regression(s) against {args.baseline}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
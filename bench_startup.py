@@ -0,0 +1,176 @@
+"""
+Cold start benchmark for scale-to-zero deployments.
+
+Measures, each in a fresh interpreter:
+  * import time of DataDiscoveryServer
+  * time from process spawn until /healthz answers (liveness)
+  * time from process spawn until /readyz answers 200 (database ready)
+  * latency of the first rendered page (/login)
+
+Usage:
+    python bench_startup.py --runs 5
+    python bench_startup.py --runs 5 --save startup_baseline.json
+    python bench_startup.py --runs 5 --baseline startup_baseline.json
+    python bench_startup.py --importtime
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import urllib.request
+import urllib.error
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_import():
+    code = (
+        "import time; t = time.perf_counter(); "
+        "import DataDiscoveryServer; print(time.perf_counter() - t)"
+    )
+    out = subprocess.run([sys.executable, "-c", code], cwd=HERE,
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def http_status(url, timeout=1.0):
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as resp:
+            resp.read()
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except (urllib.error.URLError, ConnectionError, socket.timeout):
+        return None
+
+
+def wait_for(url, expected, started, deadline):
+    while time.perf_counter() < deadline:
+        if http_status(url) == expected:
+            return time.perf_counter() - started
+        time.sleep(0.01)
+    return None
+
+
+def measure_server(ready_timeout):
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "DataDiscoveryServer:app",
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = started + ready_timeout
+        live = wait_for(f"{base}/healthz", 200, started, deadline)
+
+        first_request = None
+        if live is not None:
+            t = time.perf_counter()
+            if http_status(f"{base}/login", timeout=ready_timeout) == 200:
+                first_request = time.perf_counter() - t
+
+        ready = wait_for(f"{base}/readyz", 200, started, deadline)
+        return {"liveness": live, "readiness": ready, "first_request": first_request}
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def importtime_report(top):
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import DataDiscoveryServer"],
+                         cwd=HERE, capture_output=True, text=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, self_us, cumulative_us, name = [p.strip() for p in line.split("|")]
+        rows.append((int(cumulative_us), int(self_us.split(":")[1]), name))
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[:top]:
+        print(f"{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {name}")
+
+
+def summarize(samples):
+    values = [v for v in samples if v is not None]
+    if not values:
+        return None
+    return {"median": statistics.median(values), "min": min(values), "max": max(values),
+            "failures": len(samples) - len(values)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark import and first-request latency")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--ready-timeout", type=float, default=60.0)
+    parser.add_argument("--skip-server", action="store_true", help="Only measure import time")
+    parser.add_argument("--save", help="Write results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against a previously saved JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative slowdown against the baseline (default 20%%)")
+    parser.add_argument("--importtime", action="store_true",
+                        help="Print the slowest imports and exit")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    if args.importtime:
+        importtime_report(args.top)
+        return
+
+    samples = {"import": [], "liveness": [], "readiness": [], "first_request": []}
+    for i in range(args.runs):
+        samples["import"].append(measure_import())
+        if not args.skip_server:
+            for key, value in measure_server(args.ready_timeout).items():
+                samples[key].append(value)
+        print(f"run {i + 1}/{args.runs} done")
+
+    results = {key: summarize(values) for key, values in samples.items() if values}
+    results["fast_start"] = os.getenv("FAST_START", "0")
+
+    print(f"{'metric':<15} {'median ms':>10} {'min ms':>10} {'max ms':>10} {'failures':>9}")
+    for key, stats in results.items():
+        if not isinstance(stats, dict):
+            continue
+        print(f"{key:<15} {stats['median'] * 1000:10.1f} {stats['min'] * 1000:10.1f} "
+              f"{stats['max'] * 1000:10.1f} {stats['failures']:9d}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved results to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = []
+        for key, stats in results.items():
+            base = baseline.get(key)
+            if not isinstance(stats, dict) or not isinstance(base, dict):
+                continue
+            if stats["median"] > base["median"] * (1 + args.tolerance):
+                regressions.append(f"{key}: {base['median'] * 1000:.1f} ms -> {stats['median'] * 1000:.1f} ms")
+        if regressions:
+            print("Regressions against baseline:")
+            for r in regressions:
+                print(f"  {r}")
+            sys.exit(1)
+        print("No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
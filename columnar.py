@@ -0,0 +1,575 @@
+# columnar.py
+"""
+In-process columnar cache of recent findings.
+
+Each worker keeps the rows of the last COLUMNAR_WINDOW_DAYS as NumPy
+arrays: ids, timestamps and dictionary-encoded hostname, source,
+column_name and detected codes. Everything older is held as one
+pre-aggregated frame of (host, source, detected) -> count, so
+all-time facets and chart counts stay exact without keeping old rows.
+
+refresh_columnar_cache() runs as a background job. The first call loads
+the cache from one REPEATABLE READ snapshot. Later calls tail ids above a
+scan floor and skip the ones already cached. Transactions commit out of
+id order, so the floor is not simply the watermark. Every read records a
+checkpoint (watermark, snapshot xmax). The floor is the newest checkpoint
+taken before every transaction that was still in flight at the last read
+had been assigned its xid. A transaction that commits late, e.g. a large
+import batch, is therefore re-read from its first id, however many ids
+it spans. If a very long transaction holds the floor more than
+COLUMNAR_MAX_RESCAN ids back, the floor moves up anyway and the cache
+is reloaded later. When pii_results has seen deletes or updates since the
+load (pg_stat_user_tables), the cache is reloaded, at most once per
+COLUMNAR_RELOAD_INTERVAL.
+
+invalidate_columnar() receives pii_results change notifications (see
+invalidation.py). A delete makes the next refresh reload, at most once per
+COLUMNAR_MIN_RELOAD_INTERVAL, instead of waiting for pg_stat. While the
+listener is connected, refreshes only tail after an insert notification,
+or every COLUMNAR_IDLE_TAIL_INTERVAL to pick up bulk COPY loads. Idle
+workers therefore do not query. Rows beyond the
+COLUMNAR_MEMORY_MB budget, or older than the window, are folded into the
+aggregate, oldest ids first.
+
+Readers get an immutable ColumnarSnapshot from get_columnar_cache();
+the writer only appends past the snapshot's length or swaps in new
+arrays, so reads take no lock.
+"""
+import os
+import time
+import threading
+from datetime import datetime, timedelta
+
+from invalidation import listening
+
+COLUMNAR_CACHE = os.getenv("COLUMNAR_CACHE", "1").lower() in ("1", "true", "yes")
+COLUMNAR_WINDOW_DAYS = int(os.getenv("COLUMNAR_WINDOW_DAYS", "30"))
+COLUMNAR_MEMORY_MB = int(os.getenv("COLUMNAR_MEMORY_MB", "256"))
+COLUMNAR_REFRESH_INTERVAL = int(os.getenv("COLUMNAR_REFRESH_INTERVAL", "5"))
+COLUMNAR_RELOAD_INTERVAL = int(os.getenv("COLUMNAR_RELOAD_INTERVAL", "300"))
+COLUMNAR_TAIL_OVERLAP = int(os.getenv("COLUMNAR_TAIL_OVERLAP", "1000"))
+# Furthest the scan floor may trail the watermark before a reload is scheduled
+COLUMNAR_MAX_RESCAN = int(os.getenv("COLUMNAR_MAX_RESCAN", "1000000"))
+COLUMNAR_MIN_RELOAD_INTERVAL = 30
+COLUMNAR_IDLE_TAIL_INTERVAL = 60
+COLUMNAR_BATCH_SIZE = 50000
+
+# (name, dtype) of the per-row arrays
+COLUMNS = (
+    ("id", "int64"),
+    ("ts", "datetime64[us]"),
+    ("host", "int32"),
+    ("source", "int32"),
+    ("column", "int32"),
+    ("detected", "int32"),
+)
+ROW_BYTES = 8 + 8 + 4 * 4
+# Rough per-entry cost of a vocabulary string (object header, dict slot)
+VOCAB_OVERHEAD = 100
+
+
+class Vocab:
+    """Append-only string dictionary; None is a value like any other."""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+        self.nbytes = 0
+
+    def encode(self, value) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+            self.nbytes += VOCAB_OVERHEAD + (len(value) if value else 0)
+        return code
+
+
+def empty_base():
+    import pandas as pd
+
+    return pd.DataFrame({
+        "host": pd.Series([], dtype="int32"),
+        "source": pd.Series([], dtype="int32"),
+        "detected": pd.Series([], dtype="int32"),
+        "count": pd.Series([], dtype="int64"),
+    })
+
+
+class ColumnarSnapshot:
+    """Read-only view of the cache at one point in time."""
+
+    def __init__(self, store, n):
+        self.n = n
+        self.columns = {name: array[:n] for name, array in store.arrays.items()}
+        # Vocabularies only grow, so the lengths pin this snapshot's view
+        self.vocab_sizes = {name: len(v.values) for name, v in store.vocabs.items()}
+        self.vocabs = store.vocabs
+        self.base = store.base
+        self.base_max_ts = store.base_max_ts
+        self.base_has_null_ts = store.base_has_null_ts
+        self.watermark = store.watermark
+        self.loaded_at = store.loaded_at
+
+    def values(self, name):
+        return self.vocabs[name].values[:self.vocab_sizes[name]]
+
+    def code(self, name, value):
+        code = self.vocabs[name].codes.get(value)
+        return code if code is not None and code < self.vocab_sizes[name] else None
+
+    def hostnames(self):
+        return sorted(v for v in self.values("host") if v is not None)
+
+    def sources(self):
+        return sorted(v for v in self.values("source") if v is not None)
+
+    def count_matching(self, hostname=None, source=None) -> int:
+        """COUNT(*) with the dashboard's exact-match hostname/source filters."""
+        import numpy as np
+
+        mask = np.ones(self.n, dtype=bool)
+        base = self.base
+        for name, value in (("host", hostname), ("source", source)):
+            if not value:
+                continue
+            code = self.code(name, value)
+            if code is None:
+                return 0
+            mask &= self.columns[name] == code
+            base = base[base[name] == code]
+        return int(np.count_nonzero(mask)) + int(base["count"].sum())
+
+    def detected_counts(self):
+        """[(detected, count)] like SELECT detected, COUNT(*) ... GROUP BY detected."""
+        import numpy as np
+
+        size = self.vocab_sizes["detected"]
+        counts = np.bincount(self.columns["detected"], minlength=size).astype("int64")
+        if len(self.base):
+            by_code = self.base.groupby("detected")["count"].sum()
+            np.add.at(counts, by_code.index.to_numpy(), by_code.to_numpy())
+        values = self.values("detected")
+        return [(values[code], int(c)) for code, c in enumerate(counts) if c > 0]
+
+    def latest_rows(self, pii_filter: str = None, limit: int = 100):
+        """
+        The newest `limit` rows, optionally with `detected` containing
+        pii_filter (LIKE '%filter%'), or None when the answer might include
+        rows that only exist in the aggregate.
+        """
+        import numpy as np
+
+        detected = self.columns["detected"]
+        if pii_filter:
+            codes = [c for c, v in enumerate(self.values("detected")) if v is not None and pii_filter in v]
+            idx = np.flatnonzero(np.isin(detected, codes))
+            base_matches = int(self.base.loc[self.base["detected"].isin(codes), "count"].sum())
+        else:
+            idx = np.arange(self.n)
+            base_matches = int(self.base["count"].sum())
+
+        ts = self.columns["ts"][idx]
+        if np.isnat(ts).any() or (base_matches and self.base_has_null_ts):
+            # Postgres sorts NULL timestamps first in DESC order
+            return None
+        if len(idx) < limit and base_matches:
+            return None
+
+        order = ts.astype("int64")
+        if len(idx) > limit:
+            top = np.argpartition(-order, limit - 1)[:limit]
+        else:
+            top = np.arange(len(idx))
+        top = top[np.argsort(-order[top], kind="stable")]
+        chosen = idx[top]
+        if base_matches and self.base_max_ts is not None and len(chosen) \
+                and self.columns["ts"][chosen[-1]] < self.base_max_ts:
+            return None
+
+        hosts, sources = self.values("host"), self.values("source")
+        columns, detected_values = self.values("column"), self.values("detected")
+        timestamps = self.columns["ts"][chosen].tolist()
+        return [
+            (hosts[h], sources[s], columns[c], detected_values[d], t)
+            for h, s, c, d, t in zip(
+                self.columns["host"][chosen].tolist(),
+                self.columns["source"][chosen].tolist(),
+                self.columns["column"][chosen].tolist(),
+                self.columns["detected"][chosen].tolist(),
+                timestamps,
+            )
+        ]
+
+
+class ColumnStore:
+    """Writer side of the cache; only touched by refresh_columnar_cache()."""
+
+    def __init__(self, capacity: int = 1 << 16):
+        import numpy as np
+
+        self.n = 0
+        self.arrays = {name: np.empty(capacity, dtype) for name, dtype in COLUMNS}
+        self.vocabs = {name: Vocab() for name in ("host", "source", "column", "detected")}
+        self.base = empty_base()
+        self.base_max_ts = None
+        self.base_has_null_ts = False
+        self.watermark = 0
+        # Ids cached above scan_floor; tails re-read from the floor
+        self.seen_ids = set()
+        self.scan_floor = 0
+        # (watermark, snapshot xmax) of recent reads, oldest first
+        self.checkpoints = []
+        self.stale = False
+        self.write_stats = None
+        self.loaded_at = 0.0
+
+    @property
+    def capacity(self) -> int:
+        return len(self.arrays["id"])
+
+    def nbytes(self) -> int:
+        vocab = sum(v.nbytes for v in self.vocabs.values())
+        return self.capacity * ROW_BYTES + vocab + len(self.base) * 20
+
+    def row_budget(self) -> int:
+        vocab = sum(v.nbytes for v in self.vocabs.values())
+        available = COLUMNAR_MEMORY_MB * 1024 * 1024 - vocab - len(self.base) * 20
+        return max(1024, available // ROW_BYTES)
+
+    def resize(self, capacity: int):
+        import numpy as np
+
+        for name, dtype in COLUMNS:
+            array = np.empty(capacity, dtype)
+            array[:self.n] = self.arrays[name][:self.n]
+            self.arrays[name] = array
+
+    def append(self, rows):
+        """Append (id, hostname, source, column_name, detected, timestamp) rows."""
+        import numpy as np
+
+        k = len(rows)
+        if not k:
+            return
+        if self.n + k > self.capacity:
+            self.resize(max(2 * self.capacity, self.n + k))
+
+        ids, hosts, sources, columns, detected, ts = zip(*rows)
+        end = self.n + k
+        a = self.arrays
+        a["id"][self.n:end] = ids
+        a["ts"][self.n:end] = np.array(ts, dtype="datetime64[us]")
+        for name, values in (("host", hosts), ("source", sources),
+                             ("column", columns), ("detected", detected)):
+            encode = self.vocabs[name].encode
+            a[name][self.n:end] = [encode(v) for v in values]
+        self.n = end
+
+    def add_base(self, grouped):
+        """Fold (hostname, source, detected, count, max_ts, has_null_ts) groups into the aggregate."""
+        import pandas as pd
+
+        if not grouped:
+            return
+        frame = pd.DataFrame({
+            "host": [self.vocabs["host"].encode(g[0]) for g in grouped],
+            "source": [self.vocabs["source"].encode(g[1]) for g in grouped],
+            "detected": [self.vocabs["detected"].encode(g[2]) for g in grouped],
+            "count": [g[3] for g in grouped],
+        })
+        self.merge_base(frame)
+        max_ts = max((g[4] for g in grouped if g[4] is not None), default=None)
+        if max_ts is not None:
+            self.raise_base_max_ts(max_ts)
+        self.base_has_null_ts = self.base_has_null_ts or any(g[5] for g in grouped)
+
+    def merge_base(self, frame):
+        import pandas as pd
+
+        merged = pd.concat([self.base, frame], ignore_index=True)
+        self.base = (merged.groupby(["host", "source", "detected"], sort=False)["count"]
+                     .sum().reset_index().astype({"host": "int32", "source": "int32",
+                                                  "detected": "int32", "count": "int64"}))
+
+    def raise_base_max_ts(self, ts):
+        import numpy as np
+
+        ts = np.datetime64(ts, "us")
+        if self.base_max_ts is None or ts > self.base_max_ts:
+            self.base_max_ts = ts
+
+    def evict(self, count: int):
+        """Fold the first `count` rows (oldest ids) into the aggregate."""
+        import numpy as np
+        import pandas as pd
+
+        count = min(count, self.n)
+        if count <= 0:
+            return
+        a = self.arrays
+        self.merge_base(pd.DataFrame({
+            "host": a["host"][:count],
+            "source": a["source"][:count],
+            "detected": a["detected"][:count],
+            "count": np.ones(count, dtype="int64"),
+        }))
+        ts = a["ts"][:count]
+        nat = np.isnat(ts)
+        if nat.any():
+            self.base_has_null_ts = True
+        if (~nat).any():
+            self.raise_base_max_ts(ts[~nat].max())
+
+        remaining = self.n - count
+        capacity = max(1 << 16, int(remaining * 1.25))
+        for name, dtype in COLUMNS:
+            array = np.empty(capacity, dtype)
+            array[:remaining] = a[name][count:self.n]
+            a[name] = array
+        self.n = remaining
+
+    def enforce_limits(self):
+        import numpy as np
+
+        # Rows that have aged out of the window, as long as they lead the arrays
+        cutoff = np.datetime64(datetime.now() - timedelta(days=COLUMNAR_WINDOW_DAYS), "us")
+        ts = self.arrays["ts"][:self.n]
+        fresh = ts >= cutoff
+        aged = int(np.argmax(fresh)) if fresh.any() else self.n
+        budget = self.row_budget()
+        over = self.n - budget
+        # Evict a little extra so we do not compact on every refresh
+        self.evict(max(aged, over + budget // 10 if over > 0 else 0))
+        if self.capacity > budget and self.n < budget:
+            self.resize(budget)
+
+
+_store = None
+_snapshot = None
+_refresh_lock = threading.Lock()
+_last_reload = 0.0
+_last_tail = 0.0
+_reload_requested = False
+_tail_requested = True
+stats = {"loads": 0, "tails": 0, "rows_tailed": 0, "invalidations": 0, "last_refresh_ms": None}
+
+
+def get_columnar_cache():
+    """The current snapshot, or None while disabled or not loaded yet."""
+    return _snapshot if COLUMNAR_CACHE else None
+
+
+def publish(store):
+    global _snapshot
+    _snapshot = ColumnarSnapshot(store, store.n)
+
+
+def write_counter(cur):
+    cur.execute("""
+        SELECT COALESCE(n_tup_del + n_tup_upd, 0) FROM pg_stat_user_tables
+        WHERE relname = 'pii_findings'
+    """)
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def current_snapshot(cur):
+    """(xmin, xmax) of the transaction's snapshot as 64-bit xids."""
+    cur.execute("""
+        SELECT pg_snapshot_xmin(s)::text::bigint, pg_snapshot_xmax(s)::text::bigint
+        FROM pg_current_snapshot() AS s
+    """)
+    return cur.fetchone()
+
+
+def advance_floor(store, xmin):
+    """
+    Move the scan floor after a read whose snapshot had `xmin`.
+
+    Every transaction still running at that read got its xid at or after
+    xmin. A checkpoint with xmax <= xmin predates all of them, so their ids
+    lie above its watermark. COLUMNAR_TAIL_OVERLAP is kept as a margin for
+    ids drawn just before an xid was assigned.
+    """
+    usable = [i for i, (_, xmax) in enumerate(store.checkpoints) if xmax <= xmin]
+    if usable:
+        del store.checkpoints[:usable[-1]]
+    while len(store.checkpoints) > 1 and store.watermark - store.checkpoints[0][0] > COLUMNAR_MAX_RESCAN:
+        # A transaction open for this long is caught by the next reload instead
+        del store.checkpoints[0]
+        store.stale = True
+    store.scan_floor = max(0, store.checkpoints[0][0] - COLUMNAR_TAIL_OVERLAP)
+    store.seen_ids = {i for i in store.seen_ids if i > store.scan_floor}
+
+
+def load(conn):
+    """Build a new store from one consistent snapshot of pii_results."""
+    store = ColumnStore()
+    cutoff = datetime.now() - timedelta(days=COLUMNAR_WINDOW_DAYS)
+    conn.rollback()
+    cur = conn.cursor()
+    try:
+        # Checkpoint ahead of the load: the floor if transactions are in flight during it
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM pii_results")
+        watermark = cur.fetchone()[0]
+        store.checkpoints.append((watermark, current_snapshot(cur)[1]))
+        conn.commit()
+
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        xmin, xmax = current_snapshot(cur)
+        store.write_stats = write_counter(cur)
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM pii_results")
+        store.watermark = cur.fetchone()[0]
+        store.checkpoints.append((store.watermark, xmax))
+        advance_floor(store, xmin)
+
+        cur.execute("""
+            SELECT hostname, source, detected, COUNT(*),
+                   MAX(timestamp), bool_or(timestamp IS NULL)
+            FROM pii_results
+            WHERE (timestamp < %s OR timestamp IS NULL) AND id <= %s
+            GROUP BY 1, 2, 3
+        """, (cutoff, store.watermark))
+        store.add_base(cur.fetchall())
+        # Ids the first tail will re-read above the floor
+        cur.execute("SELECT id FROM pii_results WHERE id > %s AND id <= %s",
+                    (store.scan_floor, store.watermark))
+        store.seen_ids = {i for (i,) in cur.fetchall()}
+
+        rows = conn.cursor(name="columnar_load")
+        rows.itersize = COLUMNAR_BATCH_SIZE
+        rows.execute("""
+            SELECT id, hostname, source, column_name, detected, timestamp
+            FROM pii_results WHERE timestamp >= %s AND id <= %s
+            ORDER BY id
+        """, (cutoff, store.watermark))
+        while True:
+            batch = rows.fetchmany(COLUMNAR_BATCH_SIZE)
+            if not batch:
+                break
+            store.append(batch)
+            if store.n > store.row_budget():
+                store.enforce_limits()
+        rows.close()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    store.enforce_limits()
+    store.loaded_at = time.time()
+    return store
+
+
+def tail(conn, store):
+    """Append rows committed since the last refresh. Returns the number added."""
+    added = 0
+    conn.rollback()
+    cur = conn.cursor()
+    try:
+        # One snapshot for all batches, so the checkpoint matches what was read
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        xmin, xmax = current_snapshot(cur)
+        after = store.scan_floor
+        while True:
+            cur.execute("""
+                SELECT id, hostname, source, column_name, detected, timestamp
+                FROM pii_results WHERE id > %s ORDER BY id LIMIT %s
+            """, (after, COLUMNAR_BATCH_SIZE))
+            batch = cur.fetchall()
+            if not batch:
+                break
+            new = [r for r in batch if r[0] > store.watermark or r[0] not in store.seen_ids]
+            store.append(new)
+            store.seen_ids.update(r[0] for r in new)
+            added += len(new)
+            after = batch[-1][0]
+            if len(batch) < COLUMNAR_BATCH_SIZE:
+                break
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    store.watermark = max(store.watermark, after)
+    store.checkpoints.append((store.watermark, xmax))
+    advance_floor(store, xmin)
+    store.enforce_limits()
+    return added
+
+
+def needs_reload(conn, store) -> bool:
+    if time.time() - _last_reload < COLUMNAR_RELOAD_INTERVAL:
+        return False
+    if store.stale:
+        return True
+    cur = conn.cursor()
+    try:
+        changed = write_counter(cur) != store.write_stats
+        conn.commit()
+    finally:
+        cur.close()
+    return changed
+
+
+def invalidate_columnar(change):
+    """Invalidation handler for pii_results; None (missed notifications) reloads."""
+    global _reload_requested, _tail_requested
+    stats["invalidations"] += 1
+    if change is None or change.get("op") != "insert":
+        _reload_requested = True
+    _tail_requested = True
+
+
+def refresh_columnar_cache(conn):
+    """Load the cache on first use, then keep it current. Skips if a refresh is running."""
+    global _store, _last_reload, _last_tail, _reload_requested, _tail_requested
+    if not COLUMNAR_CACHE or not _refresh_lock.acquire(blocking=False):
+        return
+    try:
+        started = time.perf_counter()
+        now = time.time()
+        reload_due = _reload_requested and now - _last_reload >= COLUMNAR_MIN_RELOAD_INTERVAL
+        if _store is None or reload_due or needs_reload(conn, _store):
+            # Cleared first so changes committed during the load request another
+            _reload_requested = _tail_requested = False
+            try:
+                _store = load(conn)
+            except Exception:
+                _reload_requested = True
+                raise
+            _last_reload = _last_tail = time.time()
+            stats["loads"] += 1
+        elif _tail_requested or not listening() or now - _last_tail >= COLUMNAR_IDLE_TAIL_INTERVAL:
+            _tail_requested = False
+            stats["rows_tailed"] += tail(conn, _store)
+            _last_tail = now
+            stats["tails"] += 1
+        else:
+            return
+        publish(_store)
+        stats["last_refresh_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    finally:
+        _refresh_lock.release()
+
+
+def get_columnar_stats():
+    snapshot = get_columnar_cache()
+    if snapshot is None:
+        return {"enabled": COLUMNAR_CACHE, "loaded": False}
+    return dict(
+        stats,
+        enabled=True,
+        loaded=True,
+        rows=snapshot.n,
+        aggregated_groups=len(snapshot.base),
+        watermark=snapshot.watermark,
+        memory_mb=round(_store.nbytes() / (1024 * 1024), 1) if _store else None,
+        budget_mb=COLUMNAR_MEMORY_MB,
+        loaded_at=datetime.fromtimestamp(snapshot.loaded_at).isoformat(),
+    )
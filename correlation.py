@@ -0,0 +1,277 @@
+# correlation.py
+"""
+Cross-host column correlation index.
+
+column_index maps a normalized column name to every host, source and
+detection type where it has been seen, so lineage questions like "which
+other hosts have a customer_email column with email PII?" read a handful of
+index rows instead of self-joining pii_results. Names are normalized by
+normalize_column(): customerEmail, CUSTOMER_EMAIL, "Customer-Email" and
+crm.customers.customer_email all map to customer_email. Every row also
+keeps the source's basename, so copies of the same file on different hosts
+can be found as well.
+
+update_column_index() is called by the ingest path in the same transaction
+as the findings, with sign=-1 when findings are deleted. Like the host
+summary, the index keeps counting archived findings. refresh_column_index()
+rebuilds it from pii_history, which includes the archived rollups (run it
+after changing normalize_column()); init_db() runs it on upgrade when the
+index is still empty.
+"""
+import re
+import argparse
+
+from trends import split_detected
+from dimensions import resolve
+
+CORRELATION_MAX_ROWS = 5000
+
+_CAMEL_BOUNDARY = re.compile(r"(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])")
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+_QUOTES = "\"'`[] "
+
+
+def normalize_column(name) -> str:
+    """Canonical spelling of a column name; '' when nothing is left."""
+    if not name:
+        return ""
+    # schema.table.column and nested keys: the last part names the data
+    name = name.strip(_QUOTES).rsplit(".", 1)[-1].strip(_QUOTES)
+    name = _CAMEL_BOUNDARY.sub("_", name)
+    return _NON_ALNUM.sub("_", name.lower()).strip("_")
+
+
+def source_basename(source) -> str:
+    """Final path component of a source, lower-cased."""
+    if not source:
+        return ""
+    return re.split(r"[/\\]", source.rstrip("/\\"))[-1].lower()
+
+
+def index_entries(rows, sign: int = 1):
+    """Aggregate (hostname, source, column_name, detected, timestamp) rows per index key."""
+    entries = {}
+    for hostname, source, column_name, detected, ts in rows:
+        key = normalize_column(column_name)
+        if not key:
+            continue
+        for d in split_detected(detected):
+            k = (key, d, hostname or "", source or "")
+            count, last_seen, _ = entries.get(k, (0, ts, column_name))
+            if ts is not None and (last_seen is None or ts > last_seen):
+                last_seen = ts
+            entries[k] = (count + sign, last_seen, column_name)
+    return entries
+
+
+def update_column_index(cur, rows, sign: int = 1):
+    """Fold inserted (sign=1) or deleted (sign=-1) rows into column_index."""
+    from psycopg2.extras import execute_values
+
+    entries = index_entries(rows, sign)
+    if not entries:
+        return
+
+    host_ids = resolve(cur, "host", {k[2] for k in entries})
+    source_ids = resolve(cur, "source", {k[3] for k in entries})
+
+    if sign > 0:
+        execute_values(cur, """
+            INSERT INTO column_index
+                (column_key, detected, host_id, source_id, source_base, column_name, finding_count, last_seen)
+            VALUES %s
+            ON CONFLICT (column_key, detected, host_id, source_id) DO UPDATE
+            SET finding_count = column_index.finding_count + EXCLUDED.finding_count,
+                last_seen = GREATEST(column_index.last_seen, EXCLUDED.last_seen),
+                column_name = EXCLUDED.column_name
+        """, sorted(
+            (key, d, host_ids[h], source_ids[s], source_basename(s), name, count, last_seen)
+            for (key, d, h, s), (count, last_seen, name) in entries.items()
+        ))
+        return
+
+    deltas = sorted(
+        (key, d, host_ids[h], source_ids[s], count)
+        for (key, d, h, s), (count, _, _) in entries.items()
+    )
+    execute_values(cur, """
+        UPDATE column_index c SET finding_count = c.finding_count + v.delta
+        FROM (VALUES %s) AS v (column_key, detected, host_id, source_id, delta)
+        WHERE c.column_key = v.column_key AND c.detected = v.detected
+          AND c.host_id = v.host_id AND c.source_id = v.source_id
+    """, deltas)
+    execute_values(cur, """
+        DELETE FROM column_index c
+        USING (VALUES %s) AS v (column_key, detected, host_id, source_id)
+        WHERE c.column_key = v.column_key AND c.detected = v.detected
+          AND c.host_id = v.host_id AND c.source_id = v.source_id
+          AND c.finding_count <= 0
+    """, [d[:4] for d in deltas])
+
+
+def refresh_column_index(conn):
+    """Rebuild column_index from pii_history."""
+    from psycopg2.extras import execute_values
+
+    cur = conn.cursor()
+    try:
+        cur.execute("LOCK TABLE column_index IN SHARE ROW EXCLUSIVE MODE")
+        cur.execute("TRUNCATE column_index")
+        cur.execute("""
+            SELECT hostname, source, column_name, detected, SUM(n), MAX(timestamp)
+            FROM pii_history WHERE column_name IS NOT NULL
+            GROUP BY 1, 2, 3, 4
+        """)
+        entries = {}
+        for hostname, source, column_name, detected, count, last_seen in cur.fetchall():
+            for k, (c, ts, name) in index_entries([(hostname, source, column_name, detected, last_seen)]).items():
+                total, seen, _ = entries.get(k, (0, ts, name))
+                if ts is not None and (seen is None or ts > seen):
+                    seen = ts
+                entries[k] = (total + count, seen, name)
+
+        host_ids = resolve(cur, "host", {k[2] for k in entries})
+        source_ids = resolve(cur, "source", {k[3] for k in entries})
+        execute_values(cur, """
+            INSERT INTO column_index
+                (column_key, detected, host_id, source_id, source_base, column_name, finding_count, last_seen)
+            VALUES %s
+        """, [
+            (key, d, host_ids[h], source_ids[s], source_basename(s), name, count, last_seen)
+            for (key, d, h, s), (count, last_seen, name) in entries.items()
+        ], page_size=5000)
+        conn.commit()
+        return len(entries)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def get_correlation(conn, column: str = None, source: str = None, detected: str = None,
+                    limit: int = CORRELATION_MAX_ROWS):
+    """
+    Hosts and sources where `column` (normalized) and/or a source with the
+    basename of `source` appear, optionally only with `detected` PII.
+    Past `limit` index rows, the ones with the most findings are kept.
+    """
+    key = normalize_column(column)
+    base = source_basename(source)
+    if not key and not base:
+        raise ValueError("column or source is required")
+
+    clauses, params = [], []
+    if key:
+        clauses.append("c.column_key = %s")
+        params.append(key)
+    if base:
+        clauses.append("c.source_base = %s")
+        params.append(base)
+    if detected:
+        clauses.append("c.detected = %s")
+        params.append(detected.strip())
+
+    cur = conn.cursor()
+    try:
+        cur.execute(f"""
+            SELECT h.hostname, s.source, c.column_key, c.column_name, c.detected, c.finding_count, c.last_seen
+            FROM column_index c
+            JOIN hosts h ON h.id = c.host_id
+            JOIN sources s ON s.id = c.source_id
+            WHERE {" AND ".join(clauses)}
+            ORDER BY c.finding_count DESC, h.hostname, s.source, c.column_key
+            LIMIT %s
+        """, params + [limit + 1])
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+
+    truncated = len(rows) > limit
+    hosts = {}
+    for hostname, src, column_key, column_name, d, count, last_seen in rows[:limit]:
+        host = hosts.setdefault(hostname, {"hostname": hostname, "findings": 0, "types": set(), "sources": {}})
+        entry = host["sources"].setdefault((src, column_key), {
+            "source": src, "column_key": column_key, "column_name": column_name,
+            "types": {}, "findings": 0, "last_seen": None,
+        })
+        entry["types"][d] = count
+        entry["findings"] += count
+        if last_seen is not None and (entry["last_seen"] is None or last_seen > entry["last_seen"]):
+            entry["last_seen"] = last_seen
+        host["findings"] += count
+        host["types"].add(d)
+
+    result = []
+    for host in sorted(hosts.values(), key=lambda h: (-h["findings"], h["hostname"])):
+        sources = sorted(host["sources"].values(), key=lambda s: (-s["findings"], s["source"]))
+        for entry in sources:
+            entry["last_seen"] = entry["last_seen"].isoformat() if entry["last_seen"] else None
+        result.append(dict(host, types=sorted(host["types"]), sources=sources))
+
+    return {
+        "column": key or None,
+        "source": base or None,
+        "detected": detected or None,
+        "host_count": len(result),
+        "source_count": sum(len(h["sources"]) for h in result),
+        "truncated": truncated,
+        "hosts": result,
+    }
+
+
+def get_shared_columns(conn, hostname: str = None, detected: str = None,
+                       min_hosts: int = 2, limit: int = 100):
+    """
+    Normalized columns seen on at least `min_hosts` hosts, most widespread
+    first. With `hostname`, only columns that host has.
+    """
+    clauses, params = [], []
+    if hostname is not None:
+        clauses.append("""c.column_key IN (
+            SELECT column_key FROM column_index WHERE host_id = (SELECT id FROM hosts WHERE hostname = %s)
+        )""")
+        params.append(hostname)
+    if detected:
+        clauses.append("c.detected = %s")
+        params.append(detected.strip())
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+
+    cur = conn.cursor()
+    try:
+        cur.execute(f"""
+            SELECT c.column_key, COUNT(DISTINCT c.host_id), COUNT(DISTINCT c.source_id),
+                   SUM(c.finding_count), array_agg(DISTINCT c.detected ORDER BY c.detected)
+            FROM column_index c
+            {where}
+            GROUP BY c.column_key
+            HAVING COUNT(DISTINCT c.host_id) >= %s
+            ORDER BY 2 DESC, 4 DESC, 1
+            LIMIT %s
+        """, params + [min_hosts, limit])
+        return [
+            {"column": key, "hosts": hosts, "sources": sources, "findings": int(findings), "types": types}
+            for key, hosts, sources, findings, types in cur.fetchall()
+        ]
+    finally:
+        cur.close()
+
+
+def main():
+    from db import init_db, get_db_connection, return_db_connection
+
+    parser = argparse.ArgumentParser(description="Rebuild the cross-host column correlation index")
+    parser.parse_args()
+
+    init_db()
+    conn = get_db_connection()
+    try:
+        print("Rebuilding column correlation index...")
+        entries = refresh_column_index(conn)
+        print(f"Column correlation index rebuilt: {entries:,} entries")
+    finally:
+        return_db_connection(conn)
+
+
+if __name__ == "__main__":
+    main()
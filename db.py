@@ -1,58 +1,285 @@
 # db.py
 import os
-import psycopg2
 import re
-from passlib.hash import argon2
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from psycopg2 import pool
+import time
+import threading
+
+from tracing import span, get_cursor_factory
+from invalidation import publish, listening, INVALIDATION
+from dimensions import create_schema as create_dimension_schema
+from correlation import refresh_column_index
+
+# psycopg2 and passlib are imported on first use rather than at import time,
+# which keeps cold starts on scale-to-zero platforms short.
 
 # Create a thread-safe connection pool
 connection_pool = None
 
+# Optional read-only pool on a streaming replica. Dashboard/analytics reads
+# go through get_read_connection(), which falls back to the primary when the
+# replica is not configured, unreachable or lagging too far behind.
+replica_pool = None
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "30"))
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "5"))
+_replica_conn_ids = set()
+_replica_lock = threading.Lock()
+_replica_check_lock = threading.Lock()
+_replica_state = {"healthy": False, "lag": None, "checked_at": 0.0, "error": None}
+
+# Total number of connections all workers of this deployment may open.
+# Each worker takes an equal share, split by WEB_CONCURRENCY. uvicorn only
+# reads that variable as its --workers default, it never exports it, so
+# `uvicorn --workers N` alone leaves every worker assuming it is the only one.
+DB_POOL_BUDGET = int(os.getenv("DB_POOL_BUDGET", "20"))
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+
+# Key for the advisory lock that serialises schema initialisation
+SCHEMA_LOCK_KEY = 7240316
+
+# Bump whenever init_db() gains new DDL; workers that find the stored
+# version already current skip schema verification entirely.
+SCHEMA_VERSION = 15
+
+
+def get_worker_count() -> int:
+    try:
+        return max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+    except ValueError:
+        return 1
+
+
+def get_pool_size():
+    """Return (min, max) connections for this worker's pool."""
+    override = os.getenv("DB_POOL_MAX_PER_WORKER")
+    if override:
+        max_conn = max(1, int(override))
+    else:
+        # The invalidation listener holds one more connection outside the pool
+        max_conn = max(1, DB_POOL_BUDGET // get_worker_count() - (1 if INVALIDATION else 0))
+    return min(DB_POOL_MIN, max_conn), max_conn
+
+
+def get_connection_params():
+    """Keyword arguments for psycopg2.connect() from the environment."""
+    # First try to use DATABASE_URL (Heroku)
+    database_url = os.getenv('DATABASE_URL')
+    if database_url:
+        # Heroku's DATABASE_URL starts with postgres://, but psycopg2 expects postgresql://
+        if database_url.startswith('postgres://'):
+            database_url = database_url.replace('postgres://', 'postgresql://', 1)
+        return {"dsn": database_url}
+
+    # Fallback to individual configuration variables
+    return {
+        "dbname": os.getenv("POSTGRES_DB", "pii_data"),
+        "user": os.getenv("POSTGRES_USER", "postgres"),
+        "password": os.getenv("POSTGRES_PASSWORD", ""),
+        "host": os.getenv("POSTGRES_HOST", "localhost"),
+        "port": os.getenv("POSTGRES_PORT", "5432"),
+    }
+
+
+def get_replica_connection_params():
+    """psycopg2.connect() arguments for the read replica, or None."""
+    replica_url = os.getenv("REPLICA_DATABASE_URL")
+    if not replica_url:
+        return None
+    if replica_url.startswith('postgres://'):
+        replica_url = replica_url.replace('postgres://', 'postgresql://', 1)
+    return {"dsn": replica_url}
+
+
 def init_connection_pool():
     global connection_pool
+    if connection_pool is not None:
+        return True
     try:
-        # First try to use DATABASE_URL (Heroku)
-        database_url = os.getenv('DATABASE_URL')
-        if database_url:
-            # Heroku's DATABASE_URL starts with postgres://, but psycopg2 expects postgresql://
-            if database_url.startswith('postgres://'):
-                database_url = database_url.replace('postgres://', 'postgresql://', 1)
-            
-            connection_pool = pool.SimpleConnectionPool(
-                1, 20,  # min connections, max connections
-                database_url
-            )
-        else:
-            # Fallback to individual configuration variables
-            connection_pool = pool.SimpleConnectionPool(
-                1, 20,  # min connections, max connections
-                dbname=os.getenv("POSTGRES_DB", "pii_data"),
-                user=os.getenv("POSTGRES_USER", "postgres"),
-                password=os.getenv("POSTGRES_PASSWORD", ""),
-                host=os.getenv("POSTGRES_HOST", "localhost"),
-                port=os.getenv("POSTGRES_PORT", "5432")
-            )
+        from psycopg2 import pool
+
+        workers = get_worker_count()
+        min_conn, max_conn = get_pool_size()
+        if "WEB_CONCURRENCY" not in os.environ and not os.getenv("DB_POOL_MAX_PER_WORKER"):
+            print(f"Warning: WEB_CONCURRENCY is not set; worker pid={os.getpid()} assumes it is "
+                  f"the only worker and may use the whole budget of {DB_POOL_BUDGET} connections. "
+                  f"Set WEB_CONCURRENCY to the worker count (or DB_POOL_MAX_PER_WORKER).")
+        print(f"Worker pid={os.getpid()}: {workers} worker(s), "
+              f"pool size {min_conn}-{max_conn} (budget {DB_POOL_BUDGET})")
+
+        connection_pool = pool.ThreadedConnectionPool(
+            min_conn, max_conn, cursor_factory=get_cursor_factory(), **get_connection_params()
+        )
         return True
     except Exception as e:
         print(f"Error creating connection pool: {str(e)}")
         return False
 
+def init_replica_pool():
+    global replica_pool
+    if replica_pool is not None:
+        return True
+    params = get_replica_connection_params()
+    if params is None:
+        return False
+    try:
+        from psycopg2 import pool
+
+        min_conn, max_conn = get_pool_size()
+        print(f"Worker pid={os.getpid()}: replica pool size {min_conn}-{max_conn}")
+        replica_pool = pool.ThreadedConnectionPool(
+            min_conn, max_conn, cursor_factory=get_cursor_factory(), **params
+        )
+        return True
+    except Exception as e:
+        print(f"Error creating replica connection pool: {str(e)}")
+        _replica_state.update(healthy=False, error=str(e), checked_at=time.monotonic())
+        return False
+
+def check_replica():
+    """Measure replica health and replay lag, updating the cached state."""
+    conn = None
+    try:
+        conn = replica_pool.getconn()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT CASE
+                WHEN NOT pg_is_in_recovery() THEN 0
+                WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+            END
+        """)
+        lag = float(cur.fetchone()[0])
+        cur.close()
+        conn.rollback()
+        healthy = lag <= REPLICA_MAX_LAG_SECONDS
+        _replica_state.update(healthy=healthy, lag=lag, error=None if healthy else "replica lag too high")
+        if not healthy:
+            print(f"Replica lag {lag:.1f}s exceeds {REPLICA_MAX_LAG_SECONDS}s, reading from primary")
+    except Exception as e:
+        _replica_state.update(healthy=False, lag=None, error=str(e))
+        print(f"Replica health check failed, reading from primary: {str(e)}")
+        if conn is not None:
+            replica_pool.putconn(conn, close=True)
+            conn = None
+    finally:
+        _replica_state["checked_at"] = time.monotonic()
+        if conn is not None:
+            replica_pool.putconn(conn)
+
+def replica_available() -> bool:
+    if replica_pool is None and not init_replica_pool():
+        return False
+    if time.monotonic() - _replica_state["checked_at"] >= REPLICA_CHECK_INTERVAL:
+        # One thread re-checks; the others keep using the last known state
+        if _replica_check_lock.acquire(blocking=False):
+            try:
+                check_replica()
+            finally:
+                _replica_check_lock.release()
+    return _replica_state["healthy"]
+
+def get_replica_status():
+    return {
+        "configured": get_replica_connection_params() is not None,
+        "healthy": _replica_state["healthy"],
+        "lag_seconds": _replica_state["lag"],
+        "error": _replica_state["error"],
+    }
+
 def get_db_connection():
     global connection_pool
     if connection_pool is None:
         init_connection_pool()
-    return connection_pool.getconn()
+    with span("db.pool.checkout", pool="primary"):
+        return connection_pool.getconn()
+
+def get_read_connection():
+    """Connection for read-only queries: the replica when usable, else the primary."""
+    if replica_available():
+        try:
+            with span("db.pool.checkout", pool="replica"):
+                conn = replica_pool.getconn()
+            with _replica_lock:
+                _replica_conn_ids.add(id(conn))
+            return conn
+        except Exception as e:
+            _replica_state.update(healthy=False, error=str(e), checked_at=time.monotonic())
+            print(f"Replica unavailable, reading from primary: {str(e)}")
+    return get_db_connection()
 
 def return_db_connection(conn):
     global connection_pool
-    if connection_pool is not None:
+    with _replica_lock:
+        from_replica = id(conn) in _replica_conn_ids
+        _replica_conn_ids.discard(id(conn))
+    if from_replica:
+        if replica_pool is not None:
+            # Reads never need to keep a transaction open on the replica
+            try:
+                conn.rollback()
+                replica_pool.putconn(conn)
+            except Exception:
+                replica_pool.putconn(conn, close=True)
+    elif connection_pool is not None:
         connection_pool.putconn(conn)
 
+def warm_connection_pool():
+    """Open and ping the pool's idle connections ahead of the first request."""
+    init_connection_pool()
+    conns = []
+    try:
+        for _ in range(connection_pool.minconn):
+            conn = get_db_connection()
+            conns.append(conn)
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+    finally:
+        for conn in conns:
+            return_db_connection(conn)
+
+    if init_replica_pool():
+        check_replica()
+
+def check_db_connection() -> bool:
+    """Cheap round trip used by the readiness probe."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.close()
+        conn.rollback()
+        return True
+    except Exception as e:
+        print(f"Database readiness check failed: {str(e)}")
+        return False
+    finally:
+        if conn is not None:
+            return_db_connection(conn)
+
+def close_connection_pool():
+    global connection_pool, replica_pool
+    if connection_pool is not None:
+        connection_pool.closeall()
+        connection_pool = None
+    if replica_pool is not None:
+        replica_pool.closeall()
+        replica_pool = None
+
 def insert_sample_data():
+    """Insert a handful of demo findings into an empty pii_results.
+
+    For realistic volumes use generate_dataset.py instead.
+    """
+    from datetime import datetime, timedelta
+    from ingest import insert_findings
+
+    conn = None
     try:
         print("Inserting sample data...")
         conn = get_db_connection()
@@ -61,29 +288,31 @@ def insert_sample_data():
         # Check if data already exists
         cur.execute("SELECT COUNT(*) FROM pii_results")
         count = cur.fetchone()[0]
-        
+        cur.close()
+
         if count == 0:
-            # Sample data with various PII types and sources
+            # (hostname, source, column_name, detected) across the detection types
             sample_data = [
-                ("server1.example.com", "/var/log/app.log", "email", "log_analysis", "user_email", "email detected: john.doe@example.com"),
-                ("server1.example.com", "/home/user/documents/report.pdf", "phone", "document_scan", "contact", "phone number found: +1-555-0123"),
-                ("server2.example.com", "/data/customer/info.xlsx", "credit_card", "database_scan", "payment_info", "credit card pattern detected"),
-                ("server2.example.com", "/usr/local/data/records.csv", "pan", "file_scan", "id_column", "PAN number detected in records"),
-                ("server3.example.com", "/opt/data/forms/kyc.pdf", "aadhaar", "form_analysis", "id_proof", "Aadhaar number detected"),
-                ("server3.example.com", "/var/www/uploads/user_data.json", "email", "web_scan", "contact_info", "multiple email addresses found"),
-                ("server4.example.com", "/home/admin/backups/users.db", "phone", "backup_scan", "phone_field", "phone numbers in backup"),
-                ("server4.example.com", "/etc/config/settings.yml", "credit_card", "config_scan", "api_data", "encrypted credit card data"),
-                ("server5.example.com", "/var/log/transactions.log", "pan", "log_scan", "transaction_id", "PAN in transaction logs"),
-                ("server5.example.com", "/data/archive/2025/records.txt", "aadhaar", "archive_scan", "customer_id", "Aadhaar numbers in archive")
+                ("server1.example.com", "/var/log/app.log", "user_email", "email"),
+                ("server1.example.com", "/home/user/documents/report.pdf", "contact", "phone"),
+                ("server2.example.com", "/data/customer/info.xlsx", "payment_info", "credit_card"),
+                ("server2.example.com", "/usr/local/data/records.csv", "id_column", "pan"),
+                ("server3.example.com", "/opt/data/forms/kyc.pdf", "id_proof", "aadhaar, pan"),
+                ("server3.example.com", "/var/www/uploads/user_data.json", "contact_info", "email, phone"),
+                ("server4.example.com", "/home/admin/backups/users.db", "phone_field", "phone"),
+                ("server4.example.com", "/etc/config/settings.yml", "api_data", "credit_card"),
+                ("server5.example.com", "/var/log/transactions.log", "transaction_id", "pan"),
+                ("server5.example.com", "/data/archive/2025/records.txt", "customer_id", "aadhaar"),
+            ]
+            now = datetime.now()
+            rows = [
+                (hostname, source, column_name, detected, now - timedelta(hours=i))
+                for i, (hostname, source, column_name, detected) in enumerate(sample_data)
             ]
 
-            cur.executemany("""
-                INSERT INTO pii_results (hostname, file_path, pii_type, source, column_name, detected)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, sample_data)
-
+            insert_findings(conn, rows)
             conn.commit()
-            print(f"Inserted {len(sample_data)} sample records")
+            print(f"Inserted {len(rows)} sample records")
         else:
             print("Sample data already exists, skipping insertion")
 
@@ -91,10 +320,21 @@ def insert_sample_data():
     except Exception as e:
         print(f"Error inserting sample data: {str(e)}")
         if conn:
+            conn.rollback()
             return_db_connection(conn)
         raise
 
+def schema_is_current(cur) -> bool:
+    """True when schema_version already records SCHEMA_VERSION or newer."""
+    cur.execute("SELECT to_regclass('schema_version')")
+    if cur.fetchone()[0] is None:
+        return False
+    cur.execute("SELECT version FROM schema_version WHERE id = 1")
+    row = cur.fetchone()
+    return row is not None and row[0] >= SCHEMA_VERSION
+
 def init_db():
+    conn = None
     try:
         print("Initializing connection pool...")
         if not init_connection_pool():
@@ -105,6 +345,28 @@ def init_db():
         cur = conn.cursor()
         print("Successfully connected to database")
 
+        if schema_is_current(cur):
+            conn.commit()
+            return_db_connection(conn)
+            conn = None
+            print(f"Schema already at version {SCHEMA_VERSION}, skipping initialization")
+            return
+
+        # Only one worker runs the DDL at a time; the others block here and
+        # then find every CREATE ... IF NOT EXISTS already satisfied. The
+        # lock is released when this transaction commits.
+        print(f"Waiting for schema lock (pid={os.getpid()})...")
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_KEY,))
+        print("Schema lock acquired")
+
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                id INTEGER PRIMARY KEY DEFAULT 1,
+                version INTEGER NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
         print("Creating users table...")
         # Create users table if not exists
         cur.execute("""
@@ -117,21 +379,244 @@ def init_db():
         print("Users table created successfully")
 
         
-        # Create the table with the correct schema
+        # Findings keyed by host and source ids, read through the pii_results view (see dimensions.py)
+        create_dimension_schema(cur)
+        print("PII results table created successfully")
+
+        # Time-bucketed counts for the trends API (see trends.py)
+        for table in ("pii_trend_hourly", "pii_trend_daily"):
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    bucket TIMESTAMP NOT NULL,
+                    hostname TEXT NOT NULL,
+                    detected TEXT NOT NULL,
+                    count BIGINT NOT NULL DEFAULT 0,
+                    PRIMARY KEY (bucket, hostname, detected)
+                )
+            """)
+        print("Trend tables created successfully")
+
+        # Per-host exposure summary (see host_summary.py)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS host_summary (
+                hostname TEXT PRIMARY KEY,
+                distinct_sources INTEGER NOT NULL DEFAULT 0,
+                distinct_columns INTEGER NOT NULL DEFAULT 0,
+                finding_count BIGINT NOT NULL DEFAULT 0,
+                last_scan TIMESTAMP,
+                risk_score DOUBLE PRECISION NOT NULL DEFAULT 0
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS host_type_counts (
+                hostname TEXT NOT NULL,
+                detected TEXT NOT NULL,
+                count BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (hostname, detected)
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS host_sources (
+                hostname TEXT NOT NULL,
+                source TEXT NOT NULL,
+                finding_count BIGINT NOT NULL DEFAULT 0,
+                last_seen TIMESTAMP,
+                PRIMARY KEY (hostname, source)
+            )
+        """)
         cur.execute("""
-            CREATE TABLE IF NOT EXISTS pii_results (
+            CREATE TABLE IF NOT EXISTS host_columns (
+                hostname TEXT NOT NULL,
+                source TEXT NOT NULL,
+                column_name TEXT NOT NULL,
+                PRIMARY KEY (hostname, source, column_name)
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_host_summary_risk ON host_summary (risk_score DESC)")
+        print("Host summary tables created successfully")
+
+        # Bulk import bookkeeping (see import_results.py)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS import_checkpoints (
+                path TEXT NOT NULL,
+                range_start BIGINT NOT NULL,
+                byte_offset BIGINT NOT NULL,
+                rows_loaded BIGINT NOT NULL DEFAULT 0,
+                done BOOLEAN NOT NULL DEFAULT FALSE,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (path, range_start)
+            )
+        """)
+        # Timestamp range loaded so far, for the post-import refresh
+        cur.execute("ALTER TABLE import_checkpoints ADD COLUMN IF NOT EXISTS min_ts TIMESTAMP")
+        cur.execute("ALTER TABLE import_checkpoints ADD COLUMN IF NOT EXISTS max_ts TIMESTAMP")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS import_deferred_indexes (
+                indexname TEXT PRIMARY KEY,
+                indexdef TEXT NOT NULL
+            )
+        """)
+        print("Import tables created successfully")
+
+        # HyperLogLog sketches for approximate analytics (see sketches.py)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS pii_sketches (
+                bucket DATE NOT NULL,
+                detected TEXT NOT NULL,
+                dimension TEXT NOT NULL,
+                registers BYTEA NOT NULL,
+                PRIMARY KEY (bucket, detected, dimension)
+            )
+        """)
+        print("Sketch table created successfully")
+
+        # Shared Space-Saving summaries for top-K (see topk.py)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS topk_state (
+                dimension TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        print("Top-K table created successfully")
+
+        # Per-source digests for agent sync (see sync.py)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS source_digests (
+                hostname TEXT NOT NULL,
+                source TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (hostname, source)
+            )
+        """)
+        print("Sync tables created successfully")
+
+        # Manifest of Parquet files holding archived findings (see archive.py)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS archive_files (
                 id SERIAL PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE,
+                partition TEXT NOT NULL,
+                min_ts TIMESTAMP NOT NULL,
+                max_ts TIMESTAMP NOT NULL,
+                row_count BIGINT NOT NULL,
+                hosts TEXT[],
+                bytes BIGINT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_archive_files_range ON archive_files (min_ts, max_ts)")
+        cur.execute("ALTER TABLE archive_files ADD COLUMN IF NOT EXISTS rolled_up BOOLEAN NOT NULL DEFAULT false")
+        # Hourly counts of archived findings, so rebuilds can keep counting them
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS archive_rollup (
+                file_id INTEGER NOT NULL REFERENCES archive_files (id) ON DELETE CASCADE,
                 hostname TEXT,
                 source TEXT,
                 column_name TEXT,
                 detected TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                max_ts TIMESTAMP NOT NULL,
+                row_count INTEGER NOT NULL
             )
         """)
-        print("PII results table created successfully")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_archive_rollup_file ON archive_rollup (file_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_archive_rollup_host ON archive_rollup (hostname)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_archive_rollup_ts ON archive_rollup (max_ts)")
+        # Everything ever ingested: hot rows count 1, archived rollups their row_count
+        cur.execute("""
+            CREATE OR REPLACE VIEW pii_history AS
+            SELECT hostname, source, column_name, detected, timestamp, 1 AS n FROM pii_results
+            UNION ALL
+            SELECT hostname, source, column_name, detected, max_ts, row_count FROM archive_rollup
+        """)
+        print("Archive manifest table created successfully")
+
+        # Alert rules, their rate counters and the alerts raised (see alerts.py)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS alert_rules (
+                id SERIAL PRIMARY KEY,
+                name TEXT NOT NULL,
+                detected TEXT NOT NULL,
+                host_pattern TEXT NOT NULL DEFAULT '*',
+                source_prefix TEXT NOT NULL DEFAULT '',
+                threshold INTEGER NOT NULL DEFAULT 1,
+                window_seconds INTEGER NOT NULL DEFAULT 3600,
+                cooldown_seconds INTEGER NOT NULL DEFAULT 3600,
+                enabled BOOLEAN NOT NULL DEFAULT TRUE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS alert_counters (
+                rule_id INTEGER NOT NULL REFERENCES alert_rules (id) ON DELETE CASCADE,
+                hostname TEXT NOT NULL,
+                slice_start TIMESTAMP NOT NULL,
+                count BIGINT NOT NULL,
+                PRIMARY KEY (rule_id, hostname, slice_start)
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS alerts (
+                id SERIAL PRIMARY KEY,
+                rule_id INTEGER REFERENCES alert_rules (id) ON DELETE SET NULL,
+                dedup_key TEXT NOT NULL,
+                window_start TIMESTAMP NOT NULL,
+                hostname TEXT,
+                source TEXT,
+                detected TEXT,
+                count BIGINT NOT NULL,
+                first_seen TIMESTAMP NOT NULL,
+                last_seen TIMESTAMP NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (rule_id, dedup_key, window_start)
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_alerts_last_seen ON alerts (last_seen)")
+        print("Alert tables created successfully")
+
+        # Normalized column name -> hosts/sources/types (see correlation.py)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS column_index (
+                column_key TEXT NOT NULL,
+                detected TEXT NOT NULL,
+                host_id INTEGER NOT NULL,
+                source_id INTEGER NOT NULL,
+                source_base TEXT NOT NULL,
+                column_name TEXT NOT NULL,
+                finding_count BIGINT NOT NULL DEFAULT 0,
+                last_seen TIMESTAMP,
+                PRIMARY KEY (column_key, detected, host_id, source_id)
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_column_index_source_base ON column_index (source_base)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_column_index_host ON column_index (host_id, column_key)")
+        print("Column correlation index created successfully")
+
+        # Versions of cache invalidation notifications (see invalidation.py)
+        cur.execute("CREATE SEQUENCE IF NOT EXISTS cache_version_seq")
+
+        cur.execute("""
+            INSERT INTO schema_version (id, version) VALUES (1, %s)
+            ON CONFLICT (id) DO UPDATE
+            SET version = EXCLUDED.version, updated_at = CURRENT_TIMESTAMP
+        """, (SCHEMA_VERSION,))
+
+        # Databases upgraded from before column_index have findings but no
+        # index entries; build it while still holding the schema lock so the
+        # other workers find it populated. Commits.
+        cur.execute("""
+            SELECT NOT EXISTS (SELECT 1 FROM column_index)
+               AND EXISTS (SELECT 1 FROM pii_history WHERE column_name IS NOT NULL)
+        """)
+        if cur.fetchone()[0]:
+            print("Building column correlation index from existing findings...")
+            entries = refresh_column_index(conn)
+            print(f"Column correlation index built: {entries:,} entries")
 
         conn.commit()
         return_db_connection(conn)
+        conn = None
         print("Database initialization completed successfully")
 
         # Insert sample data
@@ -139,6 +624,9 @@ def init_db():
 
     except Exception as e:
         print(f"Error initializing database: {str(e)}")
+        if conn is not None:
+            conn.rollback()
+            return_db_connection(conn)
         raise
 
 
@@ -159,12 +647,60 @@ def validate_password(password: str) -> bool:
 
 DB_FILE = "pii_data.db"
 
+# username -> (password_hash, role), or None for unknown users. Only used
+# while the invalidation listener runs, so every worker sees user changes.
+_user_cache = {}
+USER_CACHE_SIZE = 1000
+# Bumped by every users invalidation; a lookup is cached only if it did not move
+_user_generation = 0
+_user_cache_lock = threading.Lock()
+# Cached values may be None (no such user), so misses need their own marker
+_MISSING = object()
+
+
+def get_user(username: str):
+    """(password_hash, role) for a user, or None."""
+    if listening():
+        # One lookup: the listener thread may clear the cache at any point
+        cached = _user_cache.get(username, _MISSING)
+        if cached is not _MISSING:
+            return cached
+    generation = _user_generation
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT password_hash, role FROM users WHERE username=%s", (username,))
+        row = cur.fetchone()
+        conn.commit()
+    finally:
+        return_db_connection(conn)
+    with _user_cache_lock:
+        # A change that committed after the SELECT may already have been
+        # delivered; caching the row read before it would keep it forever
+        if listening() and generation == _user_generation:
+            if len(_user_cache) >= USER_CACHE_SIZE:
+                _user_cache.clear()
+            _user_cache[username] = row
+    return row
+
+
+def invalidate_users(change):
+    """Invalidation handler for the users table."""
+    global _user_generation
+    with _user_cache_lock:
+        _user_generation += 1
+        if change is None or not change.get("k"):
+            _user_cache.clear()
+        else:
+            _user_cache.pop(change["k"], None)
+
+
 def get_all_users():
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute("SELECT username, role FROM users ORDER BY username")
     users = cur.fetchall()
-    conn.close()
+    return_db_connection(conn)
     return users
 
 
@@ -172,8 +708,9 @@ def delete_user(user_name: str):
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute("DELETE FROM users WHERE username=%s", (user_name,))
+    publish(cur, "users", "delete", key=user_name)
     conn.commit()
-    conn.close()
+    return_db_connection(conn)
 
 
 def reset_password(user_name: str, new_password: str):
@@ -184,13 +721,16 @@ def reset_password(user_name: str, new_password: str):
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute("UPDATE users SET password_hash=%s WHERE username=%s", (hashed, user_name))
+    publish(cur, "users", "update", key=user_name)
     conn.commit()
-    conn.close()
+    return_db_connection(conn)
 
 
 def create_user(username: str, password: str, role: str = "user"):
     if not validate_password(password):
         raise ValueError("Password does not meet complexity requirements")
+    from passlib.hash import argon2
+
     conn = get_db_connection()
     cur = conn.cursor()
     password_hash = argon2.hash(password)
@@ -204,21 +744,16 @@ def create_user(username: str, password: str, role: str = "user"):
         """,
         (username, password_hash, role)
     )
+    publish(cur, "users", "update", key=username)
     conn.commit()
-    conn.close()
+    return_db_connection(conn)
 
 def authenticate_user(username: str, password: str) -> bool:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT password_hash FROM users WHERE username=%s", (username,))
-    row = cur.fetchone()
-    conn.close()
+    from passlib.hash import argon2
+
+    row = get_user(username)
     return row is not None and argon2.verify(password, row[0])
 
 def is_admin_user(username: str) -> bool:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT role FROM users WHERE username=%s", (username,))
-    row = cur.fetchone()
-    conn.close()
-    return row is not None and row[0] == "admin"
\ No newline at end of file
+    row = get_user(username)
+    return row is not None and row[1] == "admin"
\ No newline at end of file
@@ -0,0 +1,390 @@
+# dimensions.py
+"""
+Dictionary-encoded hosts and sources.
+
+Findings are stored in pii_findings, with integer keys into the hosts and
+sources tables in place of the repeated hostname and source text. The
+pii_results view joins the names back, so every reader keeps the original
+column layout. An INSTEAD OF INSERT trigger on the view lets older writers
+and ad-hoc scripts keep inserting into pii_results. The ingest paths use
+insert_rows() and copy_rows(), which resolve names through a per-process
+cache and write the keys directly. delete_findings() is the delete path.
+Dimension rows are never updated or deleted, so a cached name -> id
+mapping cannot go stale. Ids created by a transaction that has not
+committed yet are left out of the cache, since it may still roll back.
+
+Migration is online. On a database that still has pii_results as a table,
+init_db() renames it to pii_results_legacy, and the view becomes the
+UNION ALL of both tables. migrate_legacy() then moves the legacy rows over
+in batches. Each batch is inserted and deleted in one transaction, so
+readers see every row exactly once. When the legacy table is empty, it is
+dropped and the view reduced to the join. The migration runs as a
+background job, or to completion with `python dimensions.py`.
+"""
+import io
+import os
+import csv
+import time
+import logging
+import argparse
+
+DIMENSION_CACHE_SIZE = int(os.getenv("DIMENSION_CACHE_SIZE", "100000"))
+DIMENSION_MIGRATE_BATCH = int(os.getenv("DIMENSION_MIGRATE_BATCH", "10000"))
+DIMENSION_MIGRATE_INTERVAL = int(os.getenv("DIMENSION_MIGRATE_INTERVAL", "10"))
+# Seconds of migration work per background job run
+DIMENSION_MIGRATE_SECONDS = 5
+MIGRATION_LOCK_KEY = 7240319
+LEGACY_TABLE = "pii_results_legacy"
+
+logger = logging.getLogger(__name__)
+
+# dimension -> (table, name column)
+DIMENSIONS = {"host": ("hosts", "hostname"), "source": ("sources", "source")}
+
+RESULTS_VIEW = """
+    CREATE OR REPLACE VIEW pii_results AS
+    SELECT f.id, h.hostname, s.source, f.column_name, f.detected, f.timestamp
+    FROM pii_findings f
+    LEFT JOIN hosts h ON h.id = f.host_id
+    LEFT JOIN sources s ON s.id = f.source_id
+"""
+LEGACY_UNION = f"""
+    UNION ALL
+    SELECT id, hostname, source, column_name, detected, timestamp FROM {LEGACY_TABLE}
+"""
+
+
+def create_schema(cur):
+    """DDL for the dimension tables, pii_findings and the pii_results view; run by init_db()."""
+    cur.execute("CREATE TABLE IF NOT EXISTS hosts (id SERIAL PRIMARY KEY, hostname TEXT NOT NULL UNIQUE)")
+    cur.execute("CREATE TABLE IF NOT EXISTS sources (id SERIAL PRIMARY KEY, source TEXT NOT NULL UNIQUE)")
+    # Shared with the pre-dimension table so ids stay unique and increasing
+    cur.execute("CREATE SEQUENCE IF NOT EXISTS pii_results_id_seq")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS pii_findings (
+            id INTEGER PRIMARY KEY DEFAULT nextval('pii_results_id_seq'),
+            host_id INTEGER,
+            source_id INTEGER,
+            column_name TEXT,
+            detected TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("ALTER SEQUENCE pii_results_id_seq OWNED BY pii_findings.id")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_pii_findings_timestamp ON pii_findings (timestamp)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_pii_findings_host_source ON pii_findings (host_id, source_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_pii_findings_source ON pii_findings (source_id)")
+
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('pii_results')")
+    row = cur.fetchone()
+    if row is not None and row[0] == "r":
+        # Pre-dimension layout: keep its rows readable until migrate_legacy() has moved them
+        cur.execute(f"ALTER TABLE pii_results RENAME TO {LEGACY_TABLE}")
+        print(f"Renamed pii_results to {LEGACY_TABLE}; rows are migrated in the background")
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (LEGACY_TABLE,))
+    cur.execute(RESULTS_VIEW + (LEGACY_UNION if cur.fetchone()[0] else ""))
+
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION pii_results_insert() RETURNS trigger AS $$
+        DECLARE
+            hid INTEGER;
+            sid INTEGER;
+        BEGIN
+            IF NEW.hostname IS NOT NULL THEN
+                INSERT INTO hosts (hostname) VALUES (NEW.hostname) ON CONFLICT (hostname) DO NOTHING;
+                SELECT id INTO hid FROM hosts WHERE hostname = NEW.hostname;
+            END IF;
+            IF NEW.source IS NOT NULL THEN
+                INSERT INTO sources (source) VALUES (NEW.source) ON CONFLICT (source) DO NOTHING;
+                SELECT id INTO sid FROM sources WHERE source = NEW.source;
+            END IF;
+            INSERT INTO pii_findings (id, host_id, source_id, column_name, detected, timestamp)
+            VALUES (COALESCE(NEW.id, nextval('pii_results_id_seq')), hid, sid, NEW.column_name,
+                    NEW.detected, COALESCE(NEW.timestamp, CURRENT_TIMESTAMP))
+            RETURNING id INTO NEW.id;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    cur.execute("DROP TRIGGER IF EXISTS pii_results_insert ON pii_results")
+    cur.execute("""
+        CREATE TRIGGER pii_results_insert INSTEAD OF INSERT ON pii_results
+        FOR EACH ROW EXECUTE PROCEDURE pii_results_insert()
+    """)
+
+
+_caches = {dimension: {} for dimension in DIMENSIONS}
+_legacy_done = False
+_migrated_upto = 0
+
+
+def legacy_pending(cur) -> bool:
+    """True while pii_results_legacy still exists; stops asking once it is gone."""
+    global _legacy_done
+    if _legacy_done:
+        return False
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (LEGACY_TABLE,))
+    exists = cur.fetchone()[0]
+    if not exists:
+        _legacy_done = True
+    return exists
+
+
+def resolve(cur, dimension: str, names):
+    """{name: id} for the non-NULL names, creating dimension rows as needed."""
+    table, column = DIMENSIONS[dimension]
+    cache = _caches[dimension]
+    ids = {}
+    missing = []
+    for name in set(names):
+        if name is None:
+            continue
+        key = cache.get(name)
+        if key is None:
+            missing.append(name)
+        else:
+            ids[name] = key
+    if not missing:
+        return ids
+
+    if len(cache) + len(missing) > DIMENSION_CACHE_SIZE:
+        cache.clear()
+    lookup = f"""
+        SELECT {column}, id, xmin::text::bigint = txid_current() %% 4294967296
+        FROM {table} WHERE {column} = ANY(%s)
+    """
+    cur.execute(lookup, (missing,))
+    for name, key, mine in cur.fetchall():
+        ids[name] = key
+        if not mine:
+            cache[name] = key
+
+    new = sorted(set(missing) - set(ids))
+    if new:
+        # Sorted so concurrent writers lock new names in the same order
+        cur.execute(f"""
+            INSERT INTO {table} ({column}) SELECT unnest(%s::text[])
+            ON CONFLICT ({column}) DO NOTHING
+        """, (new,))
+        cur.execute(lookup, (new,))
+        for name, key, mine in cur.fetchall():
+            ids[name] = key
+            if not mine:
+                cache[name] = key
+    return ids
+
+
+def encode_rows(cur, rows):
+    """(hostname, source, ...) rows -> (host_id, source_id, ...) rows."""
+    host_ids = resolve(cur, "host", [r[0] for r in rows])
+    source_ids = resolve(cur, "source", [r[1] for r in rows])
+    return [(host_ids.get(r[0]), source_ids.get(r[1])) + tuple(r[2:]) for r in rows]
+
+
+def insert_rows(cur, rows):
+    """Insert (hostname, source, column_name, detected, timestamp) rows."""
+    from psycopg2.extras import execute_values
+
+    # One multi-row INSERT per page rather than a round trip per row
+    execute_values(cur, """
+        INSERT INTO pii_findings (host_id, source_id, column_name, detected, timestamp)
+        VALUES %s
+    """, encode_rows(cur, rows), page_size=1000)
+
+
+def copy_rows(cur, rows, with_ids: bool = False):
+    """COPY rows into pii_findings; with_ids rows start with their id."""
+    columns = "host_id, source_id, column_name, detected, timestamp"
+    if with_ids:
+        encoded = [(r[0],) + e for r, e in zip(rows, encode_rows(cur, [r[1:] for r in rows]))]
+        columns = "id, " + columns
+    else:
+        encoded = encode_rows(cur, rows)
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in encoded:
+        row = row[:-1] + (row[-1].isoformat(sep=" ") if row[-1] else None,)
+        # An explicit NULL marker, so empty strings stay empty strings
+        writer.writerow(["\\N" if value is None else value for value in row])
+    buf.seek(0)
+    cur.copy_expert(f"COPY pii_findings ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buf)
+
+
+def delete_findings(cur, ids):
+    """Delete findings by id; returns the deleted (hostname, source, column_name, detected, timestamp) rows."""
+    ids = list(ids)
+    rows = []
+    # Legacy first: a row being migrated concurrently is then found in pii_findings
+    if legacy_pending(cur):
+        cur.execute(f"""
+            DELETE FROM {LEGACY_TABLE} WHERE id = ANY(%s)
+            RETURNING hostname, source, column_name, detected, timestamp
+        """, (ids,))
+        rows = cur.fetchall()
+    cur.execute("""
+        WITH deleted AS (
+            DELETE FROM pii_findings WHERE id = ANY(%s)
+            RETURNING host_id, source_id, column_name, detected, timestamp
+        )
+        SELECT h.hostname, s.source, d.column_name, d.detected, d.timestamp
+        FROM deleted d
+        LEFT JOIN hosts h ON h.id = d.host_id
+        LEFT JOIN sources s ON s.id = d.source_id
+    """, (ids,))
+    return rows + cur.fetchall()
+
+
+def distinct_hostnames(cur):
+    """Hostnames that have findings, without scanning pii_findings."""
+    query = "SELECT h.hostname FROM hosts h WHERE EXISTS (SELECT 1 FROM pii_findings f WHERE f.host_id = h.id)"
+    if legacy_pending(cur):
+        query += f" UNION SELECT hostname FROM {LEGACY_TABLE} WHERE hostname IS NOT NULL"
+    cur.execute(query)
+    return [row[0] for row in cur.fetchall()]
+
+
+def distinct_sources(cur):
+    query = "SELECT s.source FROM sources s WHERE EXISTS (SELECT 1 FROM pii_findings f WHERE f.source_id = s.id)"
+    if legacy_pending(cur):
+        query += f" UNION SELECT source FROM {LEGACY_TABLE} WHERE source IS NOT NULL"
+    cur.execute(query)
+    return [row[0] for row in cur.fetchall()]
+
+
+def estimated_rows(cur) -> float:
+    """Planner estimate of the number of findings."""
+    cur.execute("""
+        SELECT COALESCE(SUM(GREATEST(reltuples, 0)), 0) FROM pg_class
+        WHERE relname IN ('pii_findings', %s) AND relkind = 'r'
+    """, (LEGACY_TABLE,))
+    return cur.fetchone()[0]
+
+
+def sampled_results(cur, method: str, percent: float):
+    """(FROM-clause item, params) sampling `percent` of pii_results with TABLESAMPLE `method`."""
+    sample = f"""
+        SELECT h.hostname, s.source, f.column_name, f.detected, f.timestamp
+        FROM pii_findings f TABLESAMPLE {method} (%s)
+        LEFT JOIN hosts h ON h.id = f.host_id
+        LEFT JOIN sources s ON s.id = f.source_id
+    """
+    params = [percent]
+    if legacy_pending(cur):
+        sample += f"""
+            UNION ALL
+            SELECT hostname, source, column_name, detected, timestamp
+            FROM {LEGACY_TABLE} TABLESAMPLE {method} (%s)
+        """
+        params.append(percent)
+    return f"({sample}) AS p", params
+
+
+def migrate_batch(conn, batch_size: int = DIMENSION_MIGRATE_BATCH) -> int:
+    """Move the next batch of legacy rows into pii_findings. Returns rows moved."""
+    global _migrated_upto
+    cur = conn.cursor()
+    try:
+        cur.execute(f"""
+            SELECT id, hostname, source, column_name, detected, timestamp
+            FROM {LEGACY_TABLE} WHERE id > %s ORDER BY id LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (_migrated_upto, batch_size))
+        rows = cur.fetchall()
+        if rows:
+            copy_rows(cur, rows, with_ids=True)
+            cur.execute(f"DELETE FROM {LEGACY_TABLE} WHERE id = ANY(%s)", ([r[0] for r in rows],))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    if rows:
+        _migrated_upto = rows[-1][0]
+    return len(rows)
+
+
+def finish_migration(conn) -> bool:
+    """Drop the legacy table once it is empty and reduce the view to the join."""
+    global _legacy_done
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SELECT EXISTS (SELECT 1 FROM {LEGACY_TABLE})")
+        if cur.fetchone()[0]:
+            # Rows locked by a concurrent delete, or below the keyset; go round again
+            conn.rollback()
+            return False
+        # Give up rather than queue every reader behind the DROP
+        cur.execute("SET LOCAL lock_timeout = '5s'")
+        cur.execute(RESULTS_VIEW)
+        cur.execute(f"DROP TABLE {LEGACY_TABLE}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    _legacy_done = True
+    logger.info("Dimension migration finished; dropped %s", LEGACY_TABLE)
+    return True
+
+
+def migrate_legacy(conn, seconds: float = DIMENSION_MIGRATE_SECONDS, batch_size: int = DIMENSION_MIGRATE_BATCH,
+                   progress: bool = False) -> int:
+    """Migrate legacy rows for up to `seconds` (None: until done). Returns rows moved."""
+    global _migrated_upto
+    cur = conn.cursor()
+    try:
+        locked = False
+        if legacy_pending(cur):
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+            locked = cur.fetchone()[0]
+        conn.commit()
+    finally:
+        cur.close()
+    if not locked:
+        return 0
+
+    moved = 0
+    deadline = None if seconds is None else time.monotonic() + seconds
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            count = migrate_batch(conn, batch_size)
+            moved += count
+            if count:
+                if progress:
+                    logger.info("Migrated %s rows (up to id %s)", f"{moved:,}", _migrated_upto)
+                continue
+            if finish_migration(conn):
+                break
+            # Skipped rows were locked; start over from the lowest id next time
+            _migrated_upto = 0
+            if deadline is not None:
+                break
+            time.sleep(1)
+    finally:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+        conn.commit()
+        cur.close()
+    return moved
+
+
+def main():
+    from db import init_db, get_db_connection, return_db_connection
+
+    parser = argparse.ArgumentParser(description="Move pre-dimension pii_results rows into pii_findings")
+    parser.add_argument("--batch-size", type=int, default=DIMENSION_MIGRATE_BATCH)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    init_db()
+    conn = get_db_connection()
+    try:
+        moved = migrate_legacy(conn, seconds=None, batch_size=args.batch_size, progress=True)
+        print(f"Moved {moved:,} rows")
+    finally:
+        return_db_connection(conn)
+
+
+if __name__ == "__main__":
+    main()
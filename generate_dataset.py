@@ -0,0 +1,293 @@
+"""
+Synthetic pii_results at production scale.
+
+Fills pii_results with realistic findings so dashboard, filter and export
+queries can be reproduced locally at 1M-100M rows:
+
+- hosts and each host's sources follow a Zipf distribution, so a few
+  hosts and files carry most of the findings;
+- column names map to the detection types they would really hold
+  (customer_email -> email, kyc_doc -> aadhaar + pan), with some noise;
+- timestamps span --days, weighted towards recent months and towards the
+  night-time hours when scans run.
+
+Rows are generated deterministically from --seed in parallel chunks and
+loaded with COPY; trend buckets, host summary, sketches and top-K are
+rebuilt at the end, as after a bulk import.
+
+Usage:
+    python generate_dataset.py --rows 1M --truncate
+    python generate_dataset.py --rows 100M --workers 8 --truncate --defer-indexes
+"""
+import os
+import time
+import random
+import bisect
+import argparse
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+from dimensions import legacy_pending, LEGACY_TABLE
+from import_results import connect, copy_batch, defer_indexes, restore_indexes, refresh_derived_tables
+
+# (column name, detected types, relative frequency)
+COLUMN_TYPES = [
+    ("email", ["email"], 30),
+    ("customer_email", ["email"], 20),
+    ("contact_email", ["email"], 10),
+    ("phone", ["phone"], 18),
+    ("mobile_no", ["phone"], 14),
+    ("alt_phone", ["phone"], 5),
+    ("pan_number", ["pan"], 8),
+    ("pan", ["pan"], 4),
+    ("aadhaar_no", ["aadhaar"], 6),
+    ("uid", ["aadhaar"], 2),
+    ("card_number", ["credit_card"], 5),
+    ("cc_num", ["credit_card"], 2),
+    ("contact", ["email", "phone"], 6),
+    ("notes", ["email", "phone"], 4),
+    ("kyc_doc", ["aadhaar", "pan"], 3),
+    ("payment_details", ["credit_card", "phone"], 2),
+]
+DETECTION_TYPES = ["email", "phone", "pan", "aadhaar", "credit_card"]
+# Share of findings where a stray extra type is detected in the column
+NOISE_RATE = 0.03
+
+SOURCE_TEMPLATES = [
+    "/srv/{app}/exports/{table}_{n}.csv",
+    "/data/{app}/archive/{year}/{table}_{n}.parquet",
+    "/home/{user}/Downloads/{table}_{n}.xlsx",
+    "/var/log/{app}/{table}.log",
+    "postgres://{app}-db/{app}.{table}",
+    "mysql://{app}-replica/{app}_prod.{table}",
+    "s3://{app}-backups/{year}/{table}_{n}.json",
+]
+APPS = ["crm", "billing", "kyc", "support", "hr", "loans", "cards", "analytics", "marketing", "ops"]
+TABLES = ["customers", "accounts", "leads", "tickets", "payments", "employees", "applications",
+          "contacts", "orders", "transactions", "users", "subscriptions"]
+USERS = ["asha", "rahul", "meera", "dev", "priya", "arjun", "svc_etl", "backup"]
+# Scan start hours: mostly overnight
+HOUR_WEIGHTS = [9, 10, 10, 9, 7, 5, 3, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 3, 3, 4, 5, 6, 8]
+
+ZIPF_EXPONENT = 1.1
+CHUNK_ROWS = 1000000
+
+
+def parse_count(value: str) -> int:
+    """"2.5M" / "100k" / "1000000" -> int."""
+    value = value.strip().lower().replace("_", "")
+    for suffix, factor in (("k", 1000), ("m", 1000000), ("b", 1000000000)):
+        if value.endswith(suffix):
+            return int(float(value[:-1]) * factor)
+    return int(value)
+
+
+def format_count(n: int) -> str:
+    for factor, suffix in ((1000000000, "B"), (1000000, "M"), (1000, "k")):
+        if n >= factor and n % (factor // 10) == 0:
+            return f"{n / factor:g}{suffix}"
+    return str(n)
+
+
+def zipf_cum_weights(n: int, exponent: float = ZIPF_EXPONENT):
+    total = 0.0
+    cum = []
+    for rank in range(1, n + 1):
+        total += 1.0 / rank ** exponent
+        cum.append(total)
+    return cum
+
+
+def pick(rng, cum_weights):
+    return bisect.bisect_left(cum_weights, rng.random() * cum_weights[-1])
+
+
+def default_hosts(rows: int) -> int:
+    return max(50, rows // 20000)
+
+
+def build_catalog(hosts: int, seed: int):
+    """Hostnames and, per host, its sources and their columns; identical in every worker."""
+    column_cum = []
+    total = 0
+    for _, _, weight in COLUMN_TYPES:
+        total += weight
+        column_cum.append(total)
+
+    catalog = []
+    for h in range(hosts):
+        rng = random.Random(f"{seed}:host:{h}")
+        app = rng.choice(APPS)
+        hostname = f"{app}-{rng.choice(['app', 'db', 'etl', 'fs', 'ws'])}-{h:05d}.corp.example.com"
+        # Source counts are heavy-tailed too: most hosts have a few dozen files
+        n_sources = max(1, min(2000, int(rng.lognormvariate(3.0, 1.0))))
+        sources = []
+        for n in range(n_sources):
+            path = rng.choice(SOURCE_TEMPLATES).format(
+                app=rng.choice([app, app, rng.choice(APPS)]),
+                table=rng.choice(TABLES), n=n, year=rng.randint(2019, 2025), user=rng.choice(USERS),
+            )
+            columns = sorted({
+                COLUMN_TYPES[pick(rng, column_cum)][0] for _ in range(rng.randint(1, 8))
+            })
+            sources.append((path, columns))
+        catalog.append((hostname, sources, zipf_cum_weights(n_sources)))
+    return catalog
+
+
+COLUMN_DETECTED = {name: types for name, types, _ in COLUMN_TYPES}
+
+
+def generate_rows(rng, catalog, host_cum, count, now, days):
+    """Yield `count` (hostname, source, column_name, detected, timestamp) rows."""
+    hour_cum = []
+    total = 0
+    for weight in HOUR_WEIGHTS:
+        total += weight
+        hour_cum.append(total)
+
+    for _ in range(count):
+        hostname, sources, source_cum = catalog[pick(rng, host_cum)]
+        source, columns = sources[pick(rng, source_cum)]
+        column = rng.choice(columns)
+        detected = COLUMN_DETECTED[column]
+        if rng.random() < NOISE_RATE:
+            extra = rng.choice(DETECTION_TYPES)
+            if extra not in detected:
+                detected = detected + [extra]
+        # Density rises towards the present (more hosts scanned every month)
+        day = int(days * (1 - rng.random() ** 0.5))
+        ts = (now - timedelta(days=day)).replace(
+            hour=pick(rng, hour_cum), minute=rng.randrange(60), second=rng.randrange(60), microsecond=0
+        )
+        if ts > now:
+            ts -= timedelta(days=1)
+        yield hostname, source, column, ", ".join(detected), ts
+
+
+def load_chunk(args):
+    """Worker entry point: generate and COPY one chunk of rows."""
+    index, count, hosts, days, seed, batch_size, now = args
+    started = time.perf_counter()
+    catalog = build_catalog(hosts, seed)
+    host_cum = zipf_cum_weights(hosts)
+    rng = random.Random(f"{seed}:chunk:{index}")
+
+    conn = connect()
+    cur = conn.cursor()
+    try:
+        batch = []
+        for row in generate_rows(rng, catalog, host_cum, count, now, days):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                copy_batch(cur, batch)
+                conn.commit()
+                batch = []
+        if batch:
+            copy_batch(cur, batch)
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+    return count, time.perf_counter() - started
+
+
+def truncate_tables(conn):
+    cur = conn.cursor()
+    cur.execute("""
+        TRUNCATE pii_findings, pii_trend_hourly, pii_trend_daily,
+                 host_summary, host_type_counts, host_sources, host_columns,
+                 pii_sketches, topk_state, source_digests, column_index
+        RESTART IDENTITY
+    """)
+    # hosts and sources are kept: running workers cache their ids
+    if legacy_pending(cur):
+        cur.execute(f"TRUNCATE {LEGACY_TABLE}")
+    conn.commit()
+    cur.close()
+
+
+def analyze(conn):
+    old_autocommit = conn.autocommit
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        for table in ("pii_findings", "hosts", "sources"):
+            cur.execute(f"VACUUM ANALYZE {table}")
+    finally:
+        cur.close()
+        conn.autocommit = old_autocommit
+
+
+def generate(rows: int, hosts: int = None, days: int = 180, seed: int = 42, workers: int = None,
+             batch_size: int = 50000, truncate: bool = False, defer: bool = False,
+             skip_refresh: bool = False):
+    """Load `rows` synthetic findings. Returns the load time in seconds."""
+    from db import init_db
+
+    hosts = hosts or default_hosts(rows)
+    workers = workers or os.cpu_count() or 4
+    now = datetime.now().replace(microsecond=0)
+    chunks = [(i, min(CHUNK_ROWS, rows - start), hosts, days, seed, batch_size, now)
+              for i, start in enumerate(range(0, rows, CHUNK_ROWS))]
+
+    init_db()
+    conn = connect()
+    try:
+        if truncate:
+            print("Truncating pii_results and derived tables...")
+            truncate_tables(conn)
+        if defer:
+            dropped = defer_indexes(conn)
+            print(f"Deferred indexes: {', '.join(dropped) or 'none'}")
+
+        print(f"Generating {rows:,} findings over {hosts:,} hosts and {days} days "
+              f"in {len(chunks)} chunk(s) with {workers} worker(s)")
+        started = time.perf_counter()
+        loaded = 0
+        with Pool(workers) as pool:
+            for count, seconds in pool.imap_unordered(load_chunk, chunks):
+                loaded += count
+                print(f"  {loaded:,}/{rows:,} rows ({count / seconds:,.0f} rows/s per worker)")
+        load_seconds = time.perf_counter() - started
+
+        if defer:
+            restored = restore_indexes(conn)
+            print(f"Rebuilt indexes: {', '.join(restored) or 'none'}")
+        if not skip_refresh:
+            refresh_derived_tables(conn, now - timedelta(days=days + 1))
+        print("Analyzing pii_results...")
+        analyze(conn)
+    finally:
+        conn.close()
+
+    print(f"Loaded {loaded:,} rows in {load_seconds:.1f}s ({loaded / load_seconds:,.0f} rows/s)")
+    return load_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill pii_results with synthetic findings")
+    parser.add_argument("--rows", default="1M", help="Number of findings, e.g. 1M, 10M, 100M")
+    parser.add_argument("--hosts", type=int, default=None,
+                        help="Number of hosts (default: one per 20k rows, at least 50)")
+    parser.add_argument("--days", type=int, default=180, help="Time span of the timestamps")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--batch-size", type=int, default=50000, help="Rows per COPY/commit")
+    parser.add_argument("--truncate", action="store_true",
+                        help="Empty pii_results and the derived tables first")
+    parser.add_argument("--defer-indexes", action="store_true",
+                        help="Drop secondary indexes during the load and rebuild them afterwards")
+    parser.add_argument("--skip-refresh", action="store_true",
+                        help="Do not rebuild trend buckets, host summary, sketches and top-K afterwards")
+    args = parser.parse_args()
+
+    generate(parse_count(args.rows), args.hosts, args.days, args.seed, args.workers,
+             args.batch_size, args.truncate, args.defer_indexes, args.skip_refresh)
+
+
+if __name__ == "__main__":
+    main()
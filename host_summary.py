@@ -0,0 +1,343 @@
+# host_summary.py
+"""
+Per-host exposure summary and weighted risk score.
+
+host_summary holds one row per hostname; host_type_counts, host_sources and
+host_columns hold the per-type counts and the distinct sets the summary
+counters are derived from. update_host_summary() is called by the ingest
+path, refresh_host_summary() rebuilds everything from pii_history, i.e.
+pii_results plus the archived rollups (run it after changing
+HOST_RISK_WEIGHTS).
+"""
+import os
+import argparse
+
+from trends import split_detected
+
+DEFAULT_RISK_WEIGHTS = "aadhaar=10,pan=8,credit_card=10,email=2,phone=3"
+
+SORT_COLUMNS = {
+    "risk_score": "risk_score",
+    "hostname": "hostname",
+    "findings": "finding_count",
+    "sources": "distinct_sources",
+    "columns": "distinct_columns",
+    "last_scan": "last_scan",
+}
+
+
+def load_risk_weights(spec: str = None):
+    """Parse HOST_RISK_WEIGHTS ("type=weight,...") into a dict."""
+    spec = spec if spec is not None else os.getenv("HOST_RISK_WEIGHTS", DEFAULT_RISK_WEIGHTS)
+    weights = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, value = item.split("=", 1)
+        weights[name.strip().lower()] = float(value)
+    return weights
+
+
+RISK_WEIGHTS = load_risk_weights()
+DEFAULT_RISK_WEIGHT = float(os.getenv("HOST_RISK_DEFAULT_WEIGHT", "1"))
+
+
+def risk_weight(detected: str) -> float:
+    return RISK_WEIGHTS.get(detected.lower(), DEFAULT_RISK_WEIGHT)
+
+
+def update_host_summary(cur, rows):
+    """
+    Fold (hostname, source, column_name, detected, timestamp) rows into the
+    host summary tables.
+    """
+    from psycopg2.extras import execute_values
+
+    hosts = {}
+    type_counts = {}
+    source_counts = {}
+    columns = set()
+
+    for hostname, source, column_name, detected, ts in rows:
+        hostname = hostname or ""
+        types = split_detected(detected)
+        h = hosts.setdefault(hostname, {"findings": 0, "risk": 0.0, "last_scan": ts})
+        h["findings"] += 1
+        h["last_scan"] = max(h["last_scan"], ts)
+        for d in types:
+            type_counts[(hostname, d)] = type_counts.get((hostname, d), 0) + 1
+            h["risk"] += risk_weight(d)
+        if source:
+            key = (hostname, source)
+            count, last_seen = source_counts.get(key, (0, ts))
+            source_counts[key] = (count + 1, max(last_seen, ts))
+            if column_name:
+                columns.add((hostname, source, column_name))
+
+    if not hosts:
+        return
+
+    new_sources = {}
+    if source_counts:
+        inserted = execute_values(cur, """
+            INSERT INTO host_sources (hostname, source, finding_count, last_seen)
+            VALUES %s
+            ON CONFLICT (hostname, source) DO UPDATE
+            SET finding_count = host_sources.finding_count + EXCLUDED.finding_count,
+                last_seen = GREATEST(host_sources.last_seen, EXCLUDED.last_seen)
+            RETURNING hostname, (xmax = 0)
+        """, [(h, s, c, ts) for (h, s), (c, ts) in sorted(source_counts.items())], fetch=True)
+        for hostname, is_new in inserted:
+            if is_new:
+                new_sources[hostname] = new_sources.get(hostname, 0) + 1
+
+    new_columns = {}
+    if columns:
+        inserted = execute_values(cur, """
+            INSERT INTO host_columns (hostname, source, column_name)
+            VALUES %s
+            ON CONFLICT DO NOTHING
+            RETURNING hostname
+        """, sorted(columns), fetch=True)
+        for (hostname,) in inserted:
+            new_columns[hostname] = new_columns.get(hostname, 0) + 1
+
+    if type_counts:
+        execute_values(cur, """
+            INSERT INTO host_type_counts (hostname, detected, count)
+            VALUES %s
+            ON CONFLICT (hostname, detected) DO UPDATE
+            SET count = host_type_counts.count + EXCLUDED.count
+        """, [(h, d, c) for (h, d), c in sorted(type_counts.items())])
+
+    execute_values(cur, """
+        INSERT INTO host_summary
+            (hostname, distinct_sources, distinct_columns, finding_count, last_scan, risk_score)
+        VALUES %s
+        ON CONFLICT (hostname) DO UPDATE
+        SET distinct_sources = host_summary.distinct_sources + EXCLUDED.distinct_sources,
+            distinct_columns = host_summary.distinct_columns + EXCLUDED.distinct_columns,
+            finding_count = host_summary.finding_count + EXCLUDED.finding_count,
+            last_scan = GREATEST(host_summary.last_scan, EXCLUDED.last_scan),
+            risk_score = host_summary.risk_score + EXCLUDED.risk_score
+    """, [
+        (h, new_sources.get(h, 0), new_columns.get(h, 0), v["findings"], v["last_scan"], v["risk"])
+        for h, v in sorted(hosts.items())
+    ])
+
+
+def refresh_host_summary(conn):
+    """Rebuild all host summary tables from pii_history."""
+    from psycopg2.extras import execute_values
+
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            LOCK TABLE host_summary, host_type_counts, host_sources, host_columns
+            IN SHARE ROW EXCLUSIVE MODE
+        """)
+        cur.execute("TRUNCATE host_summary, host_type_counts, host_sources, host_columns")
+
+        cur.execute("""
+            INSERT INTO host_sources (hostname, source, finding_count, last_seen)
+            SELECT COALESCE(hostname, ''), source, SUM(n), MAX(timestamp)
+            FROM pii_history WHERE source IS NOT NULL
+            GROUP BY 1, 2
+        """)
+        cur.execute("""
+            INSERT INTO host_columns (hostname, source, column_name)
+            SELECT DISTINCT COALESCE(hostname, ''), source, column_name
+            FROM pii_history WHERE source IS NOT NULL AND column_name IS NOT NULL
+        """)
+        cur.execute("""
+            INSERT INTO host_type_counts (hostname, detected, count)
+            SELECT COALESCE(hostname, ''), trim(d), SUM(n)
+            FROM pii_history, unnest(string_to_array(detected, ',')) AS d
+            WHERE trim(d) <> ''
+            GROUP BY 1, 2
+        """)
+        cur.execute("""
+            INSERT INTO host_summary
+                (hostname, distinct_sources, distinct_columns, finding_count, last_scan, risk_score)
+            SELECT COALESCE(hostname, ''), 0, 0, SUM(n), MAX(timestamp), 0
+            FROM pii_history GROUP BY 1
+        """)
+        cur.execute("""
+            UPDATE host_summary hs SET
+                distinct_sources = (SELECT COUNT(*) FROM host_sources s WHERE s.hostname = hs.hostname),
+                distinct_columns = (SELECT COUNT(*) FROM host_columns c WHERE c.hostname = hs.hostname)
+        """)
+
+        cur.execute("SELECT hostname, detected, count FROM host_type_counts")
+        scores = {}
+        for hostname, d, count in cur.fetchall():
+            scores[hostname] = scores.get(hostname, 0.0) + risk_weight(d) * count
+        if scores:
+            execute_values(cur, """
+                UPDATE host_summary SET risk_score = v.score
+                FROM (VALUES %s) AS v (hostname, score)
+                WHERE host_summary.hostname = v.hostname
+            """, list(scores.items()))
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def refresh_host(cur, hostname: str):
+    """
+    Recompute the summary rows of one host from pii_history, e.g. after
+    findings were deleted. Runs inside the caller's transaction.
+    """
+    hostname = hostname or ""
+    for table in ("host_summary", "host_type_counts", "host_sources", "host_columns"):
+        cur.execute(f"DELETE FROM {table} WHERE hostname = %s", (hostname,))
+
+    # Plain equality so the (hostname, source) index applies; NULL hosts
+    # are summarised under ''
+    if hostname:
+        where, params = "hostname = %s", (hostname,)
+    else:
+        where, params = "COALESCE(hostname, '') = ''", ()
+
+    cur.execute(f"""
+        INSERT INTO host_sources (hostname, source, finding_count, last_seen)
+        SELECT %s, source, SUM(n), MAX(timestamp)
+        FROM pii_history WHERE {where} AND source IS NOT NULL
+        GROUP BY source
+    """, (hostname,) + params)
+    cur.execute(f"""
+        INSERT INTO host_columns (hostname, source, column_name)
+        SELECT DISTINCT %s, source, column_name
+        FROM pii_history
+        WHERE {where} AND source IS NOT NULL AND column_name IS NOT NULL
+    """, (hostname,) + params)
+    cur.execute(f"""
+        INSERT INTO host_type_counts (hostname, detected, count)
+        SELECT %s, trim(d), SUM(n)
+        FROM pii_history, unnest(string_to_array(detected, ',')) AS d
+        WHERE {where} AND trim(d) <> ''
+        GROUP BY 2
+    """, (hostname,) + params)
+
+    cur.execute("SELECT detected, count FROM host_type_counts WHERE hostname = %s", (hostname,))
+    risk = sum(risk_weight(d) * count for d, count in cur.fetchall())
+    cur.execute(f"""
+        INSERT INTO host_summary
+            (hostname, distinct_sources, distinct_columns, finding_count, last_scan, risk_score)
+        SELECT %s,
+               (SELECT COUNT(*) FROM host_sources WHERE hostname = %s),
+               (SELECT COUNT(*) FROM host_columns WHERE hostname = %s),
+               SUM(n), MAX(timestamp), %s
+        FROM pii_history WHERE {where}
+        HAVING COUNT(*) > 0
+    """, (hostname, hostname, hostname, risk) + params)
+
+
+def get_host_ranking(conn, sort: str = "risk_score", order: str = "desc",
+                     page: int = 1, page_size: int = 50):
+    """Return one page of hosts ordered by `sort`, with per-type counts."""
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"Unsupported sort column: {sort}")
+    direction = "ASC" if order.lower() == "asc" else "DESC"
+    offset = (page - 1) * page_size
+
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT COUNT(*) FROM host_summary")
+        total = cur.fetchone()[0]
+
+        cur.execute(f"""
+            SELECT hostname, distinct_sources, distinct_columns, finding_count, last_scan, risk_score
+            FROM host_summary
+            ORDER BY {SORT_COLUMNS[sort]} {direction} NULLS LAST, hostname
+            LIMIT %s OFFSET %s
+        """, (page_size, offset))
+        hosts = [
+            {
+                "hostname": r[0],
+                "distinct_sources": r[1],
+                "distinct_columns": r[2],
+                "finding_count": r[3],
+                "last_scan": r[4].isoformat() if r[4] else None,
+                "risk_score": float(r[5]),
+                "type_counts": {},
+            }
+            for r in cur.fetchall()
+        ]
+
+        if hosts:
+            by_name = {h["hostname"]: h for h in hosts}
+            cur.execute(
+                "SELECT hostname, detected, count FROM host_type_counts WHERE hostname = ANY(%s)",
+                (list(by_name),)
+            )
+            for hostname, d, count in cur.fetchall():
+                by_name[hostname]["type_counts"][d] = count
+    finally:
+        cur.close()
+
+    return {"total": total, "page": page, "page_size": page_size,
+            "sort": sort, "order": direction.lower(), "hosts": hosts}
+
+
+def get_host_detail(conn, hostname: str, source_limit: int = 200):
+    """Summary, per-type counts and busiest sources for a single host."""
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT hostname, distinct_sources, distinct_columns, finding_count, last_scan, risk_score
+            FROM host_summary WHERE hostname = %s
+        """, (hostname,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+
+        cur.execute("""
+            SELECT detected, count FROM host_type_counts
+            WHERE hostname = %s ORDER BY count DESC
+        """, (hostname,))
+        type_counts = cur.fetchall()
+
+        cur.execute("""
+            SELECT source, finding_count, last_seen FROM host_sources
+            WHERE hostname = %s ORDER BY finding_count DESC, source
+            LIMIT %s
+        """, (hostname, source_limit))
+        sources = cur.fetchall()
+    finally:
+        cur.close()
+
+    return {
+        "hostname": row[0],
+        "distinct_sources": row[1],
+        "distinct_columns": row[2],
+        "finding_count": row[3],
+        "last_scan": row[4],
+        "risk_score": float(row[5]),
+        "type_counts": type_counts,
+        "sources": sources,
+    }
+
+
+def main():
+    from db import init_db, get_db_connection, return_db_connection
+
+    parser = argparse.ArgumentParser(description="Rebuild the per-host exposure summary")
+    parser.parse_args()
+
+    init_db()
+    conn = get_db_connection()
+    try:
+        print("Rebuilding host summary...")
+        refresh_host_summary(conn)
+        print("Host summary rebuilt successfully")
+    finally:
+        return_db_connection(conn)
+
+
+if __name__ == "__main__":
+    main()
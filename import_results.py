@@ -0,0 +1,385 @@
+"""
+Bulk import of historical scan results into pii_results.
+
+Reads CSV or JSONL files (one PiiRecord-shaped object per row, with an
+optional `timestamp`), validates every row and loads them with COPY through
+several parallel worker processes, each on its own connection.
+
+Progress is checkpointed in the import_checkpoints table in the same
+transaction as each COPY batch, so an interrupted run can simply be started
+again with the same arguments and resumes where it stopped. Checkpoints also
+record the timestamp range loaded, and the derived tables are refreshed from
+the earliest timestamp across every checkpoint of the import, so batches
+loaded by an interrupted run are covered when it is resumed. Each batch
+invalidates the sync digests of its sources and notifies the other workers'
+caches like an ordinary upload.
+
+Usage:
+    python import_results.py scans/*.jsonl scans/*.csv --workers 8
+    python import_results.py scans/ --workers 8 --defer-indexes --batch-size 50000
+
+CSV files need a header row with hostname, source, column_name, detected and
+optionally timestamp; `detected` is either "email, phone" or a JSON list.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from multiprocessing import Pool
+
+from models import normalize_record
+from dimensions import copy_rows
+from sync import invalidate_digests
+from invalidation import publish
+
+# JSONL files larger than this are split into ranges loaded in parallel
+DEFAULT_CHUNK_BYTES = 256 * 1024 * 1024
+
+
+def connect():
+    import psycopg2
+    from db import get_connection_params
+    return psycopg2.connect(**get_connection_params())
+
+
+def detect_format(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".jsonl", ".ndjson", ".json"):
+        return "jsonl"
+    if ext == ".csv":
+        return "csv"
+    raise ValueError(f"Unsupported file type: {path}")
+
+
+def collect_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    if os.path.splitext(name)[1].lower() in (".jsonl", ".ndjson", ".json", ".csv"):
+                        files.append(os.path.join(root, name))
+        else:
+            files.append(path)
+    return [os.path.abspath(f) for f in files]
+
+
+def plan_units(files, chunk_bytes):
+    """Split the input into (path, format, start, end) work units."""
+    units = []
+    for path in files:
+        fmt = detect_format(path)
+        size = os.path.getsize(path)
+        # CSV can carry quoted newlines, so it is only ever read as a whole
+        if fmt == "jsonl" and size > chunk_bytes:
+            for start in range(0, size, chunk_bytes):
+                units.append((path, fmt, start, min(start + chunk_bytes, size)))
+        else:
+            units.append((path, fmt, 0, size))
+    return units
+
+
+class LineReader:
+    """Iterates decoded lines of a binary file while tracking the byte offset."""
+
+    def __init__(self, f, end):
+        self.f = f
+        self.end = end
+        self.offset = f.tell()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.offset >= self.end:
+            raise StopIteration
+        line = self.f.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        return line.decode("utf-8")
+
+
+def parse_csv_detected(value):
+    value = (value or "").strip()
+    if value.startswith("["):
+        return json.loads(value)
+    return value
+
+
+def read_records(path, fmt, start, end, offset, errors):
+    """Yield (row_tuple, offset_after_row) for valid records in the unit."""
+    with open(path, "rb") as f:
+        if fmt == "csv":
+            header = next(csv.reader([f.readline().decode("utf-8-sig")]))
+            if offset > f.tell():
+                f.seek(offset)
+            reader = LineReader(f, end)
+            for values in csv.reader(reader):
+                if not values:
+                    continue
+                data = dict(zip(header, values))
+                try:
+                    data["detected"] = parse_csv_detected(data.get("detected"))
+                    yield normalize_record(data), reader.offset
+                except ValueError as e:
+                    errors.append(f"{path}@{reader.offset}: {e}")
+        else:
+            if offset > start:
+                f.seek(offset)
+            elif start > 0:
+                # The line straddling `start` belongs to the previous range
+                f.seek(start - 1)
+                f.readline()
+            reader = LineReader(f, end)
+            for line in reader:
+                if not line.strip():
+                    continue
+                try:
+                    yield normalize_record(json.loads(line)), reader.offset
+                except ValueError as e:
+                    errors.append(f"{path}@{reader.offset}: {e}")
+
+
+def copy_batch(cur, rows):
+    # Resolves hosts and sources to their dimension ids, then COPYs into pii_findings
+    copy_rows(cur, rows)
+    invalidate_digests(cur, rows)
+    publish(cur, "pii_results", "insert", [r[0] for r in rows], [r[1] for r in rows])
+
+
+def save_checkpoint(cur, unit, offset, rows, done):
+    """Advance the unit's checkpoint past `rows`, widening its timestamp range."""
+    path, _, start, _ = unit
+    timestamps = [r[4] for r in rows if r[4] is not None]
+    cur.execute("""
+        INSERT INTO import_checkpoints
+            (path, range_start, byte_offset, rows_loaded, done, min_ts, max_ts, updated_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (path, range_start) DO UPDATE
+        SET byte_offset = EXCLUDED.byte_offset,
+            rows_loaded = import_checkpoints.rows_loaded + EXCLUDED.rows_loaded,
+            done = EXCLUDED.done,
+            min_ts = LEAST(import_checkpoints.min_ts, EXCLUDED.min_ts),
+            max_ts = GREATEST(import_checkpoints.max_ts, EXCLUDED.max_ts),
+            updated_at = CURRENT_TIMESTAMP
+    """, (path, start, offset, len(rows), done,
+          min(timestamps, default=None), max(timestamps, default=None)))
+
+
+def checkpoint_range(conn, units):
+    """(min_ts, max_ts) over the checkpoints of `units`, from this and earlier runs."""
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT MIN(c.min_ts), MAX(c.max_ts)
+            FROM import_checkpoints c
+            JOIN unnest(%s::text[], %s::bigint[]) AS u (path, range_start)
+              ON c.path = u.path AND c.range_start = u.range_start
+        """, ([u[0] for u in units], [u[2] for u in units]))
+        return cur.fetchone()
+    finally:
+        cur.close()
+
+
+def load_unit(args):
+    """Worker entry point: load one unit, committing a checkpoint per batch."""
+    unit, batch_size, max_errors = args
+    path, fmt, start, end = unit
+    started = time.perf_counter()
+    conn = connect()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "SELECT byte_offset, done FROM import_checkpoints WHERE path = %s AND range_start = %s",
+            (path, start)
+        )
+        row = cur.fetchone()
+        if row and row[1]:
+            return {"unit": unit, "rows": 0, "bytes": 0, "errors": [], "error_count": 0, "skipped": True,
+                    "min_ts": None, "max_ts": None, "seconds": 0.0}
+        offset = row[0] if row else start
+
+        errors = []
+        batch = []
+        loaded = 0
+        min_ts = max_ts = None
+        position = offset
+        for record, position in read_records(path, fmt, start, end, offset, errors):
+            batch.append(record)
+            ts = record[4]
+            min_ts = ts if min_ts is None or ts < min_ts else min_ts
+            max_ts = ts if max_ts is None or ts > max_ts else max_ts
+            if len(batch) >= batch_size:
+                copy_batch(cur, batch)
+                save_checkpoint(cur, unit, position, batch, False)
+                conn.commit()
+                loaded += len(batch)
+                batch = []
+            if max_errors is not None and len(errors) > max_errors:
+                raise ValueError(f"{path}: more than {max_errors} invalid rows, aborting")
+
+        if batch:
+            copy_batch(cur, batch)
+            loaded += len(batch)
+        save_checkpoint(cur, unit, max(position, end), batch, True)
+        conn.commit()
+
+        return {"unit": unit, "rows": loaded, "bytes": end - offset,
+                "errors": errors[:20], "error_count": len(errors),
+                "skipped": False, "min_ts": min_ts, "max_ts": max_ts,
+                "seconds": time.perf_counter() - started}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+
+def defer_indexes(conn):
+    """Drop secondary indexes on pii_findings, remembering their definitions."""
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO import_deferred_indexes (indexname, indexdef)
+        SELECT i.indexname, i.indexdef
+        FROM pg_indexes i
+        JOIN pg_class c ON c.relname = i.indexname
+        JOIN pg_index x ON x.indexrelid = c.oid
+        WHERE i.tablename = 'pii_findings' AND NOT x.indisprimary
+        ON CONFLICT (indexname) DO NOTHING
+    """)
+    cur.execute("SELECT indexname FROM import_deferred_indexes")
+    names = [r[0] for r in cur.fetchall()]
+    for name in names:
+        cur.execute(f'DROP INDEX IF EXISTS "{name}"')
+    conn.commit()
+    cur.close()
+    return names
+
+
+def restore_indexes(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT indexname, indexdef FROM import_deferred_indexes")
+    deferred = cur.fetchall()
+    for name, indexdef in deferred:
+        print(f"Rebuilding index {name}...")
+        cur.execute(indexdef.replace("CREATE INDEX ", "CREATE INDEX IF NOT EXISTS ", 1))
+        cur.execute("DELETE FROM import_deferred_indexes WHERE indexname = %s", (name,))
+        conn.commit()
+    cur.close()
+    return [name for name, _ in deferred]
+
+
+def refresh_derived_tables(conn, min_ts):
+    from trends import refresh_trend_buckets
+    from host_summary import refresh_host_summary
+    from sketches import rebuild_sketches
+    from topk import reseed_topk
+    from correlation import refresh_column_index
+
+    if min_ts is not None:
+        print(f"Rebuilding trend buckets since {min_ts.isoformat()}...")
+        refresh_trend_buckets(conn, min_ts)
+        print(f"Rebuilding distinct-count sketches since {min_ts.isoformat()}...")
+        rebuild_sketches(conn, min_ts)
+    print("Rebuilding host summary...")
+    refresh_host_summary(conn)
+    print("Rebuilding column correlation index...")
+    refresh_column_index(conn)
+    print("Reseeding top-K summaries...")
+    reseed_topk(conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import CSV/JSONL scan results with COPY")
+    parser.add_argument("paths", nargs="+", help="Files or directories to import")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--batch-size", type=int, default=20000,
+                        help="Rows per COPY/commit/checkpoint")
+    parser.add_argument("--chunk-mb", type=int, default=DEFAULT_CHUNK_BYTES // (1024 * 1024),
+                        help="Split JSONL files larger than this into parallel ranges")
+    parser.add_argument("--defer-indexes", action="store_true",
+                        help="Drop secondary indexes during the load and rebuild them afterwards")
+    parser.add_argument("--max-errors", type=int, default=None,
+                        help="Abort a file after this many invalid rows")
+    parser.add_argument("--skip-refresh", action="store_true",
+                        help="Do not rebuild trend buckets, host summary, sketches and top-K afterwards")
+    args = parser.parse_args()
+
+    from db import init_db
+
+    init_db()
+    files = collect_files(args.paths)
+    units = plan_units(files, args.chunk_mb * 1024 * 1024)
+    total_bytes = sum(end - start for _, _, start, end in units)
+    print(f"Importing {len(files)} file(s), {len(units)} unit(s), "
+          f"{total_bytes / 1e6:.1f} MB with {args.workers} worker(s)")
+
+    conn = connect()
+    try:
+        if args.defer_indexes:
+            dropped = defer_indexes(conn)
+            print(f"Deferred indexes: {', '.join(dropped) or 'none'}")
+
+        started = time.perf_counter()
+        rows = loaded_bytes = error_count = skipped = 0
+        failed = []
+        with Pool(args.workers) as workers:
+            results = workers.imap_unordered(
+                load_unit, [(u, args.batch_size, args.max_errors) for u in units]
+            )
+            for i in range(len(units)):
+                try:
+                    result = results.next()
+                except Exception as e:
+                    failed.append(str(e))
+                    print(f"[{i + 1}/{len(units)}] FAILED: {e}")
+                    continue
+                path, _, start, _ = result["unit"]
+                if result["skipped"]:
+                    skipped += 1
+                    print(f"[{i + 1}/{len(units)}] {path}@{start}: already loaded, skipped")
+                    continue
+                rows += result["rows"]
+                loaded_bytes += result["bytes"]
+                error_count += result["error_count"]
+                for err in result["errors"][:5]:
+                    print(f"  invalid row {err}")
+                rate = result["rows"] / result["seconds"] if result["seconds"] else 0
+                print(f"[{i + 1}/{len(units)}] {path}@{start}: {result['rows']} rows "
+                      f"in {result['seconds']:.1f}s ({rate:,.0f} rows/s)")
+        load_seconds = time.perf_counter() - started
+
+        if args.defer_indexes:
+            restored = restore_indexes(conn)
+            print(f"Rebuilt indexes: {', '.join(restored) or 'none'}")
+        if not args.skip_refresh:
+            # Includes batches committed by earlier, interrupted runs
+            min_ts, _ = checkpoint_range(conn, units)
+            if min_ts is not None:
+                refresh_derived_tables(conn, min_ts)
+        total_seconds = time.perf_counter() - started
+    finally:
+        conn.close()
+
+    print()
+    print("Import summary")
+    print(f"  units loaded:   {len(units) - skipped - len(failed)} (skipped {skipped}, failed {len(failed)})")
+    print(f"  rows loaded:    {rows:,}")
+    print(f"  invalid rows:   {error_count:,}")
+    print(f"  bytes read:     {loaded_bytes / 1e6:,.1f} MB")
+    print(f"  load time:      {load_seconds:.1f}s")
+    print(f"  total time:     {total_seconds:.1f}s (incl. index rebuild/refresh)")
+    if load_seconds:
+        print(f"  throughput:     {rows / load_seconds:,.0f} rows/s, "
+              f"{loaded_bytes / 1e6 / load_seconds:,.1f} MB/s")
+    if failed:
+        print("Some units failed; rerun the same command to resume.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# ingest.py
+"""
+Single write path for PII findings.
+
+Every ingest route goes through insert_findings() (and the sync protocol
+through remove_findings()) so that the derived tables kept alongside
+pii_results are updated in the same transaction as the rows themselves.
+"""
+from trends import update_trend_buckets
+from host_summary import update_host_summary, refresh_host
+from sketches import record_sketches
+from topk import record_topk
+from sync import invalidate_digests
+from alerts import record_alerts
+from invalidation import publish
+from dimensions import insert_rows, delete_findings
+from correlation import update_column_index
+
+
+def insert_findings(conn, rows):
+    """
+    Insert (hostname, source, column_name, detected, timestamp) rows and
+    update the derived tables. The caller owns commit/rollback.
+    """
+    if not rows:
+        return 0
+
+    cur = conn.cursor()
+    try:
+        insert_rows(cur, rows)
+        update_trend_buckets(cur, rows)
+        update_host_summary(cur, rows)
+        update_column_index(cur, rows)
+        invalidate_digests(cur, rows)
+        publish(cur, "pii_results", "insert", [r[0] for r in rows], [r[1] for r in rows])
+    finally:
+        cur.close()
+    # Kept in memory and flushed by background tasks; see sketches.py/topk.py/alerts.py
+    record_sketches(rows)
+    record_topk(rows)
+    record_alerts(rows)
+    return len(rows)
+
+
+def remove_findings(conn, ids):
+    """
+    Delete pii_results rows by id and update the derived tables. Returns the
+    deleted rows. The caller owns commit/rollback.
+
+    Sketches and top-K summaries only ever grow; they catch up with
+    deletions when they are next rebuilt.
+    """
+    if not ids:
+        return []
+
+    cur = conn.cursor()
+    try:
+        rows = delete_findings(cur, ids)
+        update_trend_buckets(cur, rows, sign=-1)
+        for hostname in sorted({r[0] or "" for r in rows}):
+            refresh_host(cur, hostname)
+        update_column_index(cur, rows, sign=-1)
+        invalidate_digests(cur, rows)
+        if rows:
+            publish(cur, "pii_results", "delete", [r[0] for r in rows], [r[1] for r in rows])
+    finally:
+        cur.close()
+    return rows
@@ -0,0 +1,167 @@
+# invalidation.py
+"""
+Cross-worker invalidation of in-process caches over Postgres LISTEN/NOTIFY.
+
+Write paths call publish() with their open cursor. It sends a compact
+change notification on INVALIDATION_CHANNEL:
+
+    {"t": table, "op": "insert" | "delete" | "update", "h": [hosts],
+     "s": [sources], "k": key, "v": version}
+
+NOTIFY is transactional, so other workers hear about a change only once
+it has committed, and never about a rolled-back one. The version comes
+from cache_version_seq, so publishing takes no row locks. "h" and "s" are
+null when a change touches more than INVALIDATION_MAX_KEYS of them.
+
+Every worker runs one listener thread on a dedicated connection, outside
+the pool. It passes each notification to the handlers registered for
+its table, which drop just the affected entries. Notifications sent
+while a listener is disconnected are lost. So after reconnecting, the
+listener compares the sequence with the highest version it saw. If that
+version has moved, it calls every handler with None, which means flush
+everything. Caches that rely on this bus ask listening() first and bypass
+themselves while the listener is down.
+"""
+import os
+import json
+import select
+import logging
+import threading
+
+INVALIDATION = os.getenv("CACHE_INVALIDATION", "1").lower() in ("1", "true", "yes")
+INVALIDATION_CHANNEL = "cache_invalidation"
+INVALIDATION_MAX_KEYS = 20
+INVALIDATION_RECONNECT_MAX = 30
+
+logger = logging.getLogger(__name__)
+
+
+def compact(values):
+    if values is None:
+        return None
+    values = sorted({v or "" for v in values})
+    return values if len(values) <= INVALIDATION_MAX_KEYS else None
+
+
+def publish(cur, table: str, op: str, hosts=None, sources=None, key: str = None):
+    """Queue a change notification in the caller's transaction; sent on commit."""
+    if not INVALIDATION:
+        return
+    payload = {"t": table, "op": op, "h": compact(hosts), "s": compact(sources), "k": key}
+    cur.execute(
+        "SELECT pg_notify(%s, (%s::jsonb || jsonb_build_object('v', nextval('cache_version_seq')))::text)",
+        (INVALIDATION_CHANNEL, json.dumps(payload, separators=(",", ":"))),
+    )
+
+
+class Listener:
+    def __init__(self, handlers):
+        self.handlers = {}
+        for table, fn in handlers:
+            self.handlers.setdefault(table, []).append(fn)
+        self.version = None
+        self.connected = False
+        self.stats = {"received": 0, "full_flushes": 0, "reconnects": 0, "handler_errors": 0}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, name="cache-invalidation", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+
+    def dispatch(self, table, change):
+        for fn in self.handlers.get(table, ()):
+            try:
+                fn(change)
+            except Exception as e:
+                self.stats["handler_errors"] += 1
+                logger.warning("Invalidation handler for %s failed: %s", table, e)
+
+    def flush_all(self):
+        self.stats["full_flushes"] += 1
+        for table in self.handlers:
+            self.dispatch(table, None)
+
+    def listen(self, conn):
+        cur = conn.cursor()
+        cur.execute(f"LISTEN {INVALIDATION_CHANNEL}")
+        # Read after LISTEN: anything newer is delivered, anything older is covered
+        cur.execute("SELECT last_value FROM cache_version_seq")
+        current = cur.fetchone()[0]
+        cur.close()
+        if self.version is not None and current != self.version:
+            logger.info("Invalidation listener missed changes (%s -> %s); flushing caches",
+                        self.version, current)
+            self.flush_all()
+        self.version = current
+        self.connected = True
+
+        while not self._stop.is_set():
+            if select.select([conn], [], [], 1.0) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                self.stats["received"] += 1
+                try:
+                    change = json.loads(notify.payload)
+                except ValueError:
+                    continue
+                self.version = max(self.version, change.get("v") or 0)
+                self.dispatch(change.get("t"), change)
+
+    def run(self):
+        import psycopg2
+        from db import get_connection_params
+
+        delay = 1
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**get_connection_params())
+                conn.autocommit = True
+                delay = 1
+                self.listen(conn)
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                self.stats["reconnects"] += 1
+                logger.warning("Invalidation listener disconnected: %s; retrying in %ss", e, delay)
+            finally:
+                self.connected = False
+                if conn is not None:
+                    conn.close()
+            self._stop.wait(delay)
+            delay = min(delay * 2, INVALIDATION_RECONNECT_MAX)
+
+
+_listener = None
+
+
+def start_listener(handlers):
+    """Start this worker's listener for [(table, handler(change or None))]."""
+    global _listener
+    if INVALIDATION and _listener is None:
+        _listener = Listener(handlers)
+        _listener.start()
+
+
+def stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def listening() -> bool:
+    """True while notifications are being received, i.e. bus-invalidated caches are trustworthy."""
+    return _listener is not None and _listener.connected
+
+
+def get_invalidation_stats():
+    if _listener is None:
+        return {"enabled": INVALIDATION, "connected": False}
+    return dict(_listener.stats, enabled=True, connected=_listener.connected, version=_listener.version)
@@ -0,0 +1,200 @@
+# logging_config.py
+"""
+Structured, queue-backed logging.
+
+configure_logging() routes every record through a bounded in-memory queue
+to a background QueueListener thread, so formatting and I/O happen off the
+request path; records are never formatted in the calling thread and are
+dropped (and counted) rather than blocking when the queue is full.
+
+RequestLogMiddleware emits one compact record per request with method,
+path, status, duration and any fields the handler attached with
+annotate(). Per-route sampling and level overrides come from the
+environment:
+
+    LOG_ROUTE_SAMPLING="/upload=0.01,/api/topk=0.1"   # share of requests logged
+    LOG_ROUTE_LEVELS="/upload=WARNING"                # minimum level inside the route
+
+Errors and requests slower than LOG_SLOW_REQUEST_MS are always logged.
+"""
+import os
+import json
+import time
+import queue
+import random
+import logging
+import logging.handlers
+import contextvars
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SLOW_REQUEST_MS = float(os.getenv("LOG_SLOW_REQUEST_MS", "1000"))
+
+_request_fields = contextvars.ContextVar("request_log_fields", default=None)
+_route_level = contextvars.ContextVar("request_log_level", default=logging.NOTSET)
+
+_listener = None
+dropped_records = 0
+
+access_logger = logging.getLogger("access")
+
+
+def parse_route_map(spec: str, convert):
+    """Parse "prefix=value,prefix=value" into [(prefix, value)], longest prefix first."""
+    routes = []
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        prefix, value = item.split("=", 1)
+        routes.append((prefix.strip(), convert(value.strip())))
+    return sorted(routes, key=lambda r: len(r[0]), reverse=True)
+
+
+ROUTE_SAMPLING = parse_route_map(os.getenv("LOG_ROUTE_SAMPLING", ""), float)
+ROUTE_LEVELS = parse_route_map(os.getenv("LOG_ROUTE_LEVELS", ""), lambda v: logging.getLevelName(v.upper()))
+
+
+def match_route(routes, path, default):
+    for prefix, value in routes:
+        if prefix == "/" and path != "/":
+            continue
+        if path.startswith(prefix):
+            return value
+    return default
+
+
+def annotate(**fields):
+    """Attach fields to the current request's summary record."""
+    current = _request_fields.get()
+    if current is not None:
+        current.update(fields)
+
+
+class StructuredFormatter(logging.Formatter):
+    """One JSON object per line, using Cloud Logging's field names."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        text = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            text += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return text
+
+
+class RouteLevelFilter(logging.Filter):
+    """Drop records below the level override of the route being served."""
+
+    def filter(self, record):
+        level = _route_level.get()
+        return level == logging.NOTSET or record.levelno >= level or record.name == "access"
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Formatting is left to the listener thread; the record is only
+        # read there, never mutated by the caller afterwards.
+        return record
+
+    def enqueue(self, record):
+        global dropped_records
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_records += 1
+
+
+def configure_logging():
+    """Install the queue handler on the root logger (idempotent)."""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler()
+    stream.setFormatter(StructuredFormatter() if LOG_FORMAT == "json" else TextFormatter())
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(RouteLevelFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Drain the queue; call on application shutdown."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestLogMiddleware:
+    """ASGI middleware writing one sampled summary record per request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        fields = {}
+        fields_token = _request_fields.set(fields)
+        level_token = _route_level.set(match_route(ROUTE_LEVELS, path, logging.NOTSET))
+        status = {"code": 500}
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            _request_fields.reset(fields_token)
+            _route_level.reset(level_token)
+
+            rate = match_route(ROUTE_SAMPLING, path, 1.0)
+            always = status["code"] >= 500 or duration_ms >= LOG_SLOW_REQUEST_MS
+            if always or rate >= 1.0 or random.random() < rate:
+                fields.update(
+                    method=scope["method"],
+                    path=path,
+                    status=status["code"],
+                    duration_ms=round(duration_ms, 2),
+                )
+                if not always and rate < 1.0:
+                    fields["sample_rate"] = rate
+                level = logging.WARNING if status["code"] >= 500 else logging.INFO
+                access_logger.log(level, "request", extra={"fields": fields})
@@ -0,0 +1,66 @@
+# models.py
+"""
+Shape of an uploaded PII finding.
+
+PiiRecord is what the HTTP ingest routes validate against. Bulk paths that
+cannot afford one pydantic model per row use normalize_record(), which
+enforces the same field rules on a plain dict and returns the tuple written
+to pii_results.
+"""
+from datetime import datetime
+from typing import List
+
+from pydantic import BaseModel
+
+
+class PiiRecord(BaseModel):
+    hostname: str
+    source: str
+    column_name: str
+    detected: List[str]
+
+
+PII_RECORD_FIELDS = ("hostname", "source", "column_name", "detected")
+
+
+def parse_timestamp(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value)
+    text = str(value).strip()
+    if text.endswith("Z"):
+        text = text[:-1] + "+00:00"
+    ts = datetime.fromisoformat(text)
+    # pii_results.timestamp is a naive TIMESTAMP
+    if ts.tzinfo is not None:
+        ts = ts.astimezone().replace(tzinfo=None)
+    return ts
+
+
+def normalize_record(data: dict, default_timestamp: datetime = None):
+    """
+    Validate a raw dict against the PiiRecord shape.
+
+    Returns a (hostname, source, column_name, detected, timestamp) tuple with
+    `detected` joined the same way /upload stores it. Raises ValueError on
+    missing or mistyped fields. `detected` may be a list of strings or an
+    already comma-joined string; `timestamp` is optional.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("record must be an object")
+    for field in ("hostname", "source", "column_name"):
+        value = data.get(field)
+        if not isinstance(value, str):
+            raise ValueError(f"{field} must be a string")
+
+    detected = data.get("detected")
+    if isinstance(detected, str):
+        detected = [d.strip() for d in detected.split(",") if d.strip()]
+    if not isinstance(detected, list) or not all(isinstance(d, str) for d in detected):
+        raise ValueError("detected must be a list of strings")
+
+    timestamp = parse_timestamp(data.get("timestamp")) or default_timestamp or datetime.now()
+    return (data["hostname"], data["source"], data["column_name"], ", ".join(detected), timestamp)
@@ -0,0 +1,90 @@
+# msgpack_ingest.py
+"""
+MessagePack batch format for POST /upload/batch.
+
+A batch is a map with a format version and an array of positional rows:
+
+    {"v": 1, "rows": [[hostname, source, column_name, [detected, ...]], ...]}
+
+Rows are validated together in one pass by decode_batch() instead of
+building a PiiRecord per row; the field rules are the same as PiiRecord's.
+encode_batch() is the helper agents use to produce a batch. It needs only
+the `msgpack` package, so this file can be copied into an agent as-is.
+"""
+
+MSGPACK_CONTENT_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+MSGPACK_FORMAT_VERSION = 1
+ROW_FIELDS = ("hostname", "source", "column_name", "detected")
+
+MSGPACK_SCHEMA = {
+    "content_type": MSGPACK_CONTENT_TYPES[0],
+    "version": MSGPACK_FORMAT_VERSION,
+    "layout": {"v": "int, format version", "rows": "array of row arrays"},
+    "row": [
+        {"name": "hostname", "type": "str"},
+        {"name": "source", "type": "str"},
+        {"name": "column_name", "type": "str"},
+        {"name": "detected", "type": "array of str"},
+    ],
+    "example": {"v": 1, "rows": [["server1", "/data/customers.csv", "email", ["email"]]]},
+}
+
+
+def encode_batch(records) -> bytes:
+    """
+    Pack records for /upload/batch.
+
+    `records` may contain dicts with the PiiRecord fields or
+    (hostname, source, column_name, detected) tuples.
+    """
+    import msgpack
+
+    rows = []
+    for r in records:
+        if isinstance(r, dict):
+            rows.append([r["hostname"], r["source"], r["column_name"], list(r["detected"])])
+        else:
+            hostname, source, column_name, detected = r
+            rows.append([hostname, source, column_name, list(detected)])
+    return msgpack.packb({"v": MSGPACK_FORMAT_VERSION, "rows": rows}, use_bin_type=True)
+
+
+def validate_rows(rows, timestamp):
+    """
+    Check every row against the PiiRecord field rules and return
+    (hostname, source, column_name, detected, timestamp) tuples ready for
+    insert_findings(). Raises ValueError naming the first bad row.
+    """
+    if type(rows) is not list:
+        raise ValueError("rows must be an array")
+
+    out = []
+    append = out.append
+    for i, row in enumerate(rows):
+        if type(row) is not list or len(row) != 4:
+            raise ValueError(f"row {i}: expected [hostname, source, column_name, detected]")
+        hostname, source, column_name, detected = row
+        if type(hostname) is not str or type(source) is not str or type(column_name) is not str:
+            raise ValueError(f"row {i}: hostname, source and column_name must be strings")
+        if type(detected) is not list:
+            raise ValueError(f"row {i}: detected must be an array of strings")
+        for d in detected:
+            if type(d) is not str:
+                raise ValueError(f"row {i}: detected must be an array of strings")
+        append((hostname, source, column_name, ", ".join(detected), timestamp))
+    return out
+
+
+def decode_batch(body: bytes, timestamp):
+    """Unpack and validate a MessagePack batch body."""
+    import msgpack
+
+    try:
+        payload = msgpack.unpackb(body, raw=False)
+    except Exception as e:
+        raise ValueError(f"invalid MessagePack body: {e}")
+    if not isinstance(payload, dict):
+        raise ValueError("batch must be a map with 'v' and 'rows'")
+    if payload.get("v") != MSGPACK_FORMAT_VERSION:
+        raise ValueError(f"unsupported batch version: {payload.get('v')}")
+    return validate_rows(payload.get("rows"), timestamp)
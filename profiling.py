@@ -0,0 +1,188 @@
+# profiling.py
+"""
+On-demand CPU and memory profiling of a live worker.
+
+profile_stacks() samples for the requested number of seconds from the
+thread it is called on. Every interval it reads sys._current_frames(),
+which covers every thread, including the one running the event loop and
+the threadpool workers running handlers. Optionally it also reads the stacks
+of suspended asyncio tasks, which shows where requests are waiting. The
+result is the collapsed-stack ("folded") format read by flamegraph.pl,
+speedscope and similar tools:
+
+    thread;outer (file.py:10);inner (file.py:42) 17
+
+Nothing is installed between runs: no hooks, signals or threads. When no
+profile is running, profiling costs nothing.
+
+The tracemalloc helpers start allocation tracing, keep named snapshots and
+diff two of them to find growth. Tracing slows allocations down while it
+is on, so it runs only between start_tracemalloc() and stop_tracemalloc().
+"""
+import os
+import sys
+import time
+import asyncio
+import threading
+import tracemalloc
+
+PROFILE_MAX_SECONDS = 60
+PROFILE_MIN_INTERVAL = 0.001
+# Snapshots kept per worker; the oldest is dropped first
+TRACEMALLOC_MAX_SNAPSHOTS = 5
+
+_profile_lock = threading.Lock()
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def collapse(frames) -> str:
+    """Frames from innermost outwards -> "outer;...;inner"."""
+    return ";".join(frame_label(f) for f in reversed(frames))
+
+
+def walk(frame):
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    return frames
+
+
+def sample_tasks(loop, counts):
+    """Add the stacks of the loop's suspended tasks; runs off the loop thread, so it may miss some."""
+    try:
+        tasks = list(asyncio.all_tasks(loop))
+    except RuntimeError:
+        # The task set changed while we were copying it
+        return
+    for task in tasks:
+        if task.done():
+            continue
+        try:
+            stack = task.get_stack()
+        except RuntimeError:
+            continue
+        if stack:
+            key = f"task {task.get_name()};" + ";".join(frame_label(f) for f in stack)
+            counts[key] = counts.get(key, 0) + 1
+
+
+def profile_stacks(seconds: float, interval: float = 0.005, loop=None):
+    """Sample every thread (and, given `loop`, its tasks) for `seconds`. Returns (folded text, samples)."""
+    seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+    interval = max(interval, PROFILE_MIN_INTERVAL)
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("A profile is already running in this worker")
+    try:
+        counts = {}
+        names = {}
+        me = threading.get_ident()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                key = f"{names.get(ident, ident)};{collapse(walk(frame))}"
+                counts[key] = counts.get(key, 0) + 1
+            if loop is not None:
+                sample_tasks(loop, counts)
+            samples += 1
+            time.sleep(interval)
+    finally:
+        _profile_lock.release()
+
+    lines = [f"{stack} {count}" for stack, count in sorted(counts.items(), key=lambda kv: -kv[1])]
+    return "\n".join(lines) + "\n", samples
+
+
+# -----------------------------
+# tracemalloc
+# -----------------------------
+_snapshots = {}
+
+
+def start_tracemalloc(frames: int = 25):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(min(max(frames, 1), 100))
+    return tracemalloc_status()
+
+
+def stop_tracemalloc():
+    tracemalloc.stop()
+    _snapshots.clear()
+    return tracemalloc_status()
+
+
+def tracemalloc_status():
+    status = {"tracing": tracemalloc.is_tracing(), "snapshots": sorted(_snapshots)}
+    if status["tracing"]:
+        current, peak = tracemalloc.get_traced_memory()
+        status.update(
+            frames=tracemalloc.get_traceback_limit(),
+            traced_mb=round(current / 1048576, 2),
+            peak_mb=round(peak / 1048576, 2),
+            overhead_mb=round(tracemalloc.get_tracemalloc_memory() / 1048576, 2),
+        )
+    return status
+
+
+def filtered_snapshot():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+
+
+def take_snapshot(name: str = None, limit: int = 20):
+    """Store a snapshot under `name` (default: a timestamp); returns its top allocation sites."""
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc is not running; start it first")
+    name = name or time.strftime("%H%M%S")
+    snapshot = filtered_snapshot()
+    _snapshots.pop(name, None)
+    while len(_snapshots) >= TRACEMALLOC_MAX_SNAPSHOTS:
+        _snapshots.pop(next(iter(_snapshots)))
+    _snapshots[name] = snapshot
+    return {"name": name, "top": [
+        {"site": str(stat.traceback[0]), "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+        for stat in snapshot.statistics("lineno")[:limit]
+    ]}
+
+
+def diff_snapshots(old: str = None, new: str = None, limit: int = 20, group_by: str = "lineno"):
+    """Largest growth from snapshot `old` to `new` (default: the two most recent; `new` may be "now")."""
+    names = list(_snapshots)
+    if new == "now":
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running")
+        after = filtered_snapshot()
+        old = old or (names[-1] if names else None)
+    else:
+        new = new or (names[-1] if names else None)
+        old = old or (names[-2] if len(names) > 1 else None)
+        after = _snapshots.get(new)
+    before = _snapshots.get(old)
+    if before is None or after is None:
+        raise KeyError(f"Unknown snapshot; have {names}")
+    if group_by not in ("lineno", "traceback", "filename"):
+        raise ValueError("group_by must be lineno, traceback or filename")
+
+    stats = after.compare_to(before, group_by)
+    return {"old": old, "new": new or "now", "growth": [
+        {
+            "site": str(stat.traceback[0]),
+            "traceback": [str(frame) for frame in stat.traceback] if group_by == "traceback" else None,
+            "size_diff_kb": round(stat.size_diff / 1024, 1),
+            "count_diff": stat.count_diff,
+            "size_kb": round(stat.size / 1024, 1),
+        }
+        for stat in stats[:limit]
+    ]}
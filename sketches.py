@@ -0,0 +1,214 @@
+# sketches.py
+"""
+HyperLogLog sketches of distinct hosts, sources and columns per detection
+type and day.
+
+Ingest adds values to per-worker in-memory sketches (record_sketches());
+a background task flushes them into pii_sketches by merging with the stored
+registers under a row lock. HLL merges are idempotent (register-wise max),
+so flushing the same values twice never over-counts. Daily sketches merge
+into any longer range.
+"""
+import os
+import math
+import hashlib
+import threading
+from datetime import datetime, timedelta
+
+from trends import split_detected
+
+HLL_PRECISION = 12
+HLL_REGISTERS = 1 << HLL_PRECISION
+SKETCH_DIMENSIONS = ("host", "source", "column")
+SKETCH_FLUSH_INTERVAL = int(os.getenv("SKETCH_FLUSH_INTERVAL", "10"))
+
+_MASK64 = (1 << 64) - 1
+
+
+class HyperLogLog:
+    """Dense HyperLogLog with 2**HLL_PRECISION one-byte registers."""
+
+    relative_error = 1.04 / math.sqrt(HLL_REGISTERS)
+
+    def __init__(self, registers: bytes = None):
+        self.registers = bytearray(registers) if registers else bytearray(HLL_REGISTERS)
+
+    def add(self, value: str):
+        h = int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+        index = h >> (64 - HLL_PRECISION)
+        rest = (h << HLL_PRECISION) & _MASK64
+        rank = min(64 - rest.bit_length() + 1, 64 - HLL_PRECISION + 1)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        import numpy as np
+
+        merged = np.maximum(np.frombuffer(self.registers, dtype=np.uint8),
+                            np.frombuffer(other.registers, dtype=np.uint8))
+        self.registers = bytearray(merged.tobytes())
+        return self
+
+    def count(self) -> float:
+        import numpy as np
+
+        regs = np.frombuffer(self.registers, dtype=np.uint8)
+        m = HLL_REGISTERS
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / float(np.sum(np.ldexp(1.0, -regs.astype(np.int32))))
+        zeros = int(np.count_nonzero(regs == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Small-range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return estimate
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+
+
+def sketch_values(hostname, source, column_name):
+    """Values for each dimension; columns are identified within host and source."""
+    hostname = hostname or ""
+    source = source or ""
+    return {
+        "host": hostname,
+        "source": f"{hostname}\x1f{source}",
+        "column": f"{hostname}\x1f{source}\x1f{column_name or ''}",
+    }
+
+
+_pending_lock = threading.Lock()
+_pending = {}
+
+
+def record_sketches(rows):
+    """Fold ingested rows into this worker's pending sketches."""
+    with _pending_lock:
+        for hostname, source, column_name, detected, ts in rows:
+            day = ts.date()
+            values = sketch_values(hostname, source, column_name)
+            for d in split_detected(detected):
+                for dimension, value in values.items():
+                    key = (day, d, dimension)
+                    sketch = _pending.get(key)
+                    if sketch is None:
+                        sketch = _pending[key] = HyperLogLog()
+                    sketch.add(value)
+
+
+def merge_into_table(cur, sketches):
+    """Merge {(day, detected, dimension): HyperLogLog} into pii_sketches."""
+    # Sorted so concurrent flushes lock rows in the same order
+    for key in sorted(sketches):
+        day, d, dimension = key
+        cur.execute("""
+            SELECT registers FROM pii_sketches
+            WHERE bucket = %s AND detected = %s AND dimension = %s
+            FOR UPDATE
+        """, key)
+        row = cur.fetchone()
+        sketch = sketches[key]
+        if row is not None:
+            sketch = HyperLogLog(bytes(row[0])).merge(sketch)
+        cur.execute("""
+            INSERT INTO pii_sketches (bucket, detected, dimension, registers)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (bucket, detected, dimension)
+            DO UPDATE SET registers = EXCLUDED.registers
+        """, (day, d, dimension, sketch.to_bytes()))
+
+
+def flush_sketches(conn):
+    """Write pending sketches to the database. Returns the number of keys flushed."""
+    global _pending
+    with _pending_lock:
+        pending, _pending = _pending, {}
+    if not pending:
+        return 0
+
+    cur = conn.cursor()
+    try:
+        merge_into_table(cur, pending)
+        conn.commit()
+        return len(pending)
+    except Exception:
+        conn.rollback()
+        # Put them back; merging is idempotent so the next flush can retry
+        with _pending_lock:
+            for key, sketch in pending.items():
+                if key in _pending:
+                    _pending[key].merge(sketch)
+                else:
+                    _pending[key] = sketch
+        raise
+    finally:
+        cur.close()
+
+
+def rebuild_sketches(conn, since: datetime, until: datetime = None, batch_size: int = 50000):
+    """Recompute sketches for days in [since, until) from pii_history (archived rollups included)."""
+    until = until or datetime.now() + timedelta(days=1)
+    start = since.replace(hour=0, minute=0, second=0, microsecond=0)
+    sketches = {}
+    read = conn.cursor(name="sketch_rebuild")
+    read.itersize = batch_size
+    read.execute("""
+        SELECT hostname, source, column_name, detected, timestamp
+        FROM pii_history WHERE timestamp >= %s AND timestamp < %s
+    """, (start, until))
+    for hostname, source, column_name, detected, ts in read:
+        day = ts.date()
+        values = sketch_values(hostname, source, column_name)
+        for d in split_detected(detected):
+            for dimension, value in values.items():
+                sketch = sketches.get((day, d, dimension))
+                if sketch is None:
+                    sketch = sketches[(day, d, dimension)] = HyperLogLog()
+                sketch.add(value)
+    read.close()
+
+    cur = conn.cursor()
+    try:
+        cur.execute("DELETE FROM pii_sketches WHERE bucket >= %s AND bucket < %s",
+                    (start.date(), until.date()))
+        merge_into_table(cur, sketches)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def estimate_distinct(conn, since=None, until=None, detected: str = None):
+    """
+    Merge daily sketches over [since, until) and return
+    {detected: {"host": n, "source": n, "column": n}} estimates.
+    """
+    query = "SELECT detected, dimension, registers FROM pii_sketches WHERE 1=1"
+    params = []
+    if since:
+        query += " AND bucket >= %s"
+        params.append(since.date() if isinstance(since, datetime) else since)
+    if until:
+        query += " AND bucket < %s"
+        params.append(until.date() if isinstance(until, datetime) else until)
+    if detected:
+        query += " AND detected = %s"
+        params.append(detected)
+
+    cur = conn.cursor()
+    try:
+        cur.execute(query, params)
+        merged = {}
+        for d, dimension, registers in cur:
+            sketch = HyperLogLog(bytes(registers))
+            key = (d, dimension)
+            merged[key] = merged[key].merge(sketch) if key in merged else sketch
+    finally:
+        cur.close()
+
+    result = {}
+    for (d, dimension), sketch in merged.items():
+        result.setdefault(d, {})[dimension] = round(sketch.count())
+    return result
@@ -0,0 +1,189 @@
+# sync.py
+"""
+Snapshot digest sync for scanning agents.
+
+The server keeps a digest of the current findings of every (host, source)
+in source_digests and a host digest over those. An agent computes the same
+digests over its latest scan (source_digest()/host_digest() below), asks
+GET /sync/{hostname}?digest=<host digest> and stops there when nothing
+changed. Otherwise it compares the returned per-source digests and posts
+only the sources that differ, each with its complete set of findings, plus
+the sources that disappeared. apply_sync() turns that into inserts of new
+findings and deletes of vanished ones.
+
+A finding is identified by its column name and set of detected types;
+timestamps and duplicates do not affect digests. Findings that arrive
+through the ordinary upload routes invalidate the digests of their
+sources, which are recomputed from pii_results on the next GET. The
+recompute holds the host's sync lock, and invalidation takes it shared, so
+an upload committing during a recompute cannot leave a stale digest behind.
+"""
+import hashlib
+from datetime import datetime
+
+from trends import split_detected
+
+# Advisory lock class for per-host sync; the second key is hashtext(hostname)
+SYNC_LOCK_KEY = 7240317
+
+
+def finding_key(column_name, detected) -> str:
+    """Identity of a finding within a source. `detected` is a list or comma-joined string."""
+    if isinstance(detected, str) or detected is None:
+        detected = split_detected(detected)
+    types = sorted({d.strip().lower() for d in detected if d and d.strip()})
+    return f"{column_name or ''}\x1f{','.join(types)}"
+
+
+def source_digest(keys) -> str:
+    """Digest of a source's findings, given their finding_key()s."""
+    h = hashlib.sha256()
+    for key in sorted(set(keys)):
+        h.update(key.encode("utf-8"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+
+def host_digest(digests: dict) -> str:
+    """Digest over {source: source digest}; the root of the host's tree."""
+    h = hashlib.sha256()
+    for source in sorted(digests):
+        h.update(f"{source}\x1f{digests[source]}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+def invalidate_digests(cur, rows):
+    """Drop stored digests of the (hostname, source) pairs touched by `rows`."""
+    from psycopg2.extras import execute_values
+
+    pairs = sorted({(r[0] or "", r[1]) for r in rows if r[1] is not None})
+    # Shared host lock: waits out a digest recompute in get_host_digests(), so
+    # a digest computed before this transaction's findings commit is deleted
+    for hostname in sorted({h for h, _ in pairs}):
+        cur.execute("SELECT pg_advisory_xact_lock_shared(%s, hashtext(%s))", (SYNC_LOCK_KEY, hostname))
+    if pairs:
+        execute_values(cur, """
+            DELETE FROM source_digests d USING (VALUES %s) AS v (hostname, source)
+            WHERE d.hostname = v.hostname AND d.source = v.source
+        """, pairs)
+
+
+def load_source_keys(cur, hostname: str, sources):
+    """{source: {finding_key: [ids]}} for the given sources of a host."""
+    cur.execute("""
+        SELECT id, source, column_name, detected FROM pii_results
+        WHERE hostname = %s AND source = ANY(%s)
+    """, (hostname, list(sources)))
+    found = {s: {} for s in sources}
+    for row_id, source, column_name, detected in cur.fetchall():
+        found[source].setdefault(finding_key(column_name, detected), []).append(row_id)
+    return found
+
+
+def store_digests(cur, hostname: str, digests: dict):
+    from psycopg2.extras import execute_values
+
+    if digests:
+        execute_values(cur, """
+            INSERT INTO source_digests (hostname, source, digest, updated_at)
+            VALUES %s
+            ON CONFLICT (hostname, source) DO UPDATE
+            SET digest = EXCLUDED.digest, updated_at = EXCLUDED.updated_at
+        """, [(hostname, s, d, datetime.now()) for s, d in sorted(digests.items())])
+
+
+def _load_digests(cur, hostname: str):
+    """Stored {source: digest} of a host and the sources missing a digest."""
+    cur.execute("SELECT source, digest FROM source_digests WHERE hostname = %s", (hostname,))
+    digests = dict(cur.fetchall())
+    # host_sources lists every source with findings, without scanning pii_results
+    cur.execute("SELECT source FROM host_sources WHERE hostname = %s", (hostname,))
+    return digests, [s for (s,) in cur.fetchall() if s not in digests]
+
+
+def get_host_digests(conn, hostname: str):
+    """
+    Return {"hostname", "digest", "sources": {source: digest}}, recomputing
+    any digests invalidated by uploads since the last sync. Commits.
+    """
+    cur = conn.cursor()
+    try:
+        digests, stale = _load_digests(cur, hostname)
+        if stale:
+            # Same lock as apply_sync(); re-read under it since a sync or
+            # upload may have committed in between
+            cur.execute("SELECT pg_advisory_xact_lock(%s, hashtext(%s))", (SYNC_LOCK_KEY, hostname))
+            digests, stale = _load_digests(cur, hostname)
+        if stale:
+            recomputed = {
+                source: source_digest(keys)
+                for source, keys in load_source_keys(cur, hostname, stale).items()
+                if keys
+            }
+            store_digests(cur, hostname, recomputed)
+            digests.update(recomputed)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    return {"hostname": hostname, "digest": host_digest(digests), "sources": digests}
+
+
+def apply_sync(conn, hostname: str, sources: dict, removed=(), timestamp: datetime = None):
+    """
+    Make the stored findings of each source in `sources` equal to the given
+    rows, and delete every finding of the sources in `removed`.
+
+    `sources` maps source -> list of (hostname, source, column_name,
+    detected, timestamp) rows as produced by normalize_record(). Returns
+    {"added", "removed", "digest", "sources"} where "sources" holds the new
+    digests of the sources touched. Commits.
+    """
+    # ingest imports this module for invalidate_digests()
+    from ingest import insert_findings, remove_findings
+
+    touched = set(sources) | set(removed)
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT pg_advisory_xact_lock(%s, hashtext(%s))", (SYNC_LOCK_KEY, hostname))
+        stored = load_source_keys(cur, hostname, sorted(touched))
+
+        added_rows = []
+        delete_ids = []
+        new_digests = {}
+        for source in sorted(touched):
+            wanted = {}
+            for row in sources.get(source, ()):
+                wanted.setdefault(finding_key(row[2], row[3]), row)
+            current = stored[source]
+            for key, row in wanted.items():
+                if key not in current:
+                    added_rows.append(row[:4] + (timestamp or row[4],))
+            for key, ids in current.items():
+                if key not in wanted:
+                    delete_ids.extend(ids)
+            if wanted:
+                new_digests[source] = source_digest(wanted)
+
+        cur.execute("DELETE FROM source_digests WHERE hostname = %s AND source = ANY(%s)",
+                    (hostname, sorted(touched)))
+        removed_rows = remove_findings(conn, delete_ids)
+        insert_findings(conn, added_rows)
+        store_digests(cur, hostname, new_digests)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    result = get_host_digests(conn, hostname)
+    return {
+        "added": len(added_rows),
+        "removed": len(removed_rows),
+        "digest": result["digest"],
+        "sources": {s: new_digests.get(s) for s in sorted(touched)},
+    }
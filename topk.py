@@ -0,0 +1,219 @@
+# topk.py
+"""
+Streaming top-K heavy hitters for hosts, sources and column names.
+
+Each worker keeps a Space-Saving summary per dimension for the findings it
+ingested since the last flush. flush_topk() merges that delta into the
+shared summary in topk_state under a row lock and caches the result, so
+reads see every worker's ingest within TOPK_FLUSH_INTERVAL and the state
+survives restarts. Memory is bounded by TOPK_CAPACITY counters per
+dimension. Counts are upper bounds; `error` is how much a count may
+overstate the true value.
+"""
+import os
+import json
+import heapq
+import threading
+
+from trends import split_detected
+
+TOPK_DIMENSIONS = ("host", "source", "column")
+TOPK_CAPACITY = int(os.getenv("TOPK_CAPACITY", "1000"))
+TOPK_FLUSH_INTERVAL = int(os.getenv("TOPK_FLUSH_INTERVAL", "30"))
+
+
+class SpaceSaving:
+    """Space-Saving summary holding at most `capacity` weighted counters."""
+
+    def __init__(self, capacity: int = TOPK_CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self._heap = []
+
+    def _push(self, key):
+        heapq.heappush(self._heap, (self.counts[key], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(c, k) for k, c in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        while True:
+            count, key = heapq.heappop(self._heap)
+            if self.counts.get(key) == count:
+                return key, count
+
+    def add(self, key, weight: int = 1):
+        if key in self.counts:
+            self.counts[key] += weight
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = weight
+            self.errors[key] = 0
+        else:
+            evicted, floor = self._pop_min()
+            del self.counts[evicted]
+            del self.errors[evicted]
+            self.counts[key] = floor + weight
+            self.errors[key] = floor
+        self._push(key)
+
+    def min_count(self) -> int:
+        """Smallest counter when the summary is full, else 0."""
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def merge(self, other: "SpaceSaving"):
+        """Add another summary's counters and trim back to capacity."""
+        # A full summary may have evicted a key it lacks with up to its
+        # minimum count, so that much is added to both count and error
+        floor = self.min_count()
+        other_floor = other.min_count()
+        counts, errors = {}, {}
+        for key in self.counts.keys() | other.counts.keys():
+            counts[key] = self.counts.get(key, floor) + other.counts.get(key, other_floor)
+            errors[key] = self.errors.get(key, floor) + other.errors.get(key, other_floor)
+        kept = heapq.nlargest(self.capacity, counts.items(), key=lambda kv: kv[1])
+        self.counts = dict(kept)
+        self.errors = {k: errors[k] for k in self.counts}
+        self._heap = [(c, k) for k, c in self.counts.items()]
+        heapq.heapify(self._heap)
+        return self
+
+    def top(self, k: int):
+        items = heapq.nlargest(k, self.counts.items(), key=lambda kv: kv[1])
+        return [{"key": key, "count": count, "error": self.errors.get(key, 0)} for key, count in items]
+
+    def to_json(self) -> str:
+        return json.dumps({k: [c, self.errors.get(k, 0)] for k, c in self.counts.items()})
+
+    @classmethod
+    def from_json(cls, text: str, capacity: int = TOPK_CAPACITY):
+        summary = cls(capacity)
+        if text:
+            other = cls(capacity)
+            for key, (count, error) in json.loads(text).items():
+                other.counts[key] = count
+                other.errors[key] = error
+            summary.merge(other)
+        return summary
+
+
+def topk_keys(hostname, source, column_name):
+    hostname = hostname or ""
+    return {
+        "host": hostname,
+        "source": f"{hostname}:{source or ''}",
+        "column": column_name or "",
+    }
+
+
+_lock = threading.Lock()
+_delta = {d: SpaceSaving() for d in TOPK_DIMENSIONS}
+_shared = {d: SpaceSaving() for d in TOPK_DIMENSIONS}
+
+
+def record_topk(rows):
+    """Count each finding once per dimension in this worker's delta."""
+    batch = {d: {} for d in TOPK_DIMENSIONS}
+    for hostname, source, column_name, detected, _ in rows:
+        if not split_detected(detected):
+            continue
+        for dimension, key in topk_keys(hostname, source, column_name).items():
+            batch[dimension][key] = batch[dimension].get(key, 0) + 1
+    with _lock:
+        for dimension, counts in batch.items():
+            summary = _delta[dimension]
+            for key, weight in counts.items():
+                summary.add(key, weight)
+
+
+def flush_topk(conn):
+    """Merge this worker's delta into topk_state and refresh the shared view."""
+    global _delta
+    with _lock:
+        delta, _delta = _delta, {d: SpaceSaving() for d in TOPK_DIMENSIONS}
+
+    cur = conn.cursor()
+    try:
+        shared = {}
+        for dimension in TOPK_DIMENSIONS:
+            cur.execute("SELECT state FROM topk_state WHERE dimension = %s FOR UPDATE", (dimension,))
+            row = cur.fetchone()
+            summary = SpaceSaving.from_json(row[0] if row else None)
+            if delta[dimension].counts:
+                summary.merge(delta[dimension])
+                cur.execute("""
+                    INSERT INTO topk_state (dimension, state, updated_at)
+                    VALUES (%s, %s, CURRENT_TIMESTAMP)
+                    ON CONFLICT (dimension) DO UPDATE
+                    SET state = EXCLUDED.state, updated_at = CURRENT_TIMESTAMP
+                """, (dimension, summary.to_json()))
+            shared[dimension] = summary
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        with _lock:
+            for dimension, summary in delta.items():
+                _delta[dimension].merge(summary)
+        raise
+    finally:
+        cur.close()
+
+    with _lock:
+        _shared.update(shared)
+
+
+def get_top_k(dimension: str, k: int = 20):
+    """Heavy hitters from the shared state plus this worker's unflushed delta."""
+    if dimension not in TOPK_DIMENSIONS:
+        raise ValueError(f"Unsupported dimension: {dimension}")
+    with _lock:
+        view = SpaceSaving().merge(_shared[dimension]).merge(_delta[dimension])
+    return view.top(k)
+
+
+EXACT_QUERIES = {
+    "host": "SELECT COALESCE(hostname, '') AS key, SUM(n) FROM pii_history",
+    "source": "SELECT COALESCE(hostname, '') || ':' || COALESCE(source, '') AS key, SUM(n) FROM pii_history",
+    "column": "SELECT COALESCE(column_name, '') AS key, SUM(n) FROM pii_history",
+}
+
+
+def exact_top_k(conn, dimension: str, k: int = 20):
+    """Recompute the top K exactly with GROUP BY (full scan)."""
+    if dimension not in TOPK_DIMENSIONS:
+        raise ValueError(f"Unsupported dimension: {dimension}")
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            EXACT_QUERIES[dimension]
+            + " WHERE COALESCE(detected, '') <> '' GROUP BY 1 ORDER BY 2 DESC LIMIT %s",
+            (k,)
+        )
+        return [{"key": key, "count": count, "error": 0} for key, count in cur.fetchall()]
+    finally:
+        cur.close()
+
+
+def reseed_topk(conn):
+    """Replace the stored summaries with exact counts, e.g. after a bulk import."""
+    cur = conn.cursor()
+    try:
+        for dimension in TOPK_DIMENSIONS:
+            summary = SpaceSaving()
+            for item in exact_top_k(conn, dimension, TOPK_CAPACITY):
+                summary.counts[item["key"]] = item["count"]
+                summary.errors[item["key"]] = 0
+            cur.execute("""
+                INSERT INTO topk_state (dimension, state, updated_at)
+                VALUES (%s, %s, CURRENT_TIMESTAMP)
+                ON CONFLICT (dimension) DO UPDATE
+                SET state = EXCLUDED.state, updated_at = CURRENT_TIMESTAMP
+            """, (dimension, summary.to_json()))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
@@ -0,0 +1,342 @@
+# tracing.py
+"""
+Lightweight request tracing.
+
+TracingMiddleware opens a root span per sampled request; span() opens
+children under whatever span is current, including inside threadpool
+handlers (contextvars are copied into run_in_threadpool). Connections
+from the pools use TracingCursor, so every statement becomes a "db.query"
+span, and pool checkout, template rendering and the response write are
+timed as well. The root span carries the totals (db.query_ms,
+db.pool_wait_ms, db.queries), which are also added to the access log
+record.
+
+Incoming W3C `traceparent` and Cloud Run `X-Cloud-Trace-Context` headers
+supply the trace id and the sampling decision; otherwise requests are
+sampled at TRACE_SAMPLE_RATE. Finished traces are exported from a
+background thread, either as JSON lines to TRACE_FILE or as OTLP/HTTP JSON
+posted to TRACE_OTLP_ENDPOINT. Unsampled requests cost one contextvar
+lookup per span site.
+"""
+import os
+import re
+import json
+import time
+import queue
+import random
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from logging_config import annotate
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "file").lower()
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "data-discovery-server")
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "1000"))
+# SQL text is truncated in span attributes; parameters are never recorded
+TRACE_MAX_STATEMENT = 500
+
+logger = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_CLOUD_TRACE = re.compile(r"^([0-9a-fA-F]{32})(?:/(\d+))?(?:;o=(\d))?")
+
+
+def new_id(nbytes: int) -> str:
+    return random.getrandbits(nbytes * 8).to_bytes(nbytes, "big").hex()
+
+
+class Trace:
+    """Spans of one request; appended to from the event loop and worker threads."""
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans = []
+        self.totals = {"db.queries": 0, "db.query_ms": 0.0, "db.pool_wait_ms": 0.0}
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+            if span.name == "db.query":
+                self.totals["db.queries"] += 1
+                self.totals["db.query_ms"] += span.duration_ms
+            elif span.name == "db.pool.checkout":
+                self.totals["db.pool_wait_ms"] += span.duration_ms
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attributes", "start_ns", "end_ns", "error")
+
+    def __init__(self, trace: Trace, name: str, parent_id: str = None, attributes: dict = None):
+        self.trace = trace
+        self.span_id = new_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes or {}
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.trace.add(self)
+
+    def to_dict(self):
+        entry = {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+        }
+        if self.error:
+            entry["error"] = self.error
+        return entry
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a block as a child of the current span; a no-op when not tracing."""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace, name, parent.span_id, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+
+def parse_trace_headers(headers: dict):
+    """Return (trace_id, parent_span_id, sampled) from incoming headers; sampled may be None."""
+    match = _TRACEPARENT.match(headers.get("traceparent", "").strip().lower())
+    if match:
+        trace_id, parent_id, flags = match.groups()
+        if trace_id != "0" * 32:
+            return trace_id, parent_id, bool(int(flags, 16) & 1)
+
+    match = _CLOUD_TRACE.match(headers.get("x-cloud-trace-context", "").strip())
+    if match:
+        trace_id, parent, option = match.groups()
+        parent_id = f"{int(parent):016x}"[-16:] if parent else None
+        sampled = None if option is None else option == "1"
+        return trace_id.lower(), parent_id, sampled
+
+    return None, None, None
+
+
+def normalize_statement(query) -> str:
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    return " ".join(str(query).split())[:TRACE_MAX_STATEMENT]
+
+
+_cursor_class = None
+
+# Callables taking the duration in seconds of every statement, traced or not
+QUERY_OBSERVERS = []
+
+
+def observe_query(seconds: float):
+    for observer in QUERY_OBSERVERS:
+        observer(seconds)
+
+
+def get_cursor_factory():
+    """psycopg2 cursor class that records a span per execute."""
+    global _cursor_class
+    if _cursor_class is None:
+        from psycopg2.extensions import cursor
+
+        class TracingCursor(cursor):
+            def execute(self, query, vars=None):
+                started = time.perf_counter()
+                try:
+                    if _current_span.get() is None:
+                        return super().execute(query, vars)
+                    with span("db.query", statement=normalize_statement(query)) as s:
+                        result = super().execute(query, vars)
+                        s.attributes["rows"] = self.rowcount
+                        return result
+                finally:
+                    observe_query(time.perf_counter() - started)
+
+            def executemany(self, query, vars_list):
+                started = time.perf_counter()
+                try:
+                    if _current_span.get() is None:
+                        return super().executemany(query, vars_list)
+                    with span("db.query", statement=normalize_statement(query), executemany=True) as s:
+                        result = super().executemany(query, vars_list)
+                        s.attributes["rows"] = self.rowcount
+                        return result
+                finally:
+                    observe_query(time.perf_counter() - started)
+
+        _cursor_class = TracingCursor
+    return _cursor_class
+
+
+# -----------------------------
+# Export
+# -----------------------------
+_export_queue = queue.Queue(TRACE_QUEUE_SIZE)
+_exporter = None
+_exporter_lock = threading.Lock()
+dropped_traces = 0
+
+
+def write_jsonl(spans):
+    with open(TRACE_FILE, "a", encoding="utf-8") as f:
+        for s in spans:
+            f.write(json.dumps(s.to_dict(), default=str) + "\n")
+
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def post_otlp(spans):
+    import urllib.request
+
+    payload = {"resourceSpans": [{
+        "resource": {"attributes": [
+            {"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}},
+        ]},
+        "scopeSpans": [{
+            "scope": {"name": "tracing"},
+            "spans": [{
+                "traceId": s.trace.trace_id,
+                "spanId": s.span_id,
+                "parentSpanId": s.parent_id or "",
+                "name": s.name,
+                "kind": 2 if s.parent_id is None else 1,
+                "startTimeUnixNano": str(s.start_ns),
+                "endTimeUnixNano": str(s.end_ns),
+                "attributes": [{"key": k, "value": otlp_value(v)} for k, v in s.attributes.items()],
+                "status": {"code": 2, "message": s.error} if s.error else {},
+            } for s in spans],
+        }],
+    }]}
+    req = urllib.request.Request(
+        TRACE_OTLP_ENDPOINT,
+        data=json.dumps(payload, default=str).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    urllib.request.urlopen(req, timeout=5).close()
+
+
+def _export_loop():
+    export = post_otlp if TRACE_EXPORT == "otlp" else write_jsonl
+    while True:
+        spans = _export_queue.get()
+        if spans is None:
+            return
+        try:
+            export(spans)
+        except Exception as e:
+            logger.warning("Trace export failed: %s", e)
+
+
+def export_trace(trace: Trace):
+    global _exporter, dropped_traces
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = threading.Thread(target=_export_loop, name="trace-exporter", daemon=True)
+                _exporter.start()
+    try:
+        _export_queue.put_nowait(list(trace.spans))
+    except queue.Full:
+        dropped_traces += 1
+
+
+def shutdown_tracing():
+    """Flush queued traces; call on application shutdown."""
+    global _exporter
+    if _exporter is not None:
+        _export_queue.put(None)
+        _exporter.join(timeout=5)
+        _exporter = None
+
+
+class TracingMiddleware:
+    """ASGI middleware opening the root span and timing the response write."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]}
+        trace_id, parent_id, sampled = parse_trace_headers(headers)
+        if sampled is None:
+            sampled = TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+        if not sampled:
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(trace_id or new_id(16))
+        root = Span(trace, f"{scope['method']} {scope['path']}", parent_id,
+                    {"http.method": scope["method"], "http.target": scope["path"]})
+        token = _current_span.set(root)
+        write = {}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                root.attributes["http.status_code"] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-trace-id", trace.trace_id.encode())]
+                write["span"] = Span(trace, "response.write", root.span_id)
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body") and "span" in write:
+                write.pop("span").end()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            root.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            if "span" in write:
+                write.pop("span").end()
+            totals = dict(trace.totals, **{
+                "db.query_ms": round(trace.totals["db.query_ms"], 2),
+                "db.pool_wait_ms": round(trace.totals["db.pool_wait_ms"], 2),
+            })
+            root.attributes.update(totals)
+            root.end()
+            annotate(trace_id=trace.trace_id, db_queries=totals["db.queries"],
+                     db_query_ms=totals["db.query_ms"], db_pool_wait_ms=totals["db.pool_wait_ms"])
+            export_trace(trace)
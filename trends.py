@@ -0,0 +1,218 @@
+# trends.py
+"""
+Time-bucketed finding counts by detection type and host.
+
+The ingest path calls update_trend_buckets() inside the same transaction as
+the pii_results insert, so the hourly/daily bucket tables never lag behind.
+refresh_trend_buckets() recounts a time range from pii_history (pii_results
+plus the archived rollups, see archive.py) and is
+used by the catch-up job for rows that arrive without going through the
+ingest path (bulk loads, back-dated timestamps, manual fixes). It applies
+the difference to each bucket rather than rewriting the tables, so ingest
+never waits on it; one worker at a time runs the catch-up.
+"""
+import os
+import argparse
+from datetime import datetime, timedelta
+
+TREND_TABLES = {
+    "hour": "pii_trend_hourly",
+    "day": "pii_trend_daily",
+}
+
+# How far back the catch-up job recomputes buckets on every run
+TREND_CATCHUP_DAYS = int(os.getenv("TREND_CATCHUP_DAYS", "2"))
+TREND_CATCHUP_INTERVAL = int(os.getenv("TREND_CATCHUP_INTERVAL", "900"))
+TREND_LOCK_KEY = 7240320
+
+
+def split_detected(detected):
+    """Split the comma-joined `detected` column into individual types."""
+    if not detected:
+        return []
+    return [d.strip() for d in detected.split(",") if d.strip()]
+
+
+def truncate_ts(ts: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def update_trend_buckets(cur, rows, sign: int = 1):
+    """
+    Increment bucket counts for freshly inserted rows (or decrement them
+    for deleted rows with sign=-1).
+
+    `rows` are (hostname, source, column_name, detected, timestamp) tuples,
+    the same shape that is written to pii_results.
+    """
+    for granularity, table in TREND_TABLES.items():
+        counts = {}
+        for hostname, _, _, detected, ts in rows:
+            bucket = truncate_ts(ts, granularity)
+            for d in split_detected(detected):
+                key = (bucket, hostname or "", d)
+                counts[key] = counts.get(key, 0) + sign
+
+        if not counts:
+            continue
+
+        # Sorted so concurrent ingests lock bucket rows in the same order
+        cur.executemany(f"""
+            INSERT INTO {table} (bucket, hostname, detected, count)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (bucket, hostname, detected)
+            DO UPDATE SET count = {table}.count + EXCLUDED.count
+        """, [(b, h, d, c) for (b, h, d), c in sorted(counts.items())])
+
+
+def refresh_trend_buckets(conn, since: datetime, until: datetime = None):
+    """
+    Recompute hourly and daily buckets for [since, until) from pii_history.
+
+    Each bucket is moved by (recount - stored count), both read from the
+    same snapshot, with count = count + delta. An upload committing
+    meanwhile either falls inside the snapshot on both sides or adds its
+    own increment on top, so nothing is lost or double counted, and the
+    bucket tables are never locked as a whole.
+    """
+    until = until or datetime.now() + timedelta(hours=1)
+    cur = conn.cursor()
+    try:
+        for granularity, table in TREND_TABLES.items():
+            start = truncate_ts(since, granularity)
+            # Ordered like update_trend_buckets() (code point order) so the
+            # two lock bucket rows in the same order
+            cur.execute(f"""
+                WITH fresh AS (
+                    SELECT date_trunc(%s, timestamp) AS bucket,
+                           COALESCE(hostname, '') AS hostname,
+                           trim(d) AS detected,
+                           SUM(n) AS count
+                    FROM pii_history,
+                         unnest(string_to_array(detected, ',')) AS d
+                    WHERE timestamp >= %s AND timestamp < %s
+                      AND trim(d) <> ''
+                    GROUP BY 1, 2, 3
+                ), stored AS (
+                    SELECT bucket, hostname, detected, count FROM {table}
+                    WHERE bucket >= %s AND bucket < %s
+                )
+                INSERT INTO {table} (bucket, hostname, detected, count)
+                SELECT COALESCE(f.bucket, s.bucket), COALESCE(f.hostname, s.hostname),
+                       COALESCE(f.detected, s.detected), COALESCE(f.count, 0) - COALESCE(s.count, 0)
+                FROM fresh f
+                FULL JOIN stored s
+                  ON s.bucket = f.bucket AND s.hostname = f.hostname AND s.detected = f.detected
+                WHERE COALESCE(f.count, 0) <> COALESCE(s.count, 0)
+                ORDER BY 1, 2 COLLATE "C", 3 COLLATE "C"
+                ON CONFLICT (bucket, hostname, detected)
+                DO UPDATE SET count = {table}.count + EXCLUDED.count
+            """, (granularity, start, until, start, until))
+            cur.execute(
+                f"DELETE FROM {table} WHERE bucket >= %s AND bucket < %s AND count = 0",
+                (start, until)
+            )
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def catch_up_trends(conn):
+    """Rebuild the trailing TREND_CATCHUP_DAYS window to absorb late data; one worker at a time."""
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (TREND_LOCK_KEY,))
+        locked = cur.fetchone()[0]
+        conn.commit()
+        if not locked:
+            return
+        try:
+            since = datetime.now() - timedelta(days=TREND_CATCHUP_DAYS)
+            refresh_trend_buckets(conn, since)
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (TREND_LOCK_KEY,))
+            conn.commit()
+    finally:
+        cur.close()
+
+
+def get_trend_series(conn, granularity: str = "day", days: int = 90,
+                     hostname: str = None, detected: str = None):
+    """
+    Return bucketed counts as chart-ready series.
+
+    Result shape:
+        {"granularity": "day", "buckets": [...iso strings...],
+         "series": {"email": [..counts aligned with buckets..], ...}}
+    """
+    if granularity not in TREND_TABLES:
+        raise ValueError(f"Unsupported granularity: {granularity}")
+    table = TREND_TABLES[granularity]
+    since = truncate_ts(datetime.now() - timedelta(days=days), granularity)
+
+    query = f"SELECT bucket, detected, SUM(count) FROM {table} WHERE bucket >= %s"
+    params = [since]
+    if hostname:
+        query += " AND hostname = %s"
+        params.append(hostname)
+    if detected:
+        query += " AND detected = %s"
+        params.append(detected)
+    query += " GROUP BY bucket, detected ORDER BY bucket"
+
+    cur = conn.cursor()
+    try:
+        cur.execute(query, params)
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+
+    # Every bucket in the range, so quiet hours/days show as zero instead
+    # of being bridged by the chart
+    step = timedelta(hours=1) if granularity == "hour" else timedelta(days=1)
+    last = truncate_ts(datetime.now(), granularity)
+    if rows:
+        last = max(last, rows[-1][0])
+    buckets = []
+    bucket = since
+    while bucket <= last:
+        buckets.append(bucket)
+        bucket += step
+    index = {b: i for i, b in enumerate(buckets)}
+    series = {}
+    for bucket, d, count in rows:
+        series.setdefault(d, [0] * len(buckets))[index[bucket]] = int(count)
+
+    return {
+        "granularity": granularity,
+        "buckets": [b.isoformat() for b in buckets],
+        "series": series,
+    }
+
+
+def main():
+    from db import init_db, get_db_connection, return_db_connection
+
+    parser = argparse.ArgumentParser(description="Rebuild PII trend buckets")
+    parser.add_argument("--days", type=int, default=TREND_CATCHUP_DAYS,
+                        help="Number of trailing days to recompute")
+    args = parser.parse_args()
+
+    init_db()
+    conn = get_db_connection()
+    try:
+        since = datetime.now() - timedelta(days=args.days)
+        print(f"Rebuilding trend buckets since {since.isoformat()}...")
+        refresh_trend_buckets(conn, since)
+        print("Trend buckets rebuilt successfully")
+    finally:
+        return_db_connection(conn)
+
+
+if __name__ == "__main__":
+    main()